@@ -1,2 +1,2 @@
 from .client import Resource
-from .dispatch import civitai_download, civitai_find_online, civitai_search_online
+from .dispatch import civitai_download, civitai_download_many, civitai_find_online, civitai_search_online
@@ -1,4 +1,7 @@
-from .http import get_session, configure_http_backend, ENDPOINT, OFFLINE_MODE, OfflineModeEnabled
+from .cache import configure_metadata_cache, get_metadata_cache, MetadataCache, CacheEntry
+from .http import get_session, configure_http_backend, configure_http_pool, configure_rate_limit, TokenBucket, \
+    ENDPOINT, OFFLINE_MODE, OfflineModeEnabled
 from .resource import find_version, find_resource, Resource, ResourceNotFound, ModelNotFound, ModelVersionNotFound, \
     ResourceDuplicated, ModelVersionDuplicated, ModelFoundDuplicated, find_model, find_model_by_name, find_model_by_id, \
-    find_version_id_by_hash, Model, list_models_by_name
+    find_version_id_by_hash, find_version_ids_by_hashes, Model, list_models_by_name, iter_models, \
+    ModelIndex
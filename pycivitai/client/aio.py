@@ -0,0 +1,296 @@
+"""
+Overview:
+    Asynchronous client of civitai.com's metadata API, based on `aiohttp <https://docs.aiohttp.org/>`_.
+
+    The functions here share the semantics and the exceptions of :mod:`pycivitai.client.resource`, so they can be
+    used as drop-in replacements inside of an event loop, e.g.
+
+    .. code:: python
+
+        import asyncio
+        from pycivitai.client.aio import find_model
+
+        async def main():
+            return await asyncio.gather(*(find_model(model_id) for model_id in [7240, 115427, 121604]))
+
+        print(asyncio.run(main()))
+
+    This module is an optional feature, please install it with ``pip install pycivitai[async]``.
+"""
+import asyncio
+import time
+import weakref
+from typing import AsyncIterator, Callable, Optional, Tuple, Union, List
+
+from .cache import get_metadata_cache, CacheEntry
+from .http import ENDPOINT, _send_throttled_async
+from ..utils.fastjson import json_loads
+from .resource import Model, ModelNotFound, _search_params, _filter_model_items, _select_unique_model, \
+    _maybe_a_hash, _by_hash_url, _version_file_by_hash, _next_page_url, _json_key
+
+try:
+    import aiohttp
+except (ModuleNotFoundError, ImportError):
+    aiohttp = None
+
+
+def _check_aiohttp():
+    if aiohttp is None:
+        raise OSError(
+            'Asynchronous client not available, '
+            'please install async extra with `pip install pycivitai[async]`.'
+        )
+
+
+#: Max number of simultaneous connections in the shared pool of each event loop.
+ASYNC_POOL_LIMIT = 100
+
+#: Max number of simultaneous connections to the same host in the shared pool of each event loop.
+ASYNC_POOL_LIMIT_PER_HOST = 100
+
+
+def _default_async_backend():
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=ASYNC_POOL_LIMIT, limit_per_host=ASYNC_POOL_LIMIT_PER_HOST),
+        raise_for_status=False,
+    )
+
+
+ASYNC_BACKEND_FACTORY_T = Callable[[], 'aiohttp.ClientSession']
+_GLOBAL_ASYNC_BACKEND_FACTORY: Optional[ASYNC_BACKEND_FACTORY_T] = None
+_SESSIONS: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]' = weakref.WeakKeyDictionary()
+
+
+def configure_async_backend(backend_factory: Optional[ASYNC_BACKEND_FACTORY_T] = None) -> None:
+    """
+    Configure the asynchronous HTTP backend by providing a ``backend_factory``, which is the asynchronous
+    counterpart of :func:`pycivitai.client.http.configure_http_backend`.
+
+    The factory is called at most once per event loop, and the created ``aiohttp.ClientSession`` (and its
+    connection pool) is shared by all the coroutines running on that loop. Sessions created by the previous
+    factory will be dropped, please close them with :func:`close_async_session` if needed.
+
+    :param backend_factory: Factory of ``aiohttp.ClientSession``. ``None`` means the default factory, which
+        creates a session with a pool of :data:`ASYNC_POOL_LIMIT` connections.
+    """
+    global _GLOBAL_ASYNC_BACKEND_FACTORY
+    _GLOBAL_ASYNC_BACKEND_FACTORY = backend_factory
+    _SESSIONS.clear()
+
+
+def get_async_session() -> 'aiohttp.ClientSession':
+    """
+    Get the shared ``aiohttp.ClientSession`` of the running event loop.
+
+    :return: The shared session, created with the factory set in :func:`configure_async_backend`.
+    :raises OSError: If ``aiohttp`` is not installed.
+    :raises RuntimeError: If there is no running event loop.
+    """
+    _check_aiohttp()
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = (_GLOBAL_ASYNC_BACKEND_FACTORY or _default_async_backend)()
+        _SESSIONS[loop] = session
+    return session
+
+
+async def close_async_session() -> None:
+    """
+    Close the shared session of the running event loop, it is recommended to call this before the loop exits.
+    """
+    session = _SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def _get_json(url: str, params: Optional[dict] = None, use_cache: bool = True) -> Optional[dict]:
+    """
+    Get JSON from metadata API, ``None`` will be returned when 404. The requests share the rate limit and retries
+    of :func:`pycivitai.client.configure_rate_limit` and the metadata cache with the synchronous client.
+    """
+    key = _json_key(url, params)
+    cache = get_metadata_cache() if use_cache else None
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None and entry.is_fresh(cache.ttl):
+        return entry.data
+
+    headers = {}
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry is not None and entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+
+    resp = await _send_throttled_async(get_async_session().get, url, params=params, headers=headers)
+    async with resp:
+        if resp.status == 304 and entry is not None:
+            entry.validated_at = time.time()
+            cache.put(key, entry)
+            return entry.data
+        elif resp.status == 404:
+            return None
+        else:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None, loads=json_loads)
+            if cache is not None:
+                cache.put(key, CacheEntry(
+                    url=str(resp.url), data=data,
+                    etag=resp.headers.get('ETag'),
+                    last_modified=resp.headers.get('Last-Modified'),
+                    validated_at=time.time(),
+                ))
+            return data
+
+
+async def find_model_by_id(model_id) -> dict:
+    """
+    Asynchronous version of :func:`pycivitai.client.resource.find_model_by_id`.
+
+    :param model_id: The ID of the model to retrieve information for.
+    :type model_id: int
+    :return: The dictionary containing the model information.
+    :rtype: dict
+    :raises ModelNotFound: If the model with the given ID is not found.
+    """
+    data = await _get_json(f'{ENDPOINT}/api/v1/models/{model_id}')
+    if data is None:
+        raise ModelNotFound(model_id)
+    else:
+        return data
+
+
+async def iter_models(query: Optional[str] = None, creator: Optional[str] = None, strict: bool = False,
+                      page_size: int = 100, prefetch: bool = True, use_cache: bool = False,
+                      keep_data: bool = True) -> AsyncIterator[Model]:
+    """
+    Asynchronous version of :func:`pycivitai.client.resource.iter_models`.
+
+    :param query: Text to search for. ``None`` means all the models.
+    :type query: Optional[str]
+    :param creator: Name of creator. ``None`` means anyone.
+    :type creator: Optional[str]
+    :param strict: Strict filter all the results or not. Default is ``False``.
+    :type strict: bool
+    :param page_size: Number of models in each page, at most ``100``. (default: 100)
+    :type page_size: int
+    :param prefetch: Fetch the next page in background while the current page is consumed. (default: True)
+    :type prefetch: bool
+    :param use_cache: Use the metadata cache for the pages or not. (default: False)
+    :type use_cache: bool
+    :param keep_data: Keep the whole model data in :attr:`Model.data` or not. (default: True)
+    :type keep_data: bool
+    :return: Asynchronous iterator of models.
+    :rtype: AsyncIterator[Model]
+    :raises ModelNotFound: If the search API responds with 404.
+    """
+    params = _search_params(query, creator)
+    params['limit'] = page_size
+    data = await _get_json(f'{ENDPOINT}/api/v1/models', params=params, use_cache=use_cache)
+    if data is None:
+        raise ModelNotFound(query)
+
+    task = None
+    try:
+        while data is not None:
+            next_page = _next_page_url(data)
+            task = asyncio.ensure_future(_get_json(next_page, use_cache=use_cache)) if prefetch and next_page else None
+
+            for item in _filter_model_items(data['items'], query, creator, strict):
+                yield Model(item, keep_data)
+
+            if task is not None:
+                data, task = await task, None
+            elif next_page:
+                data = await _get_json(next_page, use_cache=use_cache)
+            else:
+                data = None
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+async def list_models_by_name(model_name: str, creator: Optional[str] = None, strict: bool = False,
+                              all_pages: bool = False) -> List[dict]:
+    """
+    Asynchronous version of :func:`pycivitai.client.resource.list_models_by_name`.
+
+    :param model_name: The name of the model to retrieve information for.
+    :type model_name: str
+    :param creator: Name of creator. ``None`` means anyone.
+    :type creator: Optional[str]
+    :param strict: Strict filter all the results or not. Default is ``False``.
+    :type strict: bool
+    :param all_pages: Follow all the pages of the search result or not. Default is ``False``.
+    :type all_pages: bool
+    :return: The list of dictionaries containing the searched model information.
+    :rtype: dict
+    """
+    if all_pages:
+        return [model.data async for model in iter_models(model_name, creator, strict)]
+
+    data = await _get_json(f'{ENDPOINT}/api/v1/models', params=_search_params(model_name, creator))
+    if data is None:
+        raise ModelNotFound(model_name)
+    return _filter_model_items(data['items'], model_name, creator, strict)
+
+
+async def find_model_by_name(model_name: str, creator: Optional[str] = None) -> dict:
+    """
+    Asynchronous version of :func:`pycivitai.client.resource.find_model_by_name`.
+
+    :param model_name: The name of the model to retrieve information for.
+    :type model_name: str
+    :param creator: Name of creator. ``None`` means anyone.
+    :type creator: Optional[str]
+    :return: The dictionary containing the model information.
+    :rtype: dict
+    :raises ModelNotFound: If the model with the given name is not found.
+    :raises ModelFoundDuplicated: If multiple models with the same name are found.
+    """
+    collected_items = await list_models_by_name(model_name, creator, strict=True)
+    return _select_unique_model(collected_items, model_name)
+
+
+async def find_version_id_by_hash(model_hash: str) -> Optional[Tuple[int, int, str]]:
+    """
+    Asynchronous version of :func:`pycivitai.client.resource.find_version_id_by_hash`.
+
+    :param model_hash: Hash of the model file, such as SHA256, CRC32 or AutoV2.
+    :type model_hash: str
+    :return: Tuple of model id, version id and filename, ``None`` if not found.
+    :rtype: Optional[Tuple[int, int, str]]
+    """
+    if not _maybe_a_hash(model_hash):
+        return None
+
+    data = await _get_json(_by_hash_url(model_hash))
+    if data is None:
+        return None
+    else:
+        return _version_file_by_hash(data, model_hash)
+
+
+async def find_model(model_name_or_id: Union[int, str], creator: Optional[str] = None) -> dict:
+    """
+    Asynchronous version of :func:`pycivitai.client.resource.find_model`.
+
+    :param model_name_or_id: The name or ID of the model to retrieve information for.
+    :type model_name_or_id: Union[int, str]
+    :param creator: Name of creator. ``None`` means anyone.
+    :type creator: Optional[str]
+    :return: The dictionary containing the model information.
+    :rtype: dict
+    :raises TypeError: If the model name or ID is not a valid integer or string.
+    """
+    if isinstance(model_name_or_id, int):
+        return await find_model_by_id(model_name_or_id)
+    elif isinstance(model_name_or_id, str):
+        if creator is None:
+            try:
+                model_id = int(model_name_or_id)
+                return await find_model_by_id(model_id)
+            except (ModelNotFound, TypeError, ValueError):
+                pass
+        return await find_model_by_name(model_name_or_id, creator)
+    else:
+        raise TypeError(f'Unknown model name or id, it should be an integer or string - {model_name_or_id!r}.')
@@ -0,0 +1,201 @@
+"""
+Overview:
+    Two-tier (memory and disk) cache of the responses from civitai.com's metadata API.
+
+    Cached responses are used directly within their TTL. After that, they are revalidated with conditional
+    requests (``If-None-Match`` / ``If-Modified-Since``), so an unchanged payload only costs a ``304`` response.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, replace
+from typing import Optional, Any
+
+from ..utils.fastjson import json_loads, json_dumps
+
+
+@dataclass
+class CacheEntry:
+    """
+    Data class of cached response.
+    """
+    url: str
+    data: dict
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.validated_at < ttl
+
+
+def _copy_json(obj: Any) -> Any:
+    # faster than copy.deepcopy for the decoded JSON documents
+    if isinstance(obj, dict):
+        return {key: _copy_json(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [_copy_json(item) for item in obj]
+    else:
+        return obj
+
+
+class MetadataCache:
+    """
+    LRU cache in memory, backed by JSON files on disk.
+
+    The entries are copied when put and got, so the payloads modified by one caller never affect the others.
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl: float = 300.0, max_entries: int = 256,
+                 max_disk_entries: int = 4096):
+        """
+        :param directory: Directory of the disk cache, ``None`` means memory only.
+        :param ttl: Seconds before a cached response needs revalidation.
+        :param max_entries: Max number of entries kept in memory.
+        :param max_disk_entries: Max number of entries kept on disk, the least recently written ones are removed
+            when exceeded.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_puts = 0
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{hashlib.sha256(key.encode()).hexdigest()}.json')
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get the copy of cached entry of ``key``, no matter it is fresh or not.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return replace(entry, data=_copy_json(entry.data))
+
+        if self.directory:
+            try:
+                with open(self._entry_path(key), 'rb') as f:
+                    entry = CacheEntry(**json_loads(f.read()))
+            except (OSError, ValueError, TypeError):
+                return None
+
+            self._put_memory(key, replace(entry, data=_copy_json(entry.data)))
+            return entry
+        else:
+            return None
+
+    def _put_memory(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, entry: CacheEntry):
+        """
+        Put the copy of entry of ``key`` into both the memory and the disk. Failures of the disk (e.g. read-only
+        or full) are logged, and the entry is still kept in memory.
+        """
+        self._put_memory(key, replace(entry, data=_copy_json(entry.data)))
+        if self.directory:
+            path = self._entry_path(key)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(tmp_path, 'wb') as f:
+                    f.write(json_dumps(asdict(entry)))
+                os.replace(tmp_path, path)
+            except OSError as err:
+                logging.warning(f'Unable to write metadata cache {path!r}: {err!r}')
+                if os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                return
+
+            with self._lock:
+                self._disk_puts += 1
+                need_prune = self._disk_puts % max(1, self.max_disk_entries // 16) == 0
+            if need_prune:
+                self.prune()
+
+    def prune(self):
+        """
+        Remove the least recently written entries on disk, until no more than ``max_disk_entries`` are left.
+        """
+        if not self.directory:
+            return
+
+        try:
+            files = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        files.append((os.path.getmtime(path), path))
+                    except OSError:  # removed by the others
+                        pass
+        except OSError:
+            return
+
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_disk_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Clear the cached entries in memory. The files on disk are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+def _default_cache_dir() -> str:
+    return os.path.join(os.environ.get('CIVITAI_HOME', os.path.expanduser('~/.cache/civitai')), '.metadata')
+
+
+_GLOBAL_CACHE: Optional[MetadataCache] = None
+_GLOBAL_CACHE_CONFIGURED: bool = False
+
+
+def configure_metadata_cache(enabled: bool = True, directory: Optional[str] = None, ttl: float = 300.0,
+                             max_entries: int = 256, disk: bool = True, max_disk_entries: int = 4096) -> None:
+    """
+    Configure the cache of metadata API responses used by :mod:`pycivitai.client.resource`.
+
+    :param enabled: Enable the cache or not. (default: True)
+    :param directory: Directory of the disk cache, ``.metadata`` of ``CIVITAI_HOME`` is used by default.
+    :param ttl: Seconds within which the cached responses are used without any request,
+        revalidation will be performed after that. (default: 300)
+    :param max_entries: Max number of entries kept in memory. (default: 256)
+    :param disk: Enable the disk cache or not. (default: True)
+    :param max_disk_entries: Max number of entries kept on disk, the least recently written ones are removed
+        when exceeded. (default: 4096)
+    """
+    global _GLOBAL_CACHE, _GLOBAL_CACHE_CONFIGURED
+    if enabled:
+        _GLOBAL_CACHE = MetadataCache((directory or _default_cache_dir()) if disk else None, ttl, max_entries,
+                                      max_disk_entries)
+    else:
+        _GLOBAL_CACHE = None
+    _GLOBAL_CACHE_CONFIGURED = True
+
+
+def get_metadata_cache() -> Optional[MetadataCache]:
+    """
+    Get the cache of metadata API responses, ``None`` means disabled.
+    """
+    if not _GLOBAL_CACHE_CONFIGURED:
+        configure_metadata_cache()
+    return _GLOBAL_CACHE
@@ -1,10 +1,14 @@
+import asyncio
 import os
+import random
 import threading
-from functools import lru_cache
-from typing import Callable
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Tuple
 
 import requests
-
+from requests.adapters import HTTPAdapter, BaseAdapter
 
 ENDPOINT = 'https://civitai.com'
 OFFLINE_MODE = bool(os.environ.get('CIVITAI_OFFLINE'))
@@ -17,23 +21,300 @@ class OfflineModeEnabled(Exception):
     pass
 
 
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: Tokens refilled per second.
+        :param burst: Capacity of the bucket.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # take one token if available, or return the seconds to wait for it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Take one token, block until it is available.
+        """
+        while True:
+            wait_time = self._reserve()
+            if not wait_time:
+                return
+            time.sleep(wait_time)
+
+    async def acquire_async(self):
+        """
+        Take one token, wait in the event loop until it is available. The tokens are shared with :meth:`acquire`.
+        """
+        while True:
+            wait_time = self._reserve()
+            if not wait_time:
+                return
+            await asyncio.sleep(wait_time)
+
+
+@dataclass
+class _RateLimit:
+    bucket: Optional[TokenBucket]
+    retries: int
+    backoff_factor: float
+    backoff_max: float
+    retry_statuses: Tuple[int, ...]
+    retry_after_max: Optional[float] = None
+
+
+_GLOBAL_RATE_LIMIT = _RateLimit(bucket=None, retries=5, backoff_factor=1.0, backoff_max=60.0,
+                                retry_statuses=(429, 503))
+
+
+def configure_rate_limit(rate: Optional[float] = None, burst: int = 1, retries: int = 5,
+                         backoff_factor: float = 1.0, backoff_max: float = 60.0,
+                         retry_statuses: Tuple[int, ...] = (429, 503),
+                         retry_after_max: Optional[float] = None) -> None:
+    """
+    Configure the process-wide rate limit of the requests to civitai.com's API.
+
+    Requests to ``{ENDPOINT}/api/`` from the sessions of :func:`get_session` and from :mod:`pycivitai.client.aio`
+    take a token from one shared bucket before they are sent. Responses with status in ``retry_statuses`` are
+    retried after the time given by their ``Retry-After`` header, or after an exponential backoff with jitter
+    when it is absent.
+
+    :param rate: Requests allowed per second, ``None`` means unlimited. (default: None)
+    :param burst: Max number of requests allowed in burst. (default: 1)
+    :param retries: Max times to retry. (default: 5)
+    :param backoff_factor: The ``n``-th retry waits for ``backoff_factor * 2 ** n`` seconds plus a random jitter
+        in ``[0, backoff_factor)``. (default: 1.0)
+    :param backoff_max: Max seconds of the exponential backoff. (default: 60.0)
+    :param retry_statuses: HTTP statuses to retry. (default: ``(429, 503)``)
+    :param retry_after_max: Max seconds to wait for ``Retry-After``, ``None`` means always waiting as long as
+        the server asks. When the server asks for longer, the response is returned without retrying, instead of
+        retrying too early. (default: None)
+
+    Example::
+        >>> from pycivitai.client import configure_rate_limit
+        >>> configure_rate_limit(rate=2, burst=5)  # 2 requests per second, with 5 in burst
+    """
+    global _GLOBAL_RATE_LIMIT
+    _GLOBAL_RATE_LIMIT = _RateLimit(
+        bucket=TokenBucket(rate, burst) if rate else None,
+        retries=retries,
+        backoff_factor=backoff_factor,
+        backoff_max=backoff_max,
+        retry_statuses=tuple(retry_statuses),
+        retry_after_max=retry_after_max,
+    )
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _retry_delay(limit: _RateLimit, status: int, headers, attempt: int) -> Optional[float]:
+    # seconds to wait before the next attempt, None means the response should be returned
+    if status not in limit.retry_statuses or attempt >= limit.retries:
+        return None
+
+    delay = _retry_after(headers)
+    if delay is None:
+        delay = min(limit.backoff_factor * (2 ** attempt + random.random()), limit.backoff_max)
+    elif limit.retry_after_max is not None and delay > limit.retry_after_max:
+        return None  # a retry earlier than asked would be rejected again
+    return delay
+
+
+def _send_throttled(send: Callable[..., requests.Response], request, **kwargs) -> requests.Response:
+    # send with the process-wide rate limit and retries configured by configure_rate_limit
+    attempt = 0
+    while True:
+        limit = _GLOBAL_RATE_LIMIT
+        if limit.bucket is not None:
+            limit.bucket.acquire()
+        response = send(request, **kwargs)
+        delay = _retry_delay(limit, response.status_code, response.headers, attempt)
+        if delay is None:
+            return response
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def _send_throttled_async(send: Callable[..., Awaitable], *args, **kwargs):
+    # asynchronous version of _send_throttled for aiohttp, sharing the same bucket and retries
+    attempt = 0
+    while True:
+        limit = _GLOBAL_RATE_LIMIT
+        if limit.bucket is not None:
+            await limit.bucket.acquire_async()
+        response = await send(*args, **kwargs)
+        delay = _retry_delay(limit, response.status, response.headers, attempt)
+        if delay is None:
+            return response
+        response.release()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+class _ThrottledAdapter(HTTPAdapter):
+    """
+    Adapter applying the process-wide rate limit configured by :func:`configure_rate_limit`.
+    """
+
+    def send(self, request, **kwargs):
+        return _send_throttled(super().send, request, **kwargs)
+
+
+class _ThrottledWrapper(BaseAdapter):
+    """
+    Wrapper applying the process-wide rate limit to the adapter customized by the backend factory.
+    """
+
+    def __init__(self, adapter: BaseAdapter):
+        super().__init__()
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        return _send_throttled(self.adapter.send, request, **kwargs)
+
+    def close(self):
+        self.adapter.close()
+
+
+class _ConnectionPool:
+    """
+    Adapters (and their connection pools) shared by the sessions of all the threads.
+    """
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, pool_block: bool, keep_alive: bool,
+                 recycle: Optional[float]):
+        self.keep_alive = keep_alive
+        self.recycle = recycle
+        self.created_at = time.monotonic()
+        kwargs = dict(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.adapter = HTTPAdapter(**kwargs)
+        self.api_adapter = _ThrottledAdapter(**kwargs)
+
+    @property
+    def expired(self) -> bool:
+        return self.recycle is not None and time.monotonic() - self.created_at > self.recycle
+
+    def mount(self, session: requests.Session):
+        # adapters customized by the backend factory (i.e. not plain HTTPAdapter) are kept
+        for prefix in ('https://', 'http://'):
+            if type(session.adapters.get(prefix)) is HTTPAdapter:
+                session.mount(prefix, self.adapter)
+        # the api adapter customized by the backend factory is wrapped, so it is still used and throttled
+        api_prefix = f'{ENDPOINT}/api/'
+        api_adapter = session.get_adapter(api_prefix)
+        if type(api_adapter) is HTTPAdapter:
+            session.mount(api_prefix, self.api_adapter)
+        elif not isinstance(api_adapter, (_ThrottledAdapter, _ThrottledWrapper)):
+            session.mount(api_prefix, _ThrottledWrapper(api_adapter))
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+    def close(self):
+        self.adapter.close()
+        self.api_adapter.close()
+
+
+_POOL_OPTIONS = dict(pool_connections=10, pool_maxsize=64, pool_block=False, keep_alive=True, recycle=None)
+_POOL_LOCK = threading.Lock()
+_POOL: Optional[_ConnectionPool] = None
+_LOCAL = threading.local()
+
+
+def configure_http_pool(pool_connections: int = 10, pool_maxsize: int = 64, pool_block: bool = False,
+                        keep_alive: bool = True, recycle: Optional[float] = None) -> None:
+    """
+    Configure the connection pool shared by the sessions of :func:`get_session`.
+
+    :param pool_connections: Number of hosts to keep connection pools for. (default: 10)
+    :param pool_maxsize: Max number of connections kept alive for each host, it should be no less than the number
+        of threads sending requests concurrently. (default: 64)
+    :param pool_block: Block when no free connection is available, instead of creating a new one which will not
+        be kept alive. (default: False)
+    :param keep_alive: Keep the connections alive or not. (default: True)
+    :param recycle: Seconds after which the pool is dropped and recreated, ``None`` means never. (default: None)
+
+    Example::
+        >>> from pycivitai.client import configure_http_pool
+        >>> configure_http_pool(pool_maxsize=256)  # for 256 worker threads
+    """
+    global _POOL
+    _POOL_OPTIONS.update(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block,
+                         keep_alive=keep_alive, recycle=recycle)
+    with _POOL_LOCK:
+        old_pool, _POOL = _POOL, None
+    if old_pool is not None:
+        old_pool.close()
+
+
+def _get_pool() -> _ConnectionPool:
+    global _POOL
+    with _POOL_LOCK:
+        old_pool = None
+        if _POOL is None or _POOL.expired:
+            old_pool, _POOL = _POOL, _ConnectionPool(**_POOL_OPTIONS)
+        pool = _POOL
+
+    if old_pool is not None:
+        old_pool.close()
+    return pool
+
+
+def _reset_after_fork():
+    # connections of the parent process must not be shared with the child process
+    global _POOL, _POOL_LOCK, _LOCAL
+    _POOL_LOCK = threading.Lock()
+    _POOL = None
+    _LOCAL = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
 def configure_http_backend(backend_factory: BACKEND_FACTORY_T = requests.Session) -> None:
     """
-    Configure the HTTP backend by providing a `backend_factory`. Any HTTP calls made by `huggingface_hub` will use a
+    Configure the HTTP backend by providing a `backend_factory`. Any HTTP calls made by `pycivitai` will use a
     Session object instantiated by this factory. This can be useful if you are running your scripts in a specific
     environment requiring custom configuration (e.g. custom proxy or certifications).
 
     Use [`get_session`] to get a configured Session. Since `requests.Session` is not guaranteed to be thread-safe,
-    `huggingface_hub` creates 1 Session instance per thread. They are all instantiated using the same `backend_factory`
-    set in [`configure_http_backend`]. A LRU cache is used to cache the created sessions (and connections) between
-    calls. Max size is 128 to avoid memory leaks if thousands of threads are spawned.
+    `pycivitai` creates 1 Session instance per thread. They are all instantiated using the same `backend_factory`
+    set in [`configure_http_backend`], and share the same connection pool configured by [`configure_http_pool`].
 
     See [this issue](https://github.com/psf/requests/issues/2766) to know more about thread-safety in `requests`.
 
     Example:
     ```py
     import requests
-    from huggingface_hub import configure_http_backend, get_session
+    from pycivitai.client import configure_http_backend, get_session
 
     # Create a factory function that returns a Session with configured proxies
     def backend_factory() -> requests.Session:
@@ -44,13 +325,12 @@ def configure_http_backend(backend_factory: BACKEND_FACTORY_T = requests.Session
     # Set it as the default session factory
     configure_http_backend(backend_factory=backend_factory)
 
-    # In practice, this is mostly done internally in `huggingface_hub`
+    # In practice, this is mostly done internally in `pycivitai`
     session = get_session()
     ```
     """
     global _GLOBAL_BACKEND_FACTORY
     _GLOBAL_BACKEND_FACTORY = backend_factory
-    _get_session_from_cache.cache_clear()
 
 
 def get_session() -> requests.Session:
@@ -58,16 +338,19 @@ def get_session() -> requests.Session:
     Get a `requests.Session` object, using the session factory from the user.
 
     Use [`get_session`] to get a configured Session. Since `requests.Session` is not guaranteed to be thread-safe,
-    `huggingface_hub` creates 1 Session instance per thread. They are all instantiated using the same `backend_factory`
-    set in [`configure_http_backend`]. A LRU cache is used to cache the created sessions (and connections) between
-    calls. Max size is 128 to avoid memory leaks if thousands of threads are spawned.
+    `pycivitai` creates 1 Session instance per thread, which lives as long as the thread. They are all instantiated
+    using the same `backend_factory` set in [`configure_http_backend`]. Their plain `HTTPAdapter` are replaced with
+    the adapters of one process-wide connection pool (see [`configure_http_pool`]), so the connections are reused
+    across the threads, while the customized adapters are kept. The pool is reinitialized in the child processes
+    after `fork`. Requests to the API are sent with the rate limit configured by [`configure_rate_limit`], through
+    the customized adapter if there is one.
 
     See [this issue](https://github.com/psf/requests/issues/2766) to know more about thread-safety in `requests`.
 
     Example:
     ```py
     import requests
-    from huggingface_hub import configure_http_backend, get_session
+    from pycivitai.client import configure_http_backend, get_session
 
     # Create a factory function that returns a Session with configured proxies
     def backend_factory() -> requests.Session:
@@ -78,18 +361,14 @@ def get_session() -> requests.Session:
     # Set it as the default session factory
     configure_http_backend(backend_factory=backend_factory)
 
-    # In practice, this is mostly done internally in `huggingface_hub`
+    # In practice, this is mostly done internally in `pycivitai`
     session = get_session()
     ```
     """
-    return _get_session_from_cache(thread_ident=threading.get_ident())
-
-
-@lru_cache(maxsize=128)  # default value for Python>=3.8. Let's keep the same for Python3.7
-def _get_session_from_cache(thread_ident: int) -> requests.Session:
-    """
-    Create a new session per thread using global factory. Using LRU cache (maxsize 128) to avoid memory leaks when
-    using thousands of threads. Cache is cleared when `configure_http_backend` is called.
-    """
-    _ = thread_ident
-    return _GLOBAL_BACKEND_FACTORY()
+    pool = _get_pool()
+    local = _LOCAL
+    if getattr(local, 'pool', None) is not pool or getattr(local, 'factory', None) is not _GLOBAL_BACKEND_FACTORY:
+        session = _GLOBAL_BACKEND_FACTORY()
+        pool.mount(session)
+        local.session, local.pool, local.factory = session, pool, _GLOBAL_BACKEND_FACTORY
+    return local.session
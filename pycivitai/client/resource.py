@@ -1,10 +1,17 @@
-import fnmatch
+import os
 import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Union, Optional, List, Tuple
-from urllib.parse import quote_plus
+from typing import Union, Optional, List, Tuple, Dict, Iterable, Iterator
+from urllib.parse import quote_plus, urlencode
 
+from .cache import get_metadata_cache, CacheEntry, _copy_json
 from .http import get_session, ENDPOINT
+from .singleflight import SingleFlight
+from ..utils.fastjson import json_loads
+from ..utils.pattern import compile_pattern, FilePatternTyping
 
 
 class ModelNotFound(Exception):
@@ -32,20 +39,21 @@ class ResourceDuplicated(Exception):
 
 
 class Model:
-    def __init__(self, data):
-        self.data = data
-
-    @property
-    def model_name(self) -> str:
-        return self.data['name']
-
-    @property
-    def model_id(self) -> int:
-        return self.data['id']
-
-    @property
-    def creator(self) -> str:
-        return self.data['creator']['username']
+    """
+    Compact record of model, created from the model data.
+    """
+    __slots__ = ('model_name', 'model_id', 'creator', 'data')
+
+    def __init__(self, data: dict, keep_data: bool = True):
+        """
+        :param data: The model data.
+        :param keep_data: Keep the whole model data in :attr:`data` or not. Only the name, id and creator
+            are kept when ``False``, which saves lots of memory when crawling models. (default: True)
+        """
+        self.model_name: str = data['name']
+        self.model_id: int = data['id']
+        self.creator: str = sys.intern(data['creator']['username'])
+        self.data: Optional[dict] = data if keep_data else None
 
     def __repr__(self):
         return (f'<{self.__class__.__name__} name: {self.model_name!r}, '
@@ -56,7 +64,13 @@ class Model:
 class Resource:
     """
     Data class for resource.
+
+    The records are slotted, and the strings of :attr:`tags` and the names in :attr:`hashes` are interned,
+    so they are shared by all the resources instead of kept once per payload.
     """
+    __slots__ = ('model_name', 'model_id', 'creator', 'version_name', 'version_id', 'filename', 'is_primary',
+                 'url', 'sha256', 'crc32', 'hashes', 'size', 'tags')
+
     model_name: str
     model_id: int
     creator: str
@@ -67,11 +81,168 @@ class Resource:
     url: str
     sha256: str
     crc32: str
-    hashes: dict
+    hashes: Dict[str, str]
     size: int
     tags: List[str]
 
 
+class ModelIndex:
+    """
+    Index of the model data, built once from a model payload, so that the versions and files
+    can be looked up without scanning them.
+    """
+
+    def __init__(self, model_data: dict):
+        """
+        :param model_data: The model data containing version information.
+        """
+        self.data = model_data
+        self.versions: List[dict] = model_data['modelVersions']
+        self._positions = None
+        self._versions_by_id = None
+        self._versions_by_name = None
+        self._files = {}
+
+    def _build_version_tables(self):
+        # built on the first lookup, the latest version can be selected without indexing all of them
+        positions, versions_by_id, versions_by_name = {}, {}, {}
+        for position, vitem in enumerate(self.versions):
+            if vitem['id'] not in versions_by_id:
+                versions_by_id[vitem['id']] = vitem
+                positions[vitem['id']] = position
+            versions_by_name.setdefault(_name_strip(vitem['name']), []).append(vitem)
+        self._positions, self._versions_by_name = positions, versions_by_name
+        self._versions_by_id = versions_by_id
+
+    def _get_version_by_id(self, version_id) -> Optional[dict]:
+        if self._versions_by_id is None:
+            self._build_version_tables()
+        return self._versions_by_id.get(version_id)
+
+    @classmethod
+    def of(cls, model_data: Union[dict, 'ModelIndex']) -> 'ModelIndex':
+        """
+        Get the index of the given model data. The index is not cached globally, keep it together with
+        the payload (like the managers do) to look up the same payload repeatedly without rebuilding it.
+
+        :param model_data: The model data, or its index.
+        :type model_data: Union[dict, ModelIndex]
+        :return: Index of the model data.
+        :rtype: ModelIndex
+        """
+        if isinstance(model_data, ModelIndex):
+            return model_data
+        else:
+            return cls(model_data)
+
+    def find_versions(self, version: Union[int, str]) -> List[dict]:
+        """
+        Find the versions whose id is ``version``, or whose normalized name equals to the normalized ``version``.
+
+        :param version: The version ID or name to find.
+        :type version: Union[int, str]
+        :return: Matched versions without duplicated ids, in the order of the model data.
+        :rtype: List[dict]
+        """
+        matched = {}
+        if self._get_version_by_id(version) is not None:
+            matched[version] = self._versions_by_id[version]
+        for vitem in self._versions_by_name.get(_name_strip(str(version)), []):
+            matched.setdefault(vitem['id'], vitem)
+        return sorted(matched.values(), key=lambda x: self._positions[x['id']])
+
+    def _file_index(self, version_data: dict) -> Tuple[Dict[str, List[dict]], List[dict]]:
+        version_id = version_data['id']
+        indexed = self._get_version_by_id(version_id) is version_data
+        if indexed and version_id in self._files:
+            return self._files[version_id]
+
+        files_by_name, primary_files = {}, []
+        for file in version_data['files']:
+            files_by_name.setdefault(os.path.normcase(file['name']), []).append(file)
+            if file.get('primary'):
+                primary_files.append(file)
+        file_index = (files_by_name, primary_files)
+        if indexed:
+            self._files[version_id] = file_index
+        return file_index
+
+    def find_files(self, version_data: dict, pattern: Optional[FilePatternTyping] = None) -> List[dict]:
+        """
+        Find the files of the version.
+
+        :param version_data: The version data containing resource information.
+        :type version_data: dict
+        :param pattern: The pattern to match the resource filename, see :func:`pycivitai.utils.compile_pattern`.
+            If None, the primary files will be chosen.
+        :type pattern: Optional[FilePatternTyping]
+        :return: Matched files, in the order of the version data.
+        :rtype: List[dict]
+        """
+        files_by_name, primary_files = self._file_index(version_data)
+        if pattern is None:
+            return list(primary_files)
+        elif isinstance(pattern, str) and not _has_glob_magic(pattern):
+            return list(files_by_name.get(os.path.normcase(pattern), []))
+        else:
+            file_pattern = compile_pattern(pattern)
+            return [file for file in version_data['files'] if file_pattern.match(file['name'])]
+
+
+def _has_glob_magic(pattern: str) -> bool:
+    return re.search(r'[*?\[]', pattern) is not None
+
+
+_IN_FLIGHT = SingleFlight(copy=_copy_json)
+
+
+def _json_key(url: str, params: Optional[dict] = None) -> str:
+    return f'{url}?{urlencode(sorted((params or {}).items()))}'
+
+
+def _get_json(url: str, params: Optional[dict] = None, use_cache: bool = True) -> Optional[dict]:
+    """
+    Get JSON from metadata API through the metadata cache, ``None`` will be returned when 404.
+    Concurrent calls of the same request share one in-flight HTTP request, each of them gets its own copy.
+    """
+    key = _json_key(url, params)
+    # the cached and uncached calls are not merged, or the uncached ones may fill the cache
+    return _IN_FLIGHT.do((key, use_cache), _get_json_uncoalesced, key, url, params, use_cache)
+
+
+def _get_json_uncoalesced(key: str, url: str, params: Optional[dict] = None,
+                          use_cache: bool = True) -> Optional[dict]:
+    cache = get_metadata_cache() if use_cache else None
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None and entry.is_fresh(cache.ttl):
+        return entry.data
+
+    headers = {}
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    if entry is not None and entry.last_modified:
+        headers['If-Modified-Since'] = entry.last_modified
+
+    resp = get_session().get(url, params=params, headers=headers)
+    if resp.status_code == 304 and entry is not None:
+        entry.validated_at = time.time()
+        cache.put(key, entry)
+        return entry.data
+    elif resp.status_code == 404:
+        return None
+    else:
+        resp.raise_for_status()
+        data = json_loads(resp.content)
+        if cache is not None:
+            cache.put(key, CacheEntry(
+                url=resp.url, data=data,
+                etag=resp.headers.get('ETag'),
+                last_modified=resp.headers.get('Last-Modified'),
+                validated_at=time.time(),
+            ))
+        return data
+
+
 def find_model_by_id(model_id) -> dict:
     """
     Retrieve model information from the CiviTAI API based on the given model ID.
@@ -82,23 +253,22 @@ def find_model_by_id(model_id) -> dict:
     :rtype: dict
     :raises ModelNotFound: If the model with the given ID is not found.
     """
-    resp = get_session().get(f'{ENDPOINT}/api/v1/models/{model_id}')
-    if resp.ok:
-        return resp.json()
+    data = _get_json(f'{ENDPOINT}/api/v1/models/{model_id}')
+    if data is None:
+        raise ModelNotFound(model_id)
     else:
-        if resp.status_code == 404:
-            raise ModelNotFound(model_id)
-        else:
-            resp.raise_for_status()
+        return data
 
 
 def _name_strip(name: str) -> str:
     return re.sub(r'[\W_]+', '', name.lower())
 
 
-def list_models_by_name(model_name: str, creator: Optional[str] = None, strict: bool = False) -> List[dict]:
+def list_models_by_name(model_name: str, creator: Optional[str] = None, strict: bool = False,
+                        all_pages: bool = False) -> List[dict]:
     """
     Retrieve model information from the CiviTAI API based on the given model name.
+    Only the first page of the search result is collected unless ``all_pages`` is enabled.
 
     :param model_name: The name of the model to retrieve information for.
     :type model_name: str
@@ -106,25 +276,110 @@ def list_models_by_name(model_name: str, creator: Optional[str] = None, strict:
     :type creator: Optional[str]
     :param strict: Strict filter all the results or not. Default is ``False``.
     :type strict: bool
+    :param all_pages: Follow all the pages of the search result with :func:`iter_models` or not,
+        this may take many requests for a common name. Default is ``False``.
+    :type all_pages: bool
     :return: The list of dictionaries containing the searched model information.
     :rtype: dict
     """
-    _session = get_session()
-    params = {'query': model_name}
+    if all_pages:
+        return [model.data for model in iter_models(model_name, creator, strict)]
+
+    data = _get_json(f'{ENDPOINT}/api/v1/models', params=_search_params(model_name, creator))
+    if data is None:
+        raise ModelNotFound(model_name)
+    return _filter_model_items(data['items'], model_name, creator, strict)
+
+
+def _search_params(model_name: Optional[str], creator: Optional[str] = None) -> dict:
+    params = {}
+    if model_name:
+        params['query'] = model_name
     if creator:
         params['username'] = creator
+    return params
 
-    resp = _session.get(f'{ENDPOINT}/api/v1/models', params=params)
-    resp.raise_for_status()
+
+def _filter_model_items(items: List[dict], model_name: Optional[str], creator: Optional[str] = None,
+                        strict: bool = False) -> List[dict]:
     collected_items = []
-    for item in resp.json()['items']:
-        if not strict or (_name_strip(item['name']) == _name_strip(model_name) and
+    for item in items:
+        if not strict or ((model_name is None or _name_strip(item['name']) == _name_strip(model_name)) and
                           (creator is None or _name_strip(item['creator']['username']) == _name_strip(creator))):
             collected_items.append(item)
 
     return collected_items
 
 
+def _next_page_url(data: dict) -> Optional[str]:
+    return (data.get('metadata') or {}).get('nextPage')
+
+
+def iter_models(query: Optional[str] = None, creator: Optional[str] = None, strict: bool = False,
+                page_size: int = 100, prefetch: bool = True, use_cache: bool = False,
+                keep_data: bool = True) -> Iterator[Model]:
+    """
+    Iterate over the models searched from the CiviTAI API, following the ``nextPage`` of all the pages.
+
+    Only the current page (and the next page when ``prefetch`` is enabled) is kept in memory, so this can be
+    used to crawl the whole result set, e.g.
+
+    .. code:: python
+
+        from pycivitai.client import iter_models
+
+        for model in iter_models('arknights'):
+            print(model)
+
+    :param query: Text to search for. ``None`` means all the models.
+    :type query: Optional[str]
+    :param creator: Name of creator. ``None`` means anyone.
+    :type creator: Optional[str]
+    :param strict: Strict filter all the results or not. Default is ``False``.
+    :type strict: bool
+    :param page_size: Number of models in each page, at most ``100``. (default: 100)
+    :type page_size: int
+    :param prefetch: Fetch the next page in background while the current page is consumed. (default: True)
+    :type prefetch: bool
+    :param use_cache: Use the metadata cache for the pages or not. It is disabled by default, so crawling
+        a large result set does not flood the cache. (default: False)
+    :type use_cache: bool
+    :param keep_data: Keep the whole model data in :attr:`Model.data` or not, disable this when crawling
+        a large result set to keep the memory bounded. (default: True)
+    :type keep_data: bool
+    :return: Iterator of models.
+    :rtype: Iterator[Model]
+    :raises ModelNotFound: If the search API responds with 404.
+    """
+    params = _search_params(query, creator)
+    params['limit'] = page_size
+    data = _get_json(f'{ENDPOINT}/api/v1/models', params=params, use_cache=use_cache)
+    if data is None:
+        raise ModelNotFound(query)
+
+    pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        while data is not None:
+            next_page = _next_page_url(data)
+            if pool is not None and next_page:
+                future = pool.submit(_get_json, next_page, use_cache=use_cache)
+            else:
+                future = None
+
+            for item in _filter_model_items(data['items'], query, creator, strict):
+                yield Model(item, keep_data)
+
+            if future is not None:
+                data = future.result()
+            elif next_page:
+                data = _get_json(next_page, use_cache=use_cache)
+            else:
+                data = None
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
 def find_model_by_name(model_name: str, creator: Optional[str] = None) -> dict:
     """
     Retrieve model information from the CiviTAI API based on the given model name.
@@ -139,6 +394,10 @@ def find_model_by_name(model_name: str, creator: Optional[str] = None) -> dict:
     :raises ModelFoundDuplicated: If multiple models with the same name are found.
     """
     collected_items = list_models_by_name(model_name, creator, strict=True)
+    return _select_unique_model(collected_items, model_name)
+
+
+def _select_unique_model(collected_items: List[dict], model_name: str) -> dict:
     if not collected_items:
         raise ModelNotFound(model_name)
     elif len(collected_items) > 1:
@@ -156,21 +415,74 @@ def find_version_id_by_hash(model_hash: str) -> Optional[Tuple[int, int, str]]:
     if not _maybe_a_hash(model_hash):
         return None
 
-    resp = get_session().get(f'{ENDPOINT}/api/v1/model-versions/by-hash/{quote_plus(model_hash.upper())}')
-    if resp.status_code == 404:
+    data = _get_json(_by_hash_url(model_hash))
+    if data is None:
         return None
     else:
-        resp.raise_for_status()
-        data = resp.json()
-        version_file = None
-        for file in data['files']:
-            if model_hash.upper() in set((file.get('hashes') or {}).values()):
-                version_file = file['name']
-                break
+        return _version_file_by_hash(data, model_hash)
+
+
+def _by_hash_url(model_hash: str) -> str:
+    return f'{ENDPOINT}/api/v1/model-versions/by-hash/{quote_plus(model_hash.upper())}'
 
-        assert version_file is not None, f'No file in model version {data["id"]!r} ' \
-                                         f'matches the given hash {model_hash!r}.'
-        return data['modelId'], data['id'], version_file
+
+def _match_file_by_hash(data: dict, model_hash: str) -> Optional[str]:
+    for file in data['files']:
+        if model_hash.upper() in set((file.get('hashes') or {}).values()):
+            return file['name']
+
+    return None
+
+
+def _version_file_by_hash(data: dict, model_hash: str) -> Tuple[int, int, str]:
+    version_file = _match_file_by_hash(data, model_hash)
+    assert version_file is not None, f'No file in model version {data["id"]!r} ' \
+                                     f'matches the given hash {model_hash!r}.'
+    return data['modelId'], data['id'], version_file
+
+
+def _find_versions_by_hashes_chunk(hashes: List[str]) -> Dict[str, Tuple[int, int, str]]:
+    resp = get_session().post(f'{ENDPOINT}/api/v1/model-versions/by-hash', json=hashes)
+    resp.raise_for_status()
+    retval = {}
+    for data in json_loads(resp.content):
+        for model_hash in hashes:
+            if model_hash not in retval:
+                version_file = _match_file_by_hash(data, model_hash)
+                if version_file is not None:
+                    retval[model_hash] = (data['modelId'], data['id'], version_file)
+
+    return retval
+
+
+def find_version_ids_by_hashes(hashes: Iterable[str], chunk_size: int = 100, max_workers: int = 4) \
+        -> Dict[str, Optional[Tuple[int, int, str]]]:
+    """
+    Find the model versions of multiple hashes, with the batch API of CiviTAI.
+
+    :param hashes: Hashes of the model files, such as SHA256, CRC32 or AutoV2.
+    :type hashes: Iterable[str]
+    :param chunk_size: Number of hashes in each request. (default: 100)
+    :type chunk_size: int
+    :param max_workers: Max number of requests sent concurrently. (default: 4)
+    :type max_workers: int
+    :return: Dictionary from each given hash to the tuple of model id, version id and filename,
+        ``None`` if not found. The files are matched in the same way as :func:`find_version_id_by_hash`.
+    :rtype: Dict[str, Optional[Tuple[int, int, str]]]
+    """
+    hashes = list(hashes)
+    upper_hashes = list(dict.fromkeys(h.upper() for h in hashes if _maybe_a_hash(h)))
+    chunks = [upper_hashes[i:i + chunk_size] for i in range(0, len(upper_hashes), chunk_size)]
+
+    found = {}
+    if len(chunks) == 1:
+        found.update(_find_versions_by_hashes_chunk(chunks[0]))
+    elif chunks:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for chunk_result in pool.map(_find_versions_by_hashes_chunk, chunks):
+                found.update(chunk_result)
+
+    return {h: found.get(h.upper()) if _maybe_a_hash(h) else None for h in hashes}
 
 
 def find_model(model_name_or_id: Union[int, str], creator: Optional[str] = None) -> dict:
@@ -199,12 +511,12 @@ def find_model(model_name_or_id: Union[int, str], creator: Optional[str] = None)
         raise TypeError(f'Unknown model name or id, it should be an integer or string - {model_name_or_id!r}.')
 
 
-def find_version(model_data: dict, version: Union[int, str, None] = None):
+def find_version(model_data: Union[dict, ModelIndex], version: Union[int, str, None] = None):
     """
     Find the specified version from the model data.
 
-    :param model_data: The model data containing version information.
-    :type model_data: dict
+    :param model_data: The model data containing version information, or its :class:`ModelIndex`.
+    :type model_data: Union[dict, ModelIndex]
     :param version: The version ID or name to find. If None, the first version will be chosen.
     :type version: Union[int, str, None]
     :return: The dictionary containing the selected version information.
@@ -213,56 +525,48 @@ def find_version(model_data: dict, version: Union[int, str, None] = None):
     :raises ModelVersionDuplicated: If multiple versions with the same ID or name are found.
     """
     # find chosen version
-    versions = model_data['modelVersions']
+    index = ModelIndex.of(model_data)
     if version is None:
-        select_version = versions[0]
+        select_version = index.versions[0]
     else:
-        all_select_versions = []
-        exist_ids = set()
-        for vitem in versions:
-            if (vitem['id'] == version or _name_strip(vitem['name']) == _name_strip(str(version))) \
-                    and vitem['id'] not in exist_ids:
-                all_select_versions.append(vitem)
-                exist_ids.add(vitem['id'])
-
+        all_select_versions = index.find_versions(version)
         if not all_select_versions:
-            raise ModelVersionNotFound(model_data['name'], version)
+            raise ModelVersionNotFound(index.data['name'], version)
         elif len(all_select_versions) > 1:
-            raise ModelVersionDuplicated(model_data['name'], [vitem['name'] for vitem in all_select_versions])
+            raise ModelVersionDuplicated(index.data['name'], [vitem['name'] for vitem in all_select_versions])
         else:
             select_version = all_select_versions[0]
 
     return select_version
 
 
-def find_resource(model_data: dict, version_data: dict, pattern: str = None):
+def find_resource(model_data: Union[dict, ModelIndex], version_data: dict, pattern: FilePatternTyping = None):
     """
     Find the specified resource from the model and version data.
 
-    :param model_data: The model data containing version information.
-    :type model_data: dict
+    :param model_data: The model data containing version information, or its :class:`ModelIndex`.
+    :type model_data: Union[dict, ModelIndex]
     :param version_data: The version data containing resource information.
     :type version_data: dict
-    :param pattern: The pattern to match the resource filename. If None, the primary resource will be chosen.
-    :type pattern: str
+    :param pattern: The pattern to match the resource filename, which can be a glob, a list of globs or a compiled
+        regular expression. If None, the primary resource will be chosen.
+    :type pattern: FilePatternTyping
     :return: The resource information.
     :rtype: Resource
-    :raises TypeError: If the pattern of the resource is not a valid string.
+    :raises TypeError: If the pattern of the resource is not a valid pattern.
     :raises ResourceNotFound: If the specified resource is not found.
     :raises ResourceDuplicated: If multiple resources with the same name are found.
     """
     # find chosen resource
     if pattern is None:
         pattern, primary = '*', True
-    elif isinstance(pattern, str):
-        primary = False
     else:
-        raise TypeError(f'Pattern of resource should be a string, but {pattern!r} found.')
+        compile_pattern(pattern)  # raise TypeError for invalid patterns
+        primary = False
 
-    all_select_files = []
-    for file in version_data['files']:
-        if (primary and file.get('primary')) or (not primary and fnmatch.fnmatch(file['name'], pattern)):
-            all_select_files.append(file)
+    index = ModelIndex.of(model_data)
+    model_data = index.data
+    all_select_files = index.find_files(version_data, None if primary else pattern)
     if not all_select_files:
         raise ResourceNotFound(model_data['name'], version_data['name'], {'pattern': pattern, 'primary': primary})
     elif len(all_select_files) > 1:
@@ -273,16 +577,17 @@ def find_resource(model_data: dict, version_data: dict, pattern: str = None):
     file_size = select_file['sizeKB'] * 1024
     assert abs(round(file_size) - file_size) < 1e-4
     file_size = int(round(file_size))
+    hashes = {sys.intern(name): value for name, value in select_file['hashes'].items()}
     return Resource(
         model_name=model_data['name'], model_id=model_data['id'],
-        creator=model_data['creator']['username'],
+        creator=sys.intern(model_data['creator']['username']),
         version_name=version_data['name'], version_id=version_data['id'],
         filename=select_file['name'],
         url=select_file['downloadUrl'],
-        sha256=select_file['hashes'].get('SHA256'),
-        crc32=select_file['hashes'].get('CRC32'),
-        hashes=select_file['hashes'],
+        sha256=hashes.get('SHA256'),
+        crc32=hashes.get('CRC32'),
+        hashes=hashes,
         is_primary=select_file.get('primary', False),
         size=file_size,
-        tags=model_data['tags'],
+        tags=[sys.intern(tag) for tag in model_data['tags']],
     )
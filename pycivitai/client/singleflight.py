@@ -0,0 +1,65 @@
+"""
+Overview:
+    Coalescing of concurrent identical calls, in the style of Go's ``singleflight``.
+"""
+import threading
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+_T = TypeVar('_T')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution, and all of them get its result or exception.
+    """
+
+    def __init__(self, copy: Optional[Callable[[_T], _T]] = None):
+        """
+        :param copy: Function to copy the result for the waiting calls, so that the mutable result is not shared
+            between the callers. ``None`` means the same result is returned to all of them.
+        """
+        self._copy = copy
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., _T], *args, **kwargs) -> _T:
+        """
+        Execute ``fn(*args, **kwargs)``, or wait for the in-flight execution with the same ``key``.
+
+        :param key: Key of the call.
+        :param fn: Function to execute.
+        :return: Result of the execution.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as err:
+                call.error = err
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        elif not leader and self._copy is not None:
+            return self._copy(call.result)
+        else:
+            return call.result
@@ -1,11 +1,15 @@
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Union, Optional, List
+from typing import Union, Optional, List, Tuple, Iterable, Hashable
+
+from hbutils.scale import size_to_bytes
 
 from .client import find_model, find_version, find_resource, Resource, find_version_id_by_hash, Model, \
-    list_models_by_name
+    iter_models, ModelIndex
 from .manager import DispatchManager
+from .utils import FilePatternTyping, AggregatedProgress
 
 
 @lru_cache()
@@ -28,11 +32,17 @@ def _get_global_manager(offline: bool):
     :return: The global DispatchManager instance.
     :rtype: DispatchManager
     """
-    return DispatchManager(_get_storage_dir(), offline)
+    return DispatchManager(
+        _get_storage_dir(), offline,
+        ttl=float(os.environ.get('CIVITAI_TTL') or 0.0),
+        stale_while_revalidate=float(os.environ.get('CIVITAI_STALE_WHILE_REVALIDATE') or 0.0),
+        max_size=size_to_bytes(os.environ['CIVITAI_MAX_SIZE']) if os.environ.get('CIVITAI_MAX_SIZE') else None,
+        eviction=os.environ.get('CIVITAI_EVICTION') or 'lru',
+    )
 
 
 def civitai_download(model: Union[str, int], version: Union[str, int, None] = None,
-                     file: str = None, creator: Optional[str] = None, offline: bool = False):
+                     file: FilePatternTyping = None, creator: Optional[str] = None, offline: bool = False):
     """
     Download and get the local file path of the specified model file.
 
@@ -40,8 +50,9 @@ def civitai_download(model: Union[str, int], version: Union[str, int, None] = No
     :type model: Union[str, int]
     :param version: The version ID or name of the model version. If None, the latest version is used.
     :type version: Union[str, int, None]
-    :param file: The pattern or name of the file to get. If None, the primary file will be returned.
-    :type file: str
+    :param file: The pattern or name of the file to get, which can be a glob, a list of globs or
+        a compiled regular expression. If None, the primary file will be returned.
+    :type file: FilePatternTyping
     :param creator: Name of creator. ``None`` means anyone.
     :type creator: Optional[str]
     :param offline: If True, the manager operates in offline mode, using locally downloaded resources.
@@ -52,8 +63,123 @@ def civitai_download(model: Union[str, int], version: Union[str, int, None] = No
     return _get_global_manager(offline).get_file(model, version, file, creator=creator)
 
 
-def civitai_find_online(model: Union[str, int], version: Union[str, int, None] = None, file: str = None,
-                        creator: Optional[str] = None) -> Resource:
+#: Default number of the files downloaded at the same time by :func:`civitai_download_many`.
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+DownloadSpecTyping = Union[str, int, tuple, list, dict]
+
+
+def _parse_download_spec(spec: DownloadSpecTyping) \
+        -> Tuple[Union[str, int], Union[str, int, None], FilePatternTyping, Optional[str]]:
+    """
+    Parse the spec of :func:`civitai_download_many` into ``(model, version, file, creator)``.
+    """
+    if isinstance(spec, dict):
+        unknown = set(spec.keys()) - {'model', 'version', 'file', 'creator'}
+        if 'model' not in spec or unknown:
+            raise ValueError(f'Invalid download spec, key \'model\' is required and only \'version\', '
+                             f'\'file\' and \'creator\' are allowed, but {spec!r} found.')
+        return spec['model'], spec.get('version'), spec.get('file'), spec.get('creator')
+    elif isinstance(spec, (tuple, list)):
+        if not 1 <= len(spec) <= 4:
+            raise ValueError(f'Invalid download spec, (model, version, file, creator) expected but {spec!r} found.')
+        model, version, file, creator = (*spec, None, None, None)[:4]
+        return model, version, file, creator
+    else:
+        return spec, None, None, None
+
+
+def _download_spec_key(model, version, file, creator) -> Hashable:
+    # the identical specs are downloaded only once
+    if isinstance(file, list):
+        file = tuple(file)
+    return model, version, file, creator
+
+
+def civitai_download_many(specs: Iterable[DownloadSpecTyping], max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                          executor: Optional[ThreadPoolExecutor] = None, offline: bool = False,
+                          silent: bool = False) -> List[Union[str, Exception]]:
+    """
+    Download several model files concurrently, and get their local file paths.
+
+    The identical specs are downloaded only once. For each of them, the metadata is resolved and the file
+    is downloaded in the pool, the progress of all the downloads is displayed in one progress bar.
+
+    :param specs: Specs of the files. Each of them can be a model name or ID, a tuple of
+        ``(model, version, file, creator)`` (the trailing ones can be omitted), or a dict with the keys
+        ``model``, ``version``, ``file`` and ``creator``. Their meanings are the same as :func:`civitai_download`.
+    :type specs: Iterable[DownloadSpecTyping]
+    :param max_workers: Max number of the files resolved and downloaded at the same time, ignored when
+        ``executor`` is given. (default: 4)
+    :type max_workers: int
+    :param executor: Thread pool to run the downloads, which is not shut down after that. A thread pool of
+        ``max_workers`` is used by default. Process pools are not supported, because the downloads share
+        the manager and the progress bar of this process.
+    :type executor: Optional[ThreadPoolExecutor]
+    :param offline: If True, the manager operates in offline mode, using locally downloaded resources.
+    :type offline: bool
+    :param silent: Whether to silence the progress bar. (default: False)
+    :type silent: bool
+    :return: The local paths of the files in the order of ``specs``. The exception is placed instead of the path
+        when failed, so one failed item does not affect the others.
+    :rtype: List[Union[str, Exception]]
+    :raises ValueError: If any of the specs is invalid.
+    :raises TypeError: If ``executor`` is not a thread pool.
+
+    Example::
+        >>> from pycivitai import civitai_download_many
+        >>> civitai_download_many([
+        ...     'amiya arknights (old)',
+        ...     ('mutsuki', 'v1.0', '*.pt'),
+        ...     {'model': 7240, 'version': 'Meina V11'},
+        ... ])
+        ['/root/.cache/civitai/amiya_arknights_old__narugo1992__115427/v1_1__124885/files/amiya.pt', ...]
+    """
+    if executor is not None and not isinstance(executor, ThreadPoolExecutor):
+        raise TypeError(f'Executor of downloads should be a {ThreadPoolExecutor.__name__}, '
+                        f'but {executor!r} found.')
+
+    manager = _get_global_manager(offline)
+    items = [_parse_download_spec(spec) for spec in specs]
+    keys = [_download_spec_key(*item) for item in items]
+    unique_items = {}
+    for key, item in zip(keys, items):
+        unique_items.setdefault(key, item)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        with AggregatedProgress(len(unique_items), desc='Downloading', silent=silent) as progress:
+            def _download(model, version, file, creator):
+                with progress.attach():
+                    return manager.get_file(model, version, file, creator=creator)
+
+            futures = {}
+            for key, item in unique_items.items():
+                futures[key] = executor.submit(_download, *item)
+                futures[key].add_done_callback(progress.finish_item)
+
+            results = {}
+            try:
+                for key, future in futures.items():
+                    try:
+                        results[key] = future.result()
+                    except Exception as err:
+                        results[key] = err
+            except BaseException:  # e.g. interrupted, the downloads not started yet are cancelled
+                for future in futures.values():
+                    future.cancel()
+                raise
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+    return [results[key] for key in keys]
+
+
+def civitai_find_online(model: Union[str, int], version: Union[str, int, None] = None,
+                        file: FilePatternTyping = None, creator: Optional[str] = None) -> Resource:
     """
     Find the online model resource (file) information from civitai.com.
 
@@ -61,8 +187,9 @@ def civitai_find_online(model: Union[str, int], version: Union[str, int, None] =
     :type model: Union[str, int]
     :param version: The version ID or name of the model version. If None, the latest version is used.
     :type version: Union[str, int, None]
-    :param file: The pattern or name of the file to find. If None, the primary file will be returned.
-    :type file: str
+    :param file: The pattern or name of the file to find, which can be a glob, a list of globs or
+        a compiled regular expression. If None, the primary file will be returned.
+    :type file: FilePatternTyping
     :param creator: Name of creator. ``None`` means anyone.
     :type creator: Optional[str]
     :return: The Resource object containing the information about the specified model file.
@@ -77,19 +204,19 @@ def civitai_find_online(model: Union[str, int], version: Union[str, int, None] =
             warnings.warn(f'Model {model!r} founded by hash, value of file argument ({file!r}) will be ignored.')
         model, version, file = new_model, new_version, new_file
 
-    model_data = find_model(model, creator)
-    version_data = find_version(model_data, version)
-    return find_resource(model_data, version_data, file)
+    model_index = ModelIndex.of(find_model(model, creator))
+    version_data = find_version(model_index, version)
+    return find_resource(model_index, version_data, file)
 
 
 def civitai_search_online(model_name: str, creator: Optional[str] = None) -> List[Model]:
     """
     Overview:
-        Search from civitai site.
+        Search from civitai site, all the pages of the search result are collected.
 
     :param model_name: The name of the model to retrieve information for.
     :type model_name: str
     :param creator: Name of creator. ``None`` means anyone.
     :type creator: Optional[str]
     """
-    return list(map(Model, list_models_by_name(model_name, creator, strict=False)))
+    return list(iter_models(model_name, creator, strict=False))
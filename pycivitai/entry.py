@@ -3,7 +3,7 @@ import os
 from functools import partial
 
 import click
-from hbutils.scale import size_to_bytes_str
+from hbutils.scale import size_to_bytes_str, size_to_bytes
 from hbutils.string import plural_word
 
 from .dispatch import _get_global_manager, civitai_download
@@ -50,6 +50,21 @@ def _confirm(text):  # pragma: no cover
     return inquirer.confirm(text).execute()
 
 
+def _group_usage(manager):
+    # usage of the models and their versions, the largest first
+    models = {}
+    for model_dir, version_dir, files, size in manager.list_usage():
+        model_name, _, model_id = os.path.basename(model_dir).split('__')
+        version_name, version_id = os.path.basename(version_dir).split('__')
+        models.setdefault((model_name, int(model_id)), []).append((version_name, int(version_id), files, size))
+
+    retval = []
+    for (model_name, model_id), versions in models.items():
+        versions = sorted(versions, key=lambda x: (-x[3], x[0], x[1]))
+        retval.append((model_name, model_id, sum(x[2] for x in versions), sum(x[3] for x in versions), versions))
+    return sorted(retval, key=lambda x: (-x[3], x[0], x[1]))
+
+
 @cli.command('delete-cache', context_settings={**GLOBAL_CONTEXT_SETTINGS},
              help='Delete downloaded models from storage.')
 @click.option('-A', '--all', 'delete_all', is_flag=True, type=bool, default=False,
@@ -76,32 +91,21 @@ def delete_cache(delete_all):
             from InquirerPy.separator import Separator
 
             choices = []
-            for model in manager.list_models():
-                model_dir = model.root_dir
-                model_name, model_creator, model_id = os.path.basename(model_dir).split('__')
-
-                model_total_size, model_files = 0, 0
+            for model_name, model_id, model_files, model_size, versions in _group_usage(manager):
                 model_choices = []
-                for version in model.list_versions():
-                    version_dir = version.root_dir
-                    version_name, version_id = os.path.basename(version_dir).split('__')
-                    files = version.list_files()
-                    total_size = sum([file.size for file in files])
-
-                    if len(files) > 0:
-                        model_files += len(files)
-                        model_total_size += total_size
+                for version_name, version_id, files, size in versions:
+                    if files > 0:
                         model_choices.append(Choice(
-                            (model.model_name_or_id, version.version, len(files), total_size),
-                            name=f'{version_name}(ID: {version_id}, {plural_word(len(files), "file")}, '
-                                 f'size: {size_to_bytes_str(total_size, precision=3)})',
+                            (model_id, version_id, files, size),
+                            name=f'{version_name}(ID: {version_id}, {plural_word(files, "file")}, '
+                                 f'size: {size_to_bytes_str(size, precision=3)})',
                             enabled=False
                         ))
 
                 if model_choices:
                     choices.extend([
                         Separator(f'Model {model_name}(ID: {model_id}, {plural_word(model_files, "file")}, '
-                                  f'size: {size_to_bytes_str(model_total_size, precision=3)}):'),
+                                  f'size: {size_to_bytes_str(model_size, precision=3)}):'),
                         *model_choices,
                         Separator('')
                     ])
@@ -116,14 +120,38 @@ def delete_cache(delete_all):
                               f'{plural_word(files_to_delete, "file")} will be deleted, '
                               f'{size_to_bytes_str(size_to_delete, precision=3)} of disk usage '
                               f'will be released, confirm?'):
-                    for model_name, version_name, _, _ in versions_to_detect:
-                        manager.delete_version(model_name, version_name)
+                    for model_id, version_id, _, _ in versions_to_detect:
+                        manager.delete_version(model_id, version_id)
                     click.echo(click.style('Deletion complete!', fg='green'))
 
             else:
                 click.echo(click.style('No models found to delete.', fg='yellow'))
 
 
+@cli.command('du', context_settings={**GLOBAL_CONTEXT_SETTINGS},
+             help='Show the disk usage of downloaded models, the largest first.')
+@click.option('--models-only', '-M', 'models_only', is_flag=True, type=bool, default=False,
+              help='Show the models only, without their versions.', show_default=True)
+def du(models_only):
+    manager = _get_global_manager(offline=True)
+    usage = _group_usage(manager)
+    total_versions, total_files, total_size = 0, 0, 0
+    for model_name, model_id, model_files, model_size, versions in usage:
+        click.echo(f'Model {model_name}(ID: {model_id}, {plural_word(model_files, "file")}, '
+                   f'size: {size_to_bytes_str(model_size, precision=3)})')
+        if not models_only:
+            for version_name, version_id, files, size in versions:
+                click.echo(f'    {version_name}(ID: {version_id}, {plural_word(files, "file")}, '
+                           f'size: {size_to_bytes_str(size, precision=3)})')
+
+        total_versions += len(versions)
+        total_files += model_files
+        total_size += model_size
+
+    click.echo(f'Total {plural_word(len(usage), "model")}, {plural_word(total_versions, "version")} and '
+               f'{plural_word(total_files, "file")}, size: {size_to_bytes_str(total_size, precision=3)}.')
+
+
 @cli.command('get', context_settings={**GLOBAL_CONTEXT_SETTINGS},
              help='Delete downloaded models from storage.')
 @click.option('--model', '-m', 'model', type=str, required=True,
@@ -138,3 +166,51 @@ def delete_cache(delete_all):
               help='Offline mode. Default is disabled.', show_default=True)
 def get_(model, creator, version, file, offline):
     click.echo(civitai_download(model, version, file, creator=creator, offline=offline))
+
+
+@cli.command('rebuild', context_settings={**GLOBAL_CONTEXT_SETTINGS},
+             help='Rebuild the catalog of downloaded models from storage.')
+def rebuild():
+    manager = _get_global_manager(offline=True)
+    manager.rebuild_catalog()
+    models = manager.list_models()
+    versions = sum(len(model.list_versions()) for model in models)
+    click.echo(f'Catalog rebuilt, {plural_word(len(models), "model")} and '
+               f'{plural_word(versions, "version")} found.')
+
+
+@cli.command('gc', context_settings={**GLOBAL_CONTEXT_SETTINGS},
+             help='Evict the least used model versions until the storage fits in the given size. '
+                  'Versions of the pinned models are never evicted.')
+@click.option('--max-size', '-s', 'max_size', type=str, required=True,
+              help='Max total size of the downloaded files, such as 50GiB.')
+@click.option('--policy', '-p', 'policy', type=click.Choice(['lru', 'lfu']), default='lru',
+              help='Eviction policy, least recently used (lru) or least frequently used (lfu) first.',
+              show_default=True)
+def gc(max_size, policy):
+    manager = _get_global_manager(offline=True)
+    evicted, released = manager.enforce_quota(size_to_bytes(max_size), policy)
+    click.echo(f'{plural_word(len(evicted), "version")} evicted, '
+               f'{size_to_bytes_str(released, precision=3)} released.')
+
+
+@cli.command('pin', context_settings={**GLOBAL_CONTEXT_SETTINGS},
+             help='Pin the downloaded model, so it will never be evicted.')
+@click.option('--model', '-m', 'model', type=str, required=True,
+              help='Title or id of the model.')
+@click.option('--creator', '-c', 'creator', type=str, default=None,
+              help='Creator of the model.', show_default=True)
+def pin(model, creator):
+    _get_global_manager(offline=True).pin_model(model, creator)
+    click.echo(f'Model {model!r} pinned.')
+
+
+@cli.command('unpin', context_settings={**GLOBAL_CONTEXT_SETTINGS},
+             help='Unpin the downloaded model.')
+@click.option('--model', '-m', 'model', type=str, required=True,
+              help='Title or id of the model.')
+@click.option('--creator', '-c', 'creator', type=str, default=None,
+              help='Creator of the model.', show_default=True)
+def unpin(model, creator):
+    _get_global_manager(offline=True).unpin_model(model, creator)
+    click.echo(f'Model {model!r} unpinned.')
@@ -1,3 +1,5 @@
+from .blobs import BlobStore
+from .catalog import Catalog
 from .dispatch import DispatchManager, LocalModelNotFound, LocalModelDuplicated
 from .model import ModelManager, LocalVersionNotFound, LocalVersionDuplicated
 from .version import VersionManager, LocalFileDuplicated, LocalFileNotFound, LocalPrimaryFileUnset, LocalFile
@@ -1,5 +1,114 @@
+import os
+import pathlib
 import re
+from typing import Optional, Tuple, List
+
+from ..utils.fastjson import json_loads, json_dumps
+
+#: Filename of the metadata snapshot in the version directory.
+SNAPSHOT_FILENAME = 'metadata.json'
+
+#: Filename of the marker in the directory of pinned model.
+PINNED_FILENAME = '.pinned'
+
+_SNAPSHOT_MODEL_KEYS = ('id', 'name', 'type', 'nsfw', 'tags')
+_SNAPSHOT_VERSION_KEYS = ('id', 'modelId', 'name', 'baseModel', 'createdAt', 'trainedWords')
+_SNAPSHOT_FILE_KEYS = ('id', 'name', 'type', 'primary', 'sizeKB', 'downloadUrl', 'hashes')
 
 
 def _soft_name_strip(name: str) -> str:
     return re.sub(r'[\W_]+', '_', name.lower()).strip('_')
+
+
+def _atomic_write_text(path: str, text: str):
+    """
+    Write text file atomically, readers will see either the old content or the new one.
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _parse_model_dirname(dirname: str) -> Optional[Tuple[str, str, int]]:
+    """
+    Parse the directory name ``<model_name>__<creator>__<model_id>`` of model.
+    """
+    segs = dirname.split('__')
+    if len(segs) == 3 and segs[2].isdigit():
+        model_name, creator, model_id = segs
+        return model_name, creator, int(model_id)
+    else:
+        return None
+
+
+def _parse_version_dirname(dirname: str) -> Optional[Tuple[str, int]]:
+    """
+    Parse the directory name ``<version_name>__<version_id>`` of version.
+    """
+    segs = dirname.split('__')
+    if len(segs) == 2 and segs[1].isdigit():
+        version_name, version_id = segs
+        return version_name, int(version_id)
+    else:
+        return None
+
+
+def _read_primary(path: str) -> Optional[str]:
+    """
+    Read the name of primary file recorded in ``path``, ``None`` if not set.
+    """
+    if os.path.exists(path):
+        lines = pathlib.Path(path).read_text(encoding='utf-8').splitlines(keepends=False)
+        return lines[0] if lines and lines[0] else None
+    else:
+        return None
+
+
+def _pick(data: dict, keys: Tuple[str, ...]) -> dict:
+    return {key: data[key] for key in keys if key in data}
+
+
+def _snapshot_model_data(model_data: dict, version_data: dict) -> str:
+    """
+    Trim the model data to the fields used for resolution, with the given version only.
+    """
+    return json_dumps({
+        **_pick(model_data, _SNAPSHOT_MODEL_KEYS),
+        'creator': {'username': model_data['creator']['username']},
+        'modelVersions': [{
+            **_pick(version_data, _SNAPSHOT_VERSION_KEYS),
+            'files': [_pick(file, _SNAPSHOT_FILE_KEYS) for file in version_data['files']],
+        }],
+    }).decode('utf-8')
+
+
+def _read_snapshot(path: str) -> Optional[str]:
+    """
+    Read the metadata snapshot saved in ``path``, ``None`` if not saved.
+    """
+    if os.path.exists(path):
+        return pathlib.Path(path).read_text(encoding='utf-8')
+    else:
+        return None
+
+
+def _merge_snapshots(snapshots: List[str]) -> Optional[dict]:
+    """
+    Merge the metadata snapshots of the versions into one model data, the versions are sorted from the latest
+    one like civitai.com does, and the fields of model are taken from the latest one. ``None`` if no valid snapshot.
+    """
+    items = []
+    for snapshot in snapshots:
+        try:
+            items.append(json_loads(snapshot))
+        except ValueError:
+            continue
+
+    if not items:
+        return None
+    items = sorted(items, key=lambda x: -x['modelVersions'][0]['id'])
+    versions = {}
+    for item in items:
+        versions.setdefault(item['modelVersions'][0]['id'], item['modelVersions'][0])
+    return {**items[0], 'modelVersions': list(versions.values())}
@@ -0,0 +1,160 @@
+"""
+Overview:
+    Content-addressed store of the downloaded files, shared by all the models and versions managed by
+    :class:`pycivitai.manager.DispatchManager`.
+
+    Each file is stored once in ``.blobs`` of the root directory, keyed by its SHA256, and the ``files``
+    directories of versions are hardlinked (or symlinked, when hardlinks are not supported) to it. So the same
+    file used by several models or versions is downloaded and stored only once.
+"""
+import json
+import os
+import shutil
+import threading
+from typing import Optional, Dict, Iterable
+
+from filelock import FileLock
+
+from .catalog import Catalog
+
+#: Directory name of the blob store in the root directory of storage.
+BLOBS_DIRNAME = '.blobs'
+
+
+class BlobStore:
+    """
+    Content-addressed store of files, keyed by SHA256.
+    """
+
+    def __init__(self, root_dir: str):
+        """
+        :param root_dir: Directory of the blob store.
+        """
+        self.root_dir = root_dir
+        self._d_locks = os.path.join(self.root_dir, 'locks')
+
+    def blob_path(self, sha256: str) -> str:
+        """
+        Get the path of blob.
+
+        :param sha256: SHA256 of the file.
+        :return: Path of the blob, which may not exist.
+        """
+        sha256 = sha256.upper()
+        return os.path.join(self.root_dir, 'sha256', sha256[:2], sha256)
+
+    def _digests_path(self, sha256: str) -> str:
+        return f'{self.blob_path(sha256)}.json'
+
+    def lock(self, sha256: str) -> FileLock:
+        """
+        Lock of blob, which should be held when linking to or releasing the blob.
+
+        :param sha256: SHA256 of the file.
+        :return: File lock of the blob.
+        """
+        os.makedirs(self._d_locks, exist_ok=True)
+        return FileLock(os.path.join(self._d_locks, f'{sha256.upper()}.lock'))
+
+    def get(self, sha256: str, size: Optional[int] = None) -> Optional[Dict[str, str]]:
+        """
+        Get the digests of blob, if it is stored.
+
+        :param sha256: SHA256 of the file.
+        :param size: Expected size of the file, the blob of another size is treated as not stored.
+        :return: Hex digests of the blob, keyed by the names used by civitai.com. ``None`` if not stored.
+        """
+        blob_path, digests_path = self.blob_path(sha256), self._digests_path(sha256)
+        if not os.path.exists(blob_path) or not os.path.exists(digests_path):
+            return None
+        if size is not None and os.path.getsize(blob_path) != size:
+            return None
+
+        try:
+            with open(digests_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def put(self, src: str, digests: Dict[str, str]) -> str:
+        """
+        Move the file into the store, the file should have been verified.
+
+        :param src: Path of the file, it will be moved into the store.
+        :param digests: Hex digests of the file, with ``SHA256`` included.
+        :return: Path of the blob.
+        """
+        sha256 = digests['SHA256']
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(src, blob_path)
+        tmp_path = f'{self._digests_path(sha256)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(digests, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self._digests_path(sha256))
+        return blob_path
+
+    def link(self, sha256: str, dst: str):
+        """
+        Link the blob to ``dst``, which is replaced atomically if exists. Hardlink is preferred, relative symlink
+        is used when hardlinks are not supported (e.g. across filesystems), and the blob is copied when neither
+        of them is supported.
+
+        :param sha256: SHA256 of the file.
+        :param dst: Path of the link.
+        """
+        blob_path = self.blob_path(sha256)
+        tmp_path = f'{dst}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(blob_path, os.path.dirname(os.path.abspath(dst))), tmp_path)
+            except OSError:
+                shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def remove(self, sha256: str):
+        """
+        Remove the blob from the store.
+
+        :param sha256: SHA256 of the file.
+        """
+        for path in (self._digests_path(sha256), self.blob_path(sha256)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def release(self, hashes: Iterable[str], catalog: Catalog) -> int:
+        """
+        Remove the blobs no longer used by any file in the catalog.
+
+        :param hashes: SHA256 of the files deleted.
+        :param catalog: Catalog of the local model store.
+        :return: Number of the blobs removed.
+        """
+        removed = 0
+        for sha256 in set(hashes):
+            with self.lock(sha256):
+                if os.path.exists(self.blob_path(sha256)) and not catalog.is_referenced(sha256):
+                    self.remove(sha256)
+                    removed += 1
+
+        return removed
+
+    def prune(self, catalog: Catalog) -> int:
+        """
+        Remove all the blobs not used by any file in the catalog, e.g. after the storage is modified
+        outside of the managers.
+
+        :param catalog: Catalog of the local model store.
+        :return: Number of the blobs removed.
+        """
+        d_blobs = os.path.join(self.root_dir, 'sha256')
+        hashes = []
+        if os.path.exists(d_blobs):
+            for prefix in os.listdir(d_blobs):
+                for name in os.listdir(os.path.join(d_blobs, prefix)):
+                    if '.' not in name:  # skip the digests and temporary files
+                        hashes.append(name)
+
+        return self.release(hashes, catalog)
@@ -0,0 +1,701 @@
+"""
+Overview:
+    SQLite catalog of the local model store managed by :class:`pycivitai.manager.DispatchManager`.
+
+    The models, versions and files (with their hashes and sizes) are indexed in the catalog, so the local
+    lookups are indexed queries instead of scanning the directories and reading the sidecars. The catalog is
+    updated transactionally on download and deletion. It will be rebuilt from the directory tree when missing,
+    and can be rebuilt manually with ``pycivitai rebuild``.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Optional, Tuple, List
+
+from .base import _soft_name_strip, _parse_model_dirname, _parse_version_dirname, _read_primary, _read_snapshot, \
+    SNAPSHOT_FILENAME, PINNED_FILENAME
+from ..client.resource import _name_strip
+from ..utils.fastjson import json_loads
+
+#: Version of the catalog schema, the catalog will be rebuilt when it is changed.
+CATALOG_SCHEMA_VERSION = 8
+
+#: Filename of the catalog in the root directory of storage.
+CATALOG_FILENAME = '.catalog.sqlite3'
+
+#: Seconds to wait for the catalog locked by the other processes.
+CATALOG_TIMEOUT = 60.0
+
+#: Seconds between the writes of access history, the accesses are kept in memory meanwhile.
+ACCESS_FLUSH_INTERVAL = 30.0
+
+_SCHEMA = [
+    'DROP TABLE IF EXISTS resolutions',
+    'DROP TABLE IF EXISTS totals',
+    'DROP TABLE IF EXISTS blobs',
+    'DROP TABLE IF EXISTS files',
+    'DROP TABLE IF EXISTS versions',
+    'DROP TABLE IF EXISTS models',
+    """
+    CREATE TABLE models (
+        dir TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        creator TEXT NOT NULL,
+        model_id INTEGER NOT NULL,
+        pinned INTEGER NOT NULL DEFAULT 0,
+        file_count INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    'CREATE INDEX idx_models_name ON models (name)',
+    'CREATE INDEX idx_models_id ON models (model_id)',
+    """
+    CREATE TABLE versions (
+        model_dir TEXT NOT NULL REFERENCES models (dir) ON DELETE CASCADE,
+        dir TEXT NOT NULL,
+        name TEXT NOT NULL,
+        version_id INTEGER NOT NULL,
+        primary_file TEXT,
+        snapshot TEXT,
+        snapshot_name TEXT,
+        last_access REAL NOT NULL,
+        access_count INTEGER NOT NULL DEFAULT 0,
+        file_count INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (model_dir, dir)
+    )
+    """,
+    'CREATE INDEX idx_versions_name ON versions (model_dir, name)',
+    'CREATE INDEX idx_versions_id ON versions (model_dir, version_id)',
+    'CREATE INDEX idx_versions_snapshot_name ON versions (snapshot_name)',
+    """
+    CREATE TABLE files (
+        model_dir TEXT NOT NULL,
+        version_dir TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (model_dir, version_dir, filename),
+        FOREIGN KEY (model_dir, version_dir) REFERENCES versions (model_dir, dir) ON DELETE CASCADE
+    )
+    """,
+    'CREATE INDEX idx_files_hash ON files (hash)',
+    # references of each hash, the deduplicated total is only changed when a hash is added or dropped
+    """
+    CREATE TABLE blobs (
+        hash TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        deduped_size INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    'INSERT INTO totals (id) VALUES (0)',
+    """
+    CREATE TRIGGER trg_blobs_insert AFTER INSERT ON blobs BEGIN
+        UPDATE totals SET deduped_size = deduped_size + NEW.size;
+    END
+    """,
+    """
+    CREATE TRIGGER trg_blobs_delete AFTER DELETE ON blobs BEGIN
+        UPDATE totals SET deduped_size = deduped_size - OLD.size;
+    END
+    """,
+    # sizes of versions and models are accounted incrementally, so the totals are never summed up from files
+    """
+    CREATE TRIGGER trg_files_insert AFTER INSERT ON files BEGIN
+        UPDATE versions SET file_count = file_count + 1, size = size + NEW.size
+            WHERE model_dir = NEW.model_dir AND dir = NEW.version_dir;
+        UPDATE models SET file_count = file_count + 1, size = size + NEW.size WHERE dir = NEW.model_dir;
+        -- no conflict clause here, it would be overridden by the OR REPLACE of put_file
+        INSERT INTO blobs (hash, size) SELECT NEW.hash, NEW.size
+            WHERE NOT EXISTS (SELECT 1 FROM blobs WHERE hash = NEW.hash);
+        UPDATE blobs SET refs = refs + 1 WHERE hash = NEW.hash;
+    END
+    """,
+    """
+    CREATE TRIGGER trg_files_delete AFTER DELETE ON files BEGIN
+        UPDATE versions SET file_count = file_count - 1, size = size - OLD.size
+            WHERE model_dir = OLD.model_dir AND dir = OLD.version_dir;
+        UPDATE models SET file_count = file_count - 1, size = size - OLD.size WHERE dir = OLD.model_dir;
+        UPDATE blobs SET refs = refs - 1 WHERE hash = OLD.hash;
+        DELETE FROM blobs WHERE hash = OLD.hash AND refs <= 0;
+    END
+    """,
+    """
+    CREATE TABLE resolutions (
+        key TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        validated_at REAL NOT NULL
+    )
+    """,
+]
+
+
+class Catalog:
+    """
+    SQLite catalog of the models, versions and files under ``root_dir``.
+
+    The directories are expected to be laid out as ``<root_dir>/<model_dir>/<version_dir>``, just like
+    :class:`pycivitai.manager.DispatchManager` does.
+    """
+
+    def __init__(self, root_dir: str, filename: str = CATALOG_FILENAME):
+        """
+        Open the catalog of ``root_dir``, it will be rebuilt if missing or outdated.
+
+        :param root_dir: Root directory of the models.
+        :param filename: Filename of the catalog in ``root_dir``.
+        """
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, filename)
+        self._local = threading.local()
+        self._accesses = {}
+        self._accesses_lock = threading.Lock()
+        self._accesses_flushed_at = time.time()
+        atexit.register(_flush_accesses_at_exit, weakref.ref(self))
+
+        with self._transaction() as conn:
+            schema_version, = conn.execute('PRAGMA user_version').fetchone()
+            if schema_version != CATALOG_SCHEMA_VERSION:
+                self._rebuild(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread, and never reuse the connections inherited from the parent process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=CATALOG_TIMEOUT, isolation_level=None)
+            # readers never wait for the writer in WAL mode, and the catalog can always be rebuilt from the tree,
+            # so the last transactions are allowed to be lost on power failure
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA foreign_keys = ON')
+            # so that the files replaced by INSERT OR REPLACE are subtracted by the delete trigger
+            conn.execute('PRAGMA recursive_triggers = ON')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        return self._connect().execute(sql, params).fetchall()
+
+    def _rebuild(self, conn: sqlite3.Connection):
+        for statement in _SCHEMA:
+            conn.execute(statement)
+
+        for model_dir in os.listdir(self.root_dir):
+            model_path = os.path.join(self.root_dir, model_dir)
+            if not os.path.isdir(model_path) or not _parse_model_dirname(model_dir):
+                continue
+
+            self._insert_model(conn, model_dir)
+            for version_dir in os.listdir(model_path):
+                version_path = os.path.join(model_path, version_dir)
+                if not os.path.isdir(version_path) or not _parse_version_dirname(version_dir):
+                    continue
+
+                self._insert_version(conn, model_dir, version_dir)
+                d_files, d_hashes = os.path.join(version_path, 'files'), os.path.join(version_path, 'hashes')
+                if os.path.exists(d_files):
+                    for filename in os.listdir(d_files):
+                        hash_file = os.path.join(d_hashes, f'{filename}.hash')
+                        if os.path.exists(hash_file):
+                            with open(hash_file, 'r', encoding='utf-8') as f:
+                                hash_ = f.read().strip()
+                            if hash_:
+                                conn.execute(
+                                    'INSERT INTO files (model_dir, version_dir, filename, hash, size) '
+                                    'VALUES (?, ?, ?, ?, ?)',
+                                    (model_dir, version_dir, filename, hash_,
+                                     os.path.getsize(os.path.join(d_files, filename)))
+                                )
+
+        conn.execute(f'PRAGMA user_version = {CATALOG_SCHEMA_VERSION}')
+
+    def rebuild(self):
+        """
+        Regenerate the catalog from the directory tree.
+        """
+        with self._transaction() as conn:
+            self._rebuild(conn)
+
+    def _insert_model(self, conn: sqlite3.Connection, model_dir: str):
+        model_name, creator, model_id = _parse_model_dirname(model_dir)
+        pinned = os.path.exists(os.path.join(self.root_dir, model_dir, PINNED_FILENAME))
+        conn.execute('INSERT OR IGNORE INTO models (dir, name, creator, model_id, pinned) VALUES (?, ?, ?, ?, ?)',
+                     (model_dir, model_name, creator, model_id, pinned))
+
+    def _insert_version(self, conn: sqlite3.Connection, model_dir: str, version_dir: str):
+        version_name, version_id = _parse_version_dirname(version_dir)
+        version_path = os.path.join(self.root_dir, model_dir, version_dir)
+        primary_file = _read_primary(os.path.join(version_path, 'primary'))
+        snapshot = _read_snapshot(os.path.join(version_path, SNAPSHOT_FILENAME))
+        # the access history is lost when rebuilt, so the time of its last modification is used
+        last_access = os.path.getmtime(version_path) if os.path.exists(version_path) else time.time()
+        conn.execute('INSERT OR IGNORE INTO versions '
+                     '(model_dir, dir, name, version_id, primary_file, snapshot, snapshot_name, last_access) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (model_dir, version_dir, version_name, version_id, primary_file,
+                      snapshot, _snapshot_name(snapshot), last_access))
+
+    def _model_key(self, model_path: str) -> str:
+        return os.path.basename(os.path.normpath(model_path))
+
+    def _version_key(self, version_path: str) -> Tuple[str, str]:
+        version_path = os.path.normpath(version_path)
+        return os.path.basename(os.path.dirname(version_path)), os.path.basename(version_path)
+
+    def add_model(self, model_path: str):
+        """
+        Register the model directory.
+
+        :param model_path: Path of the model directory.
+        """
+        with self._transaction() as conn:
+            self._insert_model(conn, self._model_key(model_path))
+
+    def add_version(self, version_path: str):
+        """
+        Register the version directory, and its model directory.
+
+        :param version_path: Path of the version directory.
+        """
+        model_dir, version_dir = self._version_key(version_path)
+        with self._transaction() as conn:
+            self._insert_model(conn, model_dir)
+            self._insert_version(conn, model_dir, version_dir)
+
+    def remove_model(self, model_path: str):
+        """
+        Remove the model, with all its versions and files.
+
+        :param model_path: Path of the model directory.
+        """
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM models WHERE dir = ?', (self._model_key(model_path),))
+
+    def remove_version(self, version_path: str):
+        """
+        Remove the version, with all its files.
+
+        :param version_path: Path of the version directory.
+        """
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM versions WHERE model_dir = ? AND dir = ?', self._version_key(version_path))
+
+    def put_file(self, version_path: str, filename: str, hash_: str, size: int, is_primary: bool = False):
+        """
+        Register the downloaded file.
+
+        :param version_path: Path of the version directory.
+        :param filename: Name of the file.
+        :param hash_: SHA256 of the file.
+        :param size: Size of the file.
+        :param is_primary: Set the file as the primary file of version or not.
+        """
+        model_dir, version_dir = self._version_key(version_path)
+        with self._transaction() as conn:
+            self._insert_model(conn, model_dir)
+            self._insert_version(conn, model_dir, version_dir)
+            conn.execute('INSERT OR REPLACE INTO files (model_dir, version_dir, filename, hash, size) '
+                         'VALUES (?, ?, ?, ?, ?)', (model_dir, version_dir, filename, hash_, size))
+            if is_primary:
+                conn.execute('UPDATE versions SET primary_file = ? WHERE model_dir = ? AND dir = ?',
+                             (filename, model_dir, version_dir))
+
+    def put_snapshot(self, version_path: str, snapshot: str):
+        """
+        Register the metadata snapshot of version.
+
+        :param version_path: Path of the version directory.
+        :param snapshot: The metadata snapshot, in JSON.
+        """
+        model_dir, version_dir = self._version_key(version_path)
+        with self._transaction() as conn:
+            self._insert_model(conn, model_dir)
+            self._insert_version(conn, model_dir, version_dir)
+            conn.execute('UPDATE versions SET snapshot = ?, snapshot_name = ? WHERE model_dir = ? AND dir = ?',
+                         (snapshot, _snapshot_name(snapshot), model_dir, version_dir))
+
+    def remove_file(self, version_path: str, filename: str):
+        """
+        Remove the file.
+
+        :param version_path: Path of the version directory.
+        :param filename: Name of the file.
+        """
+        model_dir, version_dir = self._version_key(version_path)
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM files WHERE model_dir = ? AND version_dir = ? AND filename = ?',
+                         (model_dir, version_dir, filename))
+
+    def list_models(self) -> List[Tuple[str, str, int, str]]:
+        """
+        List the models.
+
+        :return: List of ``(model_name, creator, model_id, model_path)``.
+        """
+        return [
+            (model_name, creator, model_id, os.path.join(self.root_dir, model_dir))
+            for model_dir, model_name, creator, model_id in
+            self._query('SELECT dir, name, creator, model_id FROM models ORDER BY dir')
+        ]
+
+    def find_models(self, model_name: str, model_id: Optional[int] = None,
+                    creator: Optional[str] = None) -> List[Tuple[str, str, int, str]]:
+        """
+        Find the models by the normalized name or the id.
+
+        :param model_name: Normalized name of model.
+        :param model_id: ID of model, ``None`` means matching by name only.
+        :param creator: Normalized name of creator, ``None`` means anyone.
+        :return: List of ``(model_name, creator, model_id, model_path)``.
+        """
+        return [
+            (model_name, model_creator, model_id, os.path.join(self.root_dir, model_dir))
+            for model_dir, model_name, model_creator, model_id in self._query(
+                'SELECT dir, name, creator, model_id FROM models '
+                'WHERE (name = ? OR model_id = ?) AND (? IS NULL OR creator = ?) ORDER BY dir',
+                (model_name, model_id, creator, creator),
+            )
+        ]
+
+    def list_versions(self, model_path: str) -> List[Tuple[str, int, str]]:
+        """
+        List the versions of model.
+
+        :param model_path: Path of the model directory.
+        :return: List of ``(version_name, version_id, version_path)``.
+        """
+        return [
+            (version_name, version_id, os.path.join(model_path, version_dir))
+            for version_dir, version_name, version_id in self._query(
+                'SELECT dir, name, version_id FROM versions WHERE model_dir = ? ORDER BY dir',
+                (self._model_key(model_path),),
+            )
+        ]
+
+    def find_versions(self, model_path: str, version_name: str,
+                      version_id: Optional[int] = None) -> List[Tuple[str, int, str]]:
+        """
+        Find the versions of model by the normalized name or the id.
+
+        :param model_path: Path of the model directory.
+        :param version_name: Normalized name of version.
+        :param version_id: ID of version, ``None`` means matching by name only.
+        :return: List of ``(version_name, version_id, version_path)``.
+        """
+        return [
+            (version_name, version_id, os.path.join(model_path, version_dir))
+            for version_dir, version_name, version_id in self._query(
+                'SELECT dir, name, version_id FROM versions '
+                'WHERE model_dir = ? AND (name = ? OR version_id = ?) ORDER BY dir',
+                (self._model_key(model_path), version_name, version_id),
+            )
+        ]
+
+    def list_files(self, version_path: str) -> List[Tuple[str, str, int]]:
+        """
+        List the files of version.
+
+        :param version_path: Path of the version directory.
+        :return: List of ``(filename, hash, size)``.
+        """
+        return self._query(
+            'SELECT filename, hash, size FROM files WHERE model_dir = ? AND version_dir = ? ORDER BY filename',
+            self._version_key(version_path),
+        )
+
+    def list_snapshots(self, model_path: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        """
+        List the metadata snapshots of versions.
+
+        :param model_path: Path of the model directory, ``None`` means all the models.
+        :return: List of ``(model_path, version_path, snapshot)``, the versions without snapshot are not included.
+        """
+        model_dir = self._model_key(model_path) if model_path is not None else None
+        return [
+            (os.path.join(self.root_dir, model_dir), os.path.join(self.root_dir, model_dir, version_dir), snapshot)
+            for model_dir, version_dir, snapshot in self._query(
+                'SELECT model_dir, dir, snapshot FROM versions '
+                'WHERE snapshot IS NOT NULL AND (? IS NULL OR model_dir = ?) ORDER BY model_dir, dir',
+                (model_dir, model_dir),
+            )
+        ]
+
+    def find_snapshots(self, model_name: str, model_id: Optional[int] = None) -> List[Tuple[str, str, str]]:
+        """
+        Find the metadata snapshots of the models which may be matched by the name or the id, i.e. any of their
+        snapshots has the name, or their directories have the name or the id.
+
+        :param model_name: Name of model, it is normalized here.
+        :param model_id: ID of model, ``None`` means matching by name only.
+        :return: List of ``(model_path, version_path, snapshot)``, the versions without snapshot are not included.
+        """
+        return [
+            (os.path.join(self.root_dir, model_dir), os.path.join(self.root_dir, model_dir, version_dir), snapshot)
+            for model_dir, version_dir, snapshot in self._query(
+                'SELECT model_dir, dir, snapshot FROM versions WHERE snapshot IS NOT NULL AND model_dir IN ('
+                'SELECT model_dir FROM versions WHERE snapshot_name = ? '
+                'UNION SELECT dir FROM models WHERE name = ? OR model_id = ?'
+                ') ORDER BY model_dir, dir',
+                (_name_strip(model_name), _soft_name_strip(model_name), model_id),
+            )
+        ]
+
+    def list_hashes(self, model_path: str) -> List[str]:
+        """
+        List the hashes of files in all the versions of model.
+
+        :param model_path: Path of the model directory.
+        :return: SHA256 of the files, without duplication.
+        """
+        return [hash_ for hash_, in self._query('SELECT DISTINCT hash FROM files WHERE model_dir = ? ORDER BY hash',
+                                                 (self._model_key(model_path),))]
+
+    def is_referenced(self, hash_: str) -> bool:
+        """
+        Check if any file has the hash.
+
+        :param hash_: SHA256 of file.
+        :return: Referenced or not.
+        """
+        return bool(self._query('SELECT 1 FROM files WHERE hash = ? LIMIT 1', (hash_.upper(),)))
+
+    def get_primary(self, version_path: str) -> Optional[str]:
+        """
+        Get the primary file of version.
+
+        :param version_path: Path of the version directory.
+        :return: Name of the primary file, ``None`` if not set.
+        """
+        rows = self._query('SELECT primary_file FROM versions WHERE model_dir = ? AND dir = ?',
+                           self._version_key(version_path))
+        return rows[0][0] if rows else None
+
+    def touch_version(self, version_path: str, accessed_at: Optional[float] = None):
+        """
+        Record an access to the version.
+
+        :param version_path: Path of the version directory.
+        :param accessed_at: Timestamp of the access, current time is used by default.
+        """
+        self.flush_accesses()  # the accesses recorded before are written first
+        with self._transaction() as conn:
+            conn.execute('UPDATE versions SET last_access = ?, access_count = access_count + 1 '
+                         'WHERE model_dir = ? AND dir = ?',
+                         (time.time() if accessed_at is None else accessed_at, *self._version_key(version_path)))
+
+    def record_access(self, version_path: str, accessed_at: Optional[float] = None):
+        """
+        Record an access to the version in memory. The accesses are written in batch at most once
+        per :data:`ACCESS_FLUSH_INTERVAL`, so the cache hits do not wait for the write lock of catalog.
+
+        :param version_path: Path of the version directory.
+        :param accessed_at: Timestamp of the access, current time is used by default.
+        """
+        accessed_at = time.time() if accessed_at is None else accessed_at
+        key = self._version_key(version_path)
+        with self._accesses_lock:
+            last_access, access_count = self._accesses.get(key, (accessed_at, 0))
+            self._accesses[key] = (max(last_access, accessed_at), access_count + 1)
+            due = time.time() - self._accesses_flushed_at >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush_accesses()
+
+    def flush_accesses(self):
+        """
+        Write the accesses recorded by :meth:`record_access` into the catalog.
+        """
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, {}
+            self._accesses_flushed_at = time.time()
+        if accesses:
+            with self._transaction() as conn:
+                conn.executemany(
+                    'UPDATE versions SET last_access = MAX(last_access, ?), access_count = access_count + ? '
+                    'WHERE model_dir = ? AND dir = ?',
+                    [(last_access, access_count, model_dir, version_dir)
+                     for (model_dir, version_dir), (last_access, access_count) in accesses.items()]
+                )
+
+    def set_pinned(self, model_path: str, pinned: bool):
+        """
+        Pin or unpin the model.
+
+        :param model_path: Path of the model directory.
+        :param pinned: Pinned or not.
+        """
+        with self._transaction() as conn:
+            self._insert_model(conn, self._model_key(model_path))
+            conn.execute('UPDATE models SET pinned = ? WHERE dir = ?', (pinned, self._model_key(model_path)))
+
+    def is_pinned(self, model_path: str) -> bool:
+        """
+        Check if the model is pinned.
+
+        :param model_path: Path of the model directory.
+        :return: Pinned or not.
+        """
+        rows = self._query('SELECT pinned FROM models WHERE dir = ?', (self._model_key(model_path),))
+        return bool(rows and rows[0][0])
+
+    def disk_usage(self, dedupe: bool = False) -> int:
+        """
+        Get the total size of files.
+
+        :param dedupe: Count the files with the same hash only once, for the files deduplicated in the blob store.
+        :return: Total size in bytes.
+        """
+        if dedupe:
+            rows = self._query('SELECT deduped_size FROM totals')
+        else:
+            rows = self._query('SELECT SUM(size) FROM models')
+        return rows[0][0] or 0
+
+    def model_usage(self, model_path: str) -> Tuple[int, int]:
+        """
+        Get the number and total size of files in all the versions of model.
+
+        :param model_path: Path of the model directory.
+        :return: ``(file_count, size)``, ``(0, 0)`` if not registered.
+        """
+        rows = self._query('SELECT file_count, size FROM models WHERE dir = ?', (self._model_key(model_path),))
+        return rows[0] if rows else (0, 0)
+
+    def version_usage(self, version_path: str) -> Tuple[int, int]:
+        """
+        Get the number and total size of files of version.
+
+        :param version_path: Path of the version directory.
+        :return: ``(file_count, size)``, ``(0, 0)`` if not registered.
+        """
+        rows = self._query('SELECT file_count, size FROM versions WHERE model_dir = ? AND dir = ?',
+                           self._version_key(version_path))
+        return rows[0] if rows else (0, 0)
+
+    def released_size(self, version_path: str, dedupe: bool = False) -> int:
+        """
+        Get the bytes released if the version is deleted.
+
+        :param version_path: Path of the version directory.
+        :param dedupe: Count only the hashes which are not used by the other versions, for the files
+            deduplicated in the blob store.
+        :return: Size in bytes, ``0`` if not registered.
+        """
+        if dedupe:
+            rows = self._query(
+                'SELECT SUM(b.size) FROM (SELECT hash, COUNT(*) AS refs FROM files '
+                'WHERE model_dir = ? AND version_dir = ? GROUP BY hash) AS f '
+                'JOIN blobs AS b ON b.hash = f.hash WHERE b.refs <= f.refs',
+                self._version_key(version_path)
+            )
+        else:
+            rows = self._query('SELECT size FROM versions WHERE model_dir = ? AND dir = ?',
+                               self._version_key(version_path))
+        return (rows[0][0] or 0) if rows else 0
+
+    def list_usage(self) -> List[Tuple[str, str, int, int]]:
+        """
+        List the number and total size of files of all the versions.
+
+        :return: List of ``(model_path, version_path, file_count, size)``.
+        """
+        return [
+            (os.path.join(self.root_dir, model_dir), os.path.join(self.root_dir, model_dir, version_dir),
+             file_count, size)
+            for model_dir, version_dir, file_count, size in self._query(
+                'SELECT model_dir, dir, file_count, size FROM versions ORDER BY model_dir, dir'
+            )
+        ]
+
+    def list_eviction_candidates(self, policy: str = 'lru') -> List[Tuple[str, str, int]]:
+        """
+        List the versions of unpinned models, in the order of eviction.
+
+        :param policy: ``lru`` for the least recently used first, ``lfu`` for the least frequently used first.
+        :return: List of ``(model_path, version_path, version_id)``.
+        :raises ValueError: If the policy is unknown.
+        """
+        if policy == 'lru':
+            order_by = 'v.last_access, v.access_count'
+        elif policy == 'lfu':
+            order_by = 'v.access_count, v.last_access'
+        else:
+            raise ValueError(f"Unknown eviction policy, 'lru' or 'lfu' expected but {policy!r} found.")
+
+        self.flush_accesses()
+
+        return [
+            (os.path.join(self.root_dir, model_dir), os.path.join(self.root_dir, model_dir, version_dir), version_id)
+            for model_dir, version_dir, version_id in self._query(
+                f'SELECT v.model_dir, v.dir, v.version_id FROM versions AS v '
+                f'JOIN models AS m ON m.dir = v.model_dir WHERE m.pinned = 0 ORDER BY {order_by}, v.model_dir, v.dir'
+            )
+        ]
+
+    def get_resolution(self, key: str) -> Optional[Tuple[str, float]]:
+        """
+        Get the file resolved for the request last time.
+
+        :param key: Key of the request.
+        :return: ``(path, validated_at)``, the path of the file and the timestamp when it was validated
+            with civitai.com. ``None`` if not resolved yet.
+        """
+        rows = self._query('SELECT path, validated_at FROM resolutions WHERE key = ?', (key,))
+        if rows:
+            path, validated_at = rows[0]
+            return os.path.join(self.root_dir, path), validated_at
+        else:
+            return None
+
+    def put_resolution(self, key: str, path: str, validated_at: float):
+        """
+        Record the file resolved for the request.
+
+        :param key: Key of the request.
+        :param path: Path of the resolved file.
+        :param validated_at: Timestamp when it was validated with civitai.com.
+        """
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO resolutions (key, path, validated_at) VALUES (?, ?, ?)',
+                         (key, os.path.relpath(path, self.root_dir), validated_at))
+
+
+def _snapshot_name(snapshot: Optional[str]) -> Optional[str]:
+    # normalized name of model in the snapshot, for looking up the snapshots by name
+    if snapshot is None:
+        return None
+    try:
+        return _name_strip(json_loads(snapshot)['name'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def _flush_accesses_at_exit(ref: 'weakref.ReferenceType[Catalog]'):
+    catalog = ref()
+    if catalog is not None:
+        try:
+            catalog.flush_accesses()
+        except (sqlite3.Error, OSError) as err:  # e.g. the storage has been removed
+            logging.warning(f'Unable to write the access history into {catalog.path!r}: {err!r}')
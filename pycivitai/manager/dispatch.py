@@ -1,15 +1,24 @@
+import logging
 import os
+import pathlib
+import re
 import shutil
-from typing import Iterator, Tuple, Union, List, Optional
+import threading
+import time
+from typing import Iterator, Tuple, Union, List, Optional, Dict, Iterable
 
 import requests
-from filelock import FileLock
 from hbutils.collection import nested_map
 from hbutils.string import format_tree
 
-from .base import _soft_name_strip
+from .base import _soft_name_strip, _read_snapshot, _merge_snapshots, SNAPSHOT_FILENAME, PINNED_FILENAME
+from .blobs import BlobStore, BLOBS_DIRNAME
+from .catalog import Catalog
 from .model import ModelManager
 from ..client import find_model, OFFLINE_MODE, OfflineModeEnabled
+from ..client.resource import _filter_model_items, _maybe_a_hash, _match_file_by_hash
+from ..utils import FilePatternTyping, ReadWriteLock
+from ..utils.fastjson import json_dumps
 
 
 class LocalModelNotFound(Exception):
@@ -20,29 +29,84 @@ class LocalModelDuplicated(Exception):
     pass
 
 
+def _resolution_key(model_name_or_id: Union[str, int], version: Union[str, int, None],
+                    pattern: FilePatternTyping, creator: Optional[str]) -> Optional[str]:
+    if pattern is None or isinstance(pattern, str):
+        pattern_key = pattern
+    elif isinstance(pattern, (list, tuple)) and all(isinstance(item, str) for item in pattern):
+        pattern_key = list(pattern)
+    elif isinstance(pattern, re.Pattern) and isinstance(pattern.pattern, str):
+        pattern_key = {'regex': pattern.pattern, 'flags': pattern.flags}
+    else:
+        return None
+
+    return json_dumps([model_name_or_id, creator, version, pattern_key]).decode('utf-8')
+
+
+def _version_dir_of(local_file: str) -> str:
+    # files are placed in <version_dir>/files
+    return os.path.dirname(os.path.dirname(local_file))
+
+
 class DispatchManager:
     """
     Management of all models.
     """
 
-    def __init__(self, root_dir: str, offline: bool = False):
+    def __init__(self, root_dir: str, offline: bool = False, use_catalog: bool = True,
+                 ttl: float = 0.0, stale_while_revalidate: float = 0.0, use_blobs: bool = True,
+                 max_size: Optional[int] = None, eviction: str = 'lru'):
         """
         Manages multiple models and their versions downloaded from civitai.com.
 
         :param root_dir: The root directory where the models will be managed.
         :param offline: If True, the manager operates in offline mode, using locally downloaded resources.
+        :param use_catalog: Look up the local models from the SQLite catalog (see :class:`Catalog`) or not.
+            If False, the directories are scanned on every lookup.
+        :param ttl: Seconds within which the file resolved and validated with civitai.com last time is
+            returned directly, without any network access. ``0`` means always validating. (default: 0)
+        :param stale_while_revalidate: Seconds after ``ttl`` within which the file resolved last time is
+            still returned directly, while it is validated in the background. (default: 0)
+        :param use_blobs: Deduplicate the downloaded files in the blob store (see :class:`BlobStore`) or not,
+            works with the catalog only. (default: True)
+        :param max_size: Quota of the total size of files in bytes, enforced after each download by evicting
+            the least used versions of the unpinned models, see :meth:`enforce_quota`. ``None`` means no quota.
+            (default: None)
+        :param eviction: Eviction policy, ``lru`` for the least recently used first, ``lfu`` for the least
+            frequently used first. (default: ``lru``)
+        :raises ValueError: If the eviction policy is unknown, or ``max_size`` is given without the catalog.
+
+        .. note::
+            The freshness policy works with the catalog only, and the requests with ``version=None`` (the
+            latest version) are also resolved from it, so a new version may be found after ``ttl``.
         """
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown eviction policy, 'lru' or 'lfu' expected but {eviction!r} found.")
+        if max_size is not None and not use_catalog:
+            raise ValueError('Disk quota works with the catalog only.')
         self.root_dir = root_dir
 
         os.makedirs(self.root_dir, exist_ok=True)
         self._f_lock = os.path.join(root_dir, '.filelock')
-        self.lock = FileLock(self._f_lock)
+        self.lock = ReadWriteLock(self._f_lock)
         self._offline = offline
+        self.catalog = Catalog(self.root_dir) if use_catalog else None
+        self.blobs = BlobStore(os.path.join(self.root_dir, BLOBS_DIRNAME)) if use_catalog and use_blobs else None
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._revalidating: Dict[str, threading.Thread] = {}
+        self.max_size = max_size
+        self.eviction = eviction
+        self._revalidating_lock = threading.Lock()
 
     def _model_path(self, model_name: str, creator: str, model_id: int):
         return os.path.join(self.root_dir, f'{_soft_name_strip(model_name)}__{_soft_name_strip(creator)}__{model_id}')
 
     def _list_local_models(self) -> Iterator[Tuple[str, str, int, str]]:
+        if self.catalog is not None:
+            yield from self.catalog.list_models()
+            return
+
         for dir_ in os.listdir(self.root_dir):
             segs = dir_.split('__')
             if os.path.isdir(os.path.join(self.root_dir, dir_)) and len(segs) == 3:
@@ -55,9 +119,77 @@ class DispatchManager:
         model_id, creator, model_name = model_data['id'], model_data['creator']['username'], model_data['name']
         return model_name, creator, model_id, self._model_path(model_name, creator, model_id), model_data
 
+    def _list_local_snapshots(self, model_name_or_id: Union[str, int, None] = None) -> Dict[str, dict]:
+        # with the catalog, only the snapshots of the models which may be matched are loaded when model is given
+        snapshots: Dict[str, List[str]] = {}
+        if self.catalog is not None:
+            if model_name_or_id is None:
+                rows = self.catalog.list_snapshots()
+            else:
+                rows = self.catalog.find_snapshots(
+                    str(model_name_or_id),
+                    int(model_name_or_id) if str(model_name_or_id).isdigit() else None,
+                )
+            for model_dir, _, snapshot in rows:
+                snapshots.setdefault(model_dir, []).append(snapshot)
+        else:
+            for _, _, _, model_dir in self._list_local_models():
+                for version_dir in os.listdir(model_dir):
+                    snapshot = _read_snapshot(os.path.join(model_dir, version_dir, SNAPSHOT_FILENAME))
+                    if snapshot is not None:
+                        snapshots.setdefault(model_dir, []).append(snapshot)
+
+        retval = {}
+        for model_dir, items in snapshots.items():
+            model_data = _merge_snapshots(items)
+            if model_data is not None:
+                retval[model_dir] = model_data
+        return retval
+
+    def _find_snapshot_model(self, model_name_or_id: Union[str, int], creator: Optional[str],
+                             snapshots: Dict[str, dict]):
+        # resolved against the original names, creators and ids of models, just like the online mode does
+        matched = []
+        if isinstance(model_name_or_id, int) or (creator is None and str(model_name_or_id).isdigit()):
+            matched = [model_dir for model_dir, model_data in snapshots.items()
+                       if model_data['id'] == int(model_name_or_id)]
+        if not matched and isinstance(model_name_or_id, str):
+            matched = [model_dir for model_dir, model_data in snapshots.items()
+                       if _filter_model_items([model_data], model_name_or_id, creator, strict=True)]
+
+        valid_models = [
+            (snapshots[model_dir]['name'], snapshots[model_dir]['creator']['username'],
+             snapshots[model_dir]['id'], model_dir)
+            for model_dir in matched
+        ]
+        if len(valid_models) > 1:
+            raise LocalModelDuplicated(valid_models)
+        elif valid_models:
+            return valid_models[0]
+        else:
+            return None
+
     def _find_local_model(self, model_name_or_id: Union[str, int], creator: Optional[str] = None):
+        snapshots = self._list_local_snapshots(model_name_or_id)
+        found = self._find_snapshot_model(model_name_or_id, creator, snapshots)
+        if found is not None:
+            return found
+        # the models without snapshot (downloaded by the former versions) are matched by their directories
+        snapshot_dirs = {os.path.normpath(model_dir) for model_dir in snapshots}
+
+        if self.catalog is not None:
+            candidates = self.catalog.find_models(
+                _soft_name_strip(str(model_name_or_id)),
+                model_name_or_id if isinstance(model_name_or_id, int) else None,
+                _soft_name_strip(creator) if creator is not None else None,
+            )
+        else:
+            candidates = self._list_local_models()
+
         valid_models = []
-        for model_name, model_creator, model_id, model_dir in self._list_local_models():
+        for model_name, model_creator, model_id, model_dir in candidates:
+            if os.path.normpath(model_dir) in snapshot_dirs:
+                continue
             if ((_soft_name_strip(str(model_name_or_id)) == model_name) or (model_id == model_name_or_id)) and \
                     (creator is None or _soft_name_strip(model_creator) == _soft_name_strip(creator)):
                 valid_models.append((model_name, model_creator, model_id, model_dir))
@@ -77,7 +209,8 @@ class DispatchManager:
 
             model_name, model_creator, model_id, model_dir, model_data = \
                 self._find_online_model(model_name_or_id, creator)
-            return ModelManager(model_dir, model_name_or_id, model_creator, model_data, offline=False)
+            return ModelManager(model_dir, model_name_or_id, model_creator, model_data, offline=False,
+                                catalog=self.catalog, blobs=self.blobs)
         except (requests.exceptions.SSLError, requests.exceptions.ProxyError):
             # Actually raise for those subclasses of ConnectionError
             raise
@@ -87,10 +220,33 @@ class DispatchManager:
                 OfflineModeEnabled,
         ):
             model_name, model_creator, model_id, model_dir = self._find_local_model(model_name_or_id, creator)
-            return ModelManager(model_dir, model_name_or_id, model_creator, offline=True)
+            return ModelManager(model_dir, model_name_or_id, model_creator, offline=True,
+                                catalog=self.catalog, blobs=self.blobs)
+
+    def find_version_id_by_hash(self, model_hash: str) -> Optional[Tuple[int, int, str]]:
+        """
+        Find the local model version of the file hash, from the metadata snapshots saved on download.
+        The files are matched in the same way as :func:`pycivitai.client.find_version_id_by_hash`.
+
+        :param model_hash: Hash of the model file, such as SHA256, CRC32 or AutoV2.
+        :type model_hash: str
+        :return: Tuple of model id, version id and filename, ``None`` if not found.
+        :rtype: Optional[Tuple[int, int, str]]
+        """
+        if not _maybe_a_hash(model_hash):
+            return None
+
+        with self.lock.read():
+            for model_data in self._list_local_snapshots().values():
+                for version_data in model_data['modelVersions']:
+                    filename = _match_file_by_hash(version_data, model_hash)
+                    if filename is not None:
+                        return model_data['id'], version_data['id'], filename
+
+        return None
 
     def get_file(self, model_name_or_id: Union[str, int], version: Union[str, int, None] = None,
-                 pattern: str = None, creator: Optional[str] = None, ):
+                 pattern: FilePatternTyping = None, creator: Optional[str] = None, ):
         """
         Get the local file path of the specified model file.
 
@@ -98,8 +254,9 @@ class DispatchManager:
         :type model_name_or_id: Union[str, int]
         :param version: The version ID or name of the model version. If None, the latest version is used.
         :type version: Union[str, int, None]
-        :param pattern: The pattern or name of the file to get. If None, the primary file will be returned.
-        :type pattern: str
+        :param pattern: The pattern or name of the file to get, which can be a glob, a list of globs or
+            a compiled regular expression. If None, the primary file will be returned.
+        :type pattern: FilePatternTyping
         :param creator: Name of creator. ``None`` means anyone.
         :type creator: Optional[str]
         :return: The local path of the specified model file.
@@ -107,8 +264,61 @@ class DispatchManager:
         :raises LocalModelNotFound: If the specified model is not found locally.
         :raises LocalModelDuplicated: If multiple models matching the model_name_or_id are found locally.
         """
-        with self.lock:
-            return self._get_model_manager(model_name_or_id, creator).get_file(version, pattern)
+        local_file = None
+        key = self._resolution_key(model_name_or_id, version, pattern, creator)
+        if key is not None:
+            with self.lock.read():
+                resolution = self.catalog.get_resolution(key)
+            if resolution is not None:
+                resolved_file, validated_at = resolution
+                age = time.time() - validated_at
+                if os.path.exists(resolved_file) and age < self.ttl + self.stale_while_revalidate:
+                    if age >= self.ttl:
+                        self._revalidate_in_background(key, model_name_or_id, version, pattern, creator)
+                    local_file = resolved_file
+
+        if local_file is None:
+            local_file = self._get_file(key, model_name_or_id, version, pattern, creator)
+        if self.catalog is not None:
+            # the access history is used for eviction, it is written in batch so the hits stay read-only
+            self.catalog.record_access(_version_dir_of(local_file))
+        return local_file
+
+    def _resolution_key(self, model_name_or_id: Union[str, int], version: Union[str, int, None],
+                        pattern: FilePatternTyping, creator: Optional[str]) -> Optional[str]:
+        # None means the freshness policy is not applicable
+        if self.catalog is None or OFFLINE_MODE or self._offline or (self.ttl + self.stale_while_revalidate) <= 0:
+            return None
+        else:
+            return _resolution_key(model_name_or_id, version, pattern, creator)
+
+    def _get_file(self, key: Optional[str], model_name_or_id: Union[str, int], version: Union[str, int, None],
+                  pattern: FilePatternTyping, creator: Optional[str]) -> str:
+        with self.lock.read():
+            local_file, synced = self._get_model_manager(model_name_or_id, creator)._get_file(version, pattern)
+            if key is not None and synced:
+                self.catalog.put_resolution(key, local_file, time.time())
+            if synced and self.max_size is not None:
+                self.enforce_quota(keep=[_version_dir_of(local_file)])
+            return local_file
+
+    def _revalidate_in_background(self, key: str, model_name_or_id: Union[str, int],
+                                  version: Union[str, int, None], pattern: FilePatternTyping,
+                                  creator: Optional[str]):
+        def _revalidate():
+            try:
+                self._get_file(key, model_name_or_id, version, pattern, creator)
+            except Exception as err:
+                logging.warning(f'Background revalidation of {key} failed: {err!r}')
+            finally:
+                with self._revalidating_lock:
+                    del self._revalidating[key]
+
+        with self._revalidating_lock:
+            if key not in self._revalidating:
+                thread = threading.Thread(target=_revalidate, daemon=True)
+                self._revalidating[key] = thread
+                thread.start()
 
     def list_models(self) -> List[ModelManager]:
         """
@@ -117,10 +327,11 @@ class DispatchManager:
         :return: A list of ModelManager objects, one for each model.
         :rtype: List[ModelManager]
         """
-        with self.lock:
+        with self.lock.read():
             retval = []
             for model_name, model_creator, model_id, model_dir in self._list_local_models():
-                retval.append(ModelManager(model_dir, model_name, model_creator, offline=True))
+                retval.append(ModelManager(model_dir, model_name, model_creator, offline=True,
+                                           catalog=self.catalog, blobs=self.blobs))
 
             return retval
 
@@ -132,9 +343,31 @@ class DispatchManager:
         :return: The total size in bytes.
         :rtype: int
         """
-        with self.lock:
+        if self.catalog is not None:  # accounted incrementally in the catalog
+            return self.catalog.disk_usage()
+
+        with self.lock.read():
             return sum((model.total_size for model in self.list_models()))
 
+    def list_usage(self) -> List[Tuple[str, str, int, int]]:
+        """
+        List the disk usage of all the local model versions managed by this DispatchManager.
+
+        :return: List of ``(model_path, version_path, file_count, size)``, ordered by the paths.
+        :rtype: List[Tuple[str, str, int, int]]
+        """
+        if self.catalog is not None:  # accounted incrementally in the catalog
+            return self.catalog.list_usage()
+
+        with self.lock.read():
+            retval = []
+            for model in self.list_models():
+                for version in model.list_versions():
+                    files = version.list_files()
+                    retval.append((model.root_dir, version.root_dir, len(files), sum(file.size for file in files)))
+
+            return sorted(retval)
+
     def delete_model(self, model_name_or_id: Union[str, int]):
         """
         Delete the specified model and all its versions from the local storage.
@@ -143,9 +376,14 @@ class DispatchManager:
         :type model_name_or_id: Union[str, int]
         :raises LocalModelNotFound: If the specified model is not found locally.
         """
-        with self.lock:
+        with self.lock.write():
             model_name, model_creator, model_id, model_dir = self._find_local_model(model_name_or_id)
+            hashes = self.catalog.list_hashes(model_dir) if self.catalog is not None else []
             shutil.rmtree(model_dir, ignore_errors=True)
+            if self.catalog is not None:
+                self.catalog.remove_model(model_dir)
+            if self.blobs is not None:
+                self.blobs.release(hashes, self.catalog)
 
     def delete_version(self, model_name_or_id: Union[str, int], version: Union[str, int]):
         """
@@ -156,9 +394,99 @@ class DispatchManager:
         :param version: The version ID or name to delete.
         :type version: Union[str, int]
         """
-        with self.lock:
+        with self.lock.read():
             self._get_model_manager(model_name_or_id).delete_version(version)
 
+    def enforce_quota(self, max_size: Optional[int] = None, eviction: Optional[str] = None,
+                      keep: Iterable[str] = ()) -> Tuple[List[str], int]:
+        """
+        Evict the versions of unpinned models in the order of eviction policy, until the total size of files
+        fits in the quota.
+
+        :param max_size: Quota of the total size of files in bytes, ``max_size`` of this manager is used by default.
+        :type max_size: Optional[int]
+        :param eviction: Eviction policy, ``lru`` or ``lfu``. ``eviction`` of this manager is used by default.
+        :type eviction: Optional[str]
+        :param keep: Paths of the version directories which should not be evicted.
+        :type keep: Iterable[str]
+        :return: Paths of the evicted version directories, and the bytes released.
+        :rtype: Tuple[List[str], int]
+        :raises ValueError: If the catalog is not used.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return [], 0
+        if self.catalog is None:
+            raise ValueError('Disk quota works with the catalog only.')
+        keep = {os.path.normpath(version_dir) for version_dir in keep}
+
+        with self.lock.read():
+            initial_usage = usage = self.catalog.disk_usage(dedupe=self.blobs is not None)
+            evicted = []
+            if usage > max_size:
+                for model_dir, version_dir, version_id in \
+                        self.catalog.list_eviction_candidates(eviction or self.eviction):
+                    if usage <= max_size:
+                        break
+                    if os.path.normpath(version_dir) in keep:
+                        continue
+
+                    logging.info(f'Evicting {version_dir!r} for disk quota ...')
+                    released = self.catalog.released_size(version_dir, dedupe=self.blobs is not None)
+                    ModelManager(model_dir, os.path.basename(model_dir), offline=True,
+                                 catalog=self.catalog, blobs=self.blobs).delete_version(version_id)
+                    evicted.append(version_dir)
+                    usage -= released
+
+            return evicted, initial_usage - usage
+
+    def _set_pinned(self, model_name_or_id: Union[str, int], creator: Optional[str], pinned: bool):
+        with self.lock.read():
+            model_name, model_creator, model_id, model_dir = self._find_local_model(model_name_or_id, creator)
+            marker = os.path.join(model_dir, PINNED_FILENAME)
+            if pinned:
+                pathlib.Path(marker).touch()
+            elif os.path.exists(marker):
+                os.remove(marker)
+            if self.catalog is not None:
+                self.catalog.set_pinned(model_dir, pinned)
+
+    def pin_model(self, model_name_or_id: Union[str, int], creator: Optional[str] = None):
+        """
+        Pin the model, so its versions will never be evicted.
+
+        :param model_name_or_id: The name or ID of the model.
+        :type model_name_or_id: Union[str, int]
+        :param creator: Name of creator. ``None`` means anyone.
+        :type creator: Optional[str]
+        :raises LocalModelNotFound: If the specified model is not found locally.
+        """
+        self._set_pinned(model_name_or_id, creator, True)
+
+    def unpin_model(self, model_name_or_id: Union[str, int], creator: Optional[str] = None):
+        """
+        Unpin the model.
+
+        :param model_name_or_id: The name or ID of the model.
+        :type model_name_or_id: Union[str, int]
+        :param creator: Name of creator. ``None`` means anyone.
+        :type creator: Optional[str]
+        :raises LocalModelNotFound: If the specified model is not found locally.
+        """
+        self._set_pinned(model_name_or_id, creator, False)
+
+    def rebuild_catalog(self):
+        """
+        Regenerate the catalog from the directory tree, use this after the storage is modified
+        outside of the managers.
+        """
+        with self.lock.write():
+            if self.catalog is None:
+                self.catalog = Catalog(self.root_dir)
+            self.catalog.rebuild()
+            if self.blobs is not None:
+                self.blobs.prune(self.catalog)
+
     def _repr(self):
         return f'<{self.__class__.__name__} directory: {self.root_dir!r}>'
 
@@ -3,13 +3,16 @@ import shutil
 from typing import Union, Optional, Iterator, Tuple, List
 
 import requests
-from filelock import FileLock
 from hbutils.collection import nested_map
 from hbutils.string import format_tree
 
-from .base import _soft_name_strip
+from .base import _soft_name_strip, _parse_version_dirname, _read_snapshot, _merge_snapshots, SNAPSHOT_FILENAME
+from .blobs import BlobStore
+from .catalog import Catalog
 from .version import VersionManager
-from ..client import find_model, find_version, OFFLINE_MODE, OfflineModeEnabled
+from ..client import find_model, find_version, OFFLINE_MODE, OfflineModeEnabled, ModelIndex, ModelVersionNotFound, \
+    ModelVersionDuplicated
+from ..utils import FilePatternTyping, ReadWriteLock
 
 
 class LocalVersionNotFound(Exception):
@@ -26,7 +29,8 @@ class ModelManager:
     """
 
     def __init__(self, root_dir: str, model_name_or_id: Union[str, int], creator: Optional[str] = None,
-                 model_data: Optional[dict] = None, offline: bool = False):
+                 model_data: Optional[dict] = None, offline: bool = False, catalog: Optional[Catalog] = None,
+                 blobs: Optional[BlobStore] = None):
         """
         Manages multiple versions of a model downloaded from civitai.com.
 
@@ -35,27 +39,46 @@ class ModelManager:
         :param creator: Name of creator. ``None`` means anyone.
         :param model_data: Optional dictionary containing model information to avoid fetching it from the API.
         :param offline: If True, the manager operates in offline mode, using locally downloaded resources.
+        :param catalog: Catalog of the local model store, the versions are looked up from it when given.
+        :param blobs: Blob store which the downloaded files are deduplicated in, works with ``catalog`` only.
         """
         self.root_dir = root_dir
         self.model_name_or_id = model_name_or_id
         self.creator = creator
         self._model_data = model_data
+        self._model_index: Optional[ModelIndex] = None
 
+        created = not os.path.exists(root_dir)
         os.makedirs(root_dir, exist_ok=True)
         self._d_versions = os.path.join(self.root_dir)
         self._f_lock = os.path.join(self.root_dir, '.filelock')
-        self.lock = FileLock(self._f_lock)
+        self.lock = ReadWriteLock(self._f_lock)
         self._offline = offline
+        self._catalog = catalog
+        self._blobs = blobs if catalog is not None else None
+        # registered when created, the existing ones are registered already or when their files are published
+        if self._catalog is not None and not self._offline and created:
+            self._catalog.add_model(self.root_dir)
 
     def _get_model(self):
         if not self._model_data:
             self._model_data = find_model(self.model_name_or_id, self.creator)
         return self._model_data
 
+    def _get_model_index(self) -> ModelIndex:
+        # kept as long as the payload, so the versions and files are indexed once for this manager
+        if self._model_index is None:
+            self._model_index = ModelIndex.of(self._get_model())
+        return self._model_index
+
     def _version_path(self, version_name: str, version_id: int):
         return os.path.join(self._d_versions, f'{_soft_name_strip(version_name)}__{version_id}')
 
     def _list_local_versions(self) -> Iterator[Tuple[str, int, str]]:
+        if self._catalog is not None:
+            yield from self._catalog.list_versions(self._d_versions)
+            return
+
         for dir_ in os.listdir(self._d_versions):
             segs = dir_.split('__')
             if os.path.isdir(os.path.join(self._d_versions, dir_)) and len(segs) == 2:
@@ -63,14 +86,61 @@ class ModelManager:
                 version_id = int(version_id)
                 yield version_name, version_id, os.path.join(self._d_versions, dir_)
 
+    def _list_local_snapshots(self) -> List[Tuple[str, str]]:
+        if self._catalog is not None:
+            return [(version_dir, snapshot) for _, version_dir, snapshot in
+                    self._catalog.list_snapshots(self._d_versions)]
+
+        retval = []
+        for _, _, version_dir in self._list_local_versions():
+            snapshot = _read_snapshot(os.path.join(version_dir, SNAPSHOT_FILENAME))
+            if snapshot is not None:
+                retval.append((version_dir, snapshot))
+        return retval
+
+    def _find_snapshot_version(self, version: Union[str, int], snapshots: List[Tuple[str, str]]):
+        # resolved against the original names and ids of versions, just like the online mode does
+        model_data = _merge_snapshots([snapshot for _, snapshot in snapshots])
+        if model_data is None:
+            return None
+
+        try:
+            version_data = find_version(model_data, version)
+        except ModelVersionNotFound:
+            return None
+        except ModelVersionDuplicated as err:
+            raise LocalVersionDuplicated(self.model_name_or_id, err.args[1])
+
+        for version_dir, _ in snapshots:
+            version_name, version_id = _parse_version_dirname(os.path.basename(version_dir))
+            if version_id == version_data['id']:
+                return version_name, version_id, version_dir
+
     def _find_online_version(self, version: Union[str, int, None]):
-        version_data = find_version(self._get_model(), version)
+        version_data = find_version(self._get_model_index(), version)
         version_id, version_name = version_data['id'], version_data['name']
         return version_name, version_id, self._version_path(version_name, version_id)
 
     def _find_local_version(self, version: Union[str, int, None]):
+        snapshot_dirs = set()
+        if version is not None:
+            snapshots = self._list_local_snapshots()
+            found = self._find_snapshot_version(version, snapshots)
+            if found is not None:
+                return found
+            # the versions without snapshot (downloaded by the former versions) are matched by their directories
+            snapshot_dirs = {os.path.normpath(version_dir) for version_dir, _ in snapshots}
+
+        if self._catalog is not None and version is not None:
+            candidates = self._catalog.find_versions(self._d_versions, _soft_name_strip(str(version)),
+                                                     version if isinstance(version, int) else None)
+        else:
+            candidates = self._list_local_versions()
+
         valid_versions = []
-        for version_name, version_id, version_dir in self._list_local_versions():
+        for version_name, version_id, version_dir in candidates:
+            if os.path.normpath(version_dir) in snapshot_dirs:
+                continue
             if (version is None) or ((version is not None) and (
                     (_soft_name_strip(str(version)) == version_name) or
                     (version_id == version)
@@ -98,7 +168,7 @@ class ModelManager:
             version_name, version_id, version_dir = self._find_online_version(version)
             return VersionManager(
                 version_dir, self.model_name_or_id, self.creator, version_name,
-                model_data=self._get_model(), offline=False
+                model_data=self._get_model_index(), offline=False, catalog=self._catalog, blobs=self._blobs,
             )
 
         except (requests.exceptions.SSLError, requests.exceptions.ProxyError):
@@ -110,23 +180,29 @@ class ModelManager:
                 OfflineModeEnabled,
         ):
             version_name, version_id, version_dir = self._find_local_version(version)
-            return VersionManager(version_dir, self.model_name_or_id, self.creator, version_name, offline=True)
+            return VersionManager(version_dir, self.model_name_or_id, self.creator, version_name, offline=True,
+                                  catalog=self._catalog, blobs=self._blobs)
 
-    def get_file(self, version: Union[str, int, None] = None, pattern: str = None):
+    def get_file(self, version: Union[str, int, None] = None, pattern: FilePatternTyping = None):
         """
         Get the local file path of the specified model file.
 
         :param version: The version ID or name of the model version. If None, the latest version is used.
         :type version: Union[str, int, None]
-        :param pattern: The pattern or name of the file to get. If None, the primary file will be returned.
-        :type pattern: str
+        :param pattern: The pattern or name of the file to get, which can be a glob, a list of globs or
+            a compiled regular expression. If None, the primary file will be returned.
+        :type pattern: FilePatternTyping
         :return: The local path of the specified model file.
         :rtype: str
         :raises LocalVersionNotFound: If the specified version is not found locally.
         :raises LocalVersionDuplicated: If multiple versions matching the version parameter are found locally.
         """
-        with self.lock:
-            return self._get_version_manager(version).get_file(pattern)
+        return self._get_file(version, pattern)[0]
+
+    def _get_file(self, version: Union[str, int, None] = None,
+                  pattern: FilePatternTyping = None) -> Tuple[str, bool]:
+        with self.lock.read():
+            return self._get_version_manager(version)._get_file(pattern)
 
     def list_versions(self) -> List[VersionManager]:
         """
@@ -135,11 +211,11 @@ class ModelManager:
         :return: A list of VersionManager objects, one for each version.
         :rtype: List[VersionManager]
         """
-        with self.lock:
+        with self.lock.read():
             retval = []
             for version_name, version_id, version_dir in self._list_local_versions():
                 retval.append(VersionManager(version_dir, self.model_name_or_id, self.creator,
-                                             version_name, offline=True))
+                                             version_name, offline=True, catalog=self._catalog, blobs=self._blobs))
 
             return retval
 
@@ -151,6 +227,10 @@ class ModelManager:
         :return: The total size in bytes.
         :rtype: int
         """
+        if self._catalog is not None:  # accounted incrementally in the catalog
+            _, size = self._catalog.model_usage(self._d_versions)
+            return size
+
         return sum((version.total_size for version in self.list_versions()))
 
     def delete_version(self, version: Union[str, int, None] = None):
@@ -161,9 +241,15 @@ class ModelManager:
         :type version: Union[str, int, None]
         :raises LocalVersionNotFound: If the specified version is not found locally.
         """
-        with self.lock:
+        with self.lock.write():
             version_name, version_id, version_dir = self._find_local_version(version)
+            hashes = [hash_ for _, hash_, _ in self._catalog.list_files(version_dir)] \
+                if self._catalog is not None else []
             shutil.rmtree(version_dir, ignore_errors=True)
+            if self._catalog is not None:
+                self._catalog.remove_version(version_dir)
+            if self._blobs is not None:
+                self._blobs.release(hashes, self._catalog)
 
     def _tree(self):
         return self, [item._tree() for item in sorted(self.list_versions(), key=repr)]
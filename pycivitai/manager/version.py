@@ -1,20 +1,27 @@
-import fnmatch
+import json
 import logging
 import os.path
 import pathlib
-import shutil
 from dataclasses import dataclass
-from typing import Union, Optional, Tuple, Iterator, List
+from typing import Union, Optional, Tuple, Iterator, List, Dict
 
 import requests
 from filelock import FileLock
 from hbutils.collection import nested_map
 from hbutils.string import format_tree
-from hbutils.system import TemporaryDirectory
 
+from .base import _atomic_write_text, _read_primary, _read_snapshot, _merge_snapshots, _snapshot_model_data, \
+    SNAPSHOT_FILENAME
+from .blobs import BlobStore
+from .catalog import Catalog
 from ..client import get_session, ENDPOINT, find_resource, Resource, find_model, find_version, OFFLINE_MODE, \
-    OfflineModeEnabled
-from ..utils import download_file
+    OfflineModeEnabled, ModelIndex, ResourceNotFound, ResourceDuplicated
+from ..utils import download_file, DEFAULT_SEGMENTS, SEGMENTED_DOWNLOAD_THRESHOLD, FileHasher, \
+    HashMismatch, compile_pattern, FilePatternTyping, ReadWriteLock
+
+
+#: Times to resume an interrupted download before giving up.
+DOWNLOAD_RETRIES = 3
 
 
 class LocalPrimaryFileUnset(Exception):
@@ -34,6 +41,8 @@ class LocalFile:
     """
     Data class of local managed file.
     """
+    __slots__ = ('filename', 'hash', 'size', 'is_primary')
+
     filename: str
     hash: str
     size: int
@@ -46,7 +55,8 @@ class VersionManager:
     """
 
     def __init__(self, root_dir: str, model_name_or_id: Union[str, int], creator: Optional[str],
-                 version: Union[str, int], model_data: Optional[dict] = None, offline: bool = False):
+                 version: Union[str, int], model_data: Union[dict, ModelIndex, None] = None, offline: bool = False,
+                 catalog: Optional[Catalog] = None, blobs: Optional[BlobStore] = None):
         """
         Manages the local model files downloaded from civitai.com for a specific model and version.
 
@@ -54,44 +64,73 @@ class VersionManager:
         :param model_name_or_id: The name or ID of the model to manage files for.
         :param creator: Name of creator. ``None`` means anyone.
         :param version: The version ID or name to manage files for.
-        :param model_data: Optional dictionary containing model information to avoid fetching it from the API.
+        :param model_data: Optional dictionary containing model information (or its :class:`ModelIndex`)
+            to avoid fetching it from the API.
         :param offline: If True, the manager operates in offline mode, using locally downloaded resources.
+        :param catalog: Catalog of the local model store, the files are looked up from it when given.
+        :param blobs: Blob store which the downloaded files are deduplicated in, works with ``catalog`` only.
         """
         self.root_dir = root_dir
         self.model_name_or_id = model_name_or_id
         self.creator = creator
-        self._model_data = model_data
+        if isinstance(model_data, ModelIndex):
+            self._model_data, self._model_index = model_data.data, model_data
+        else:
+            self._model_data, self._model_index = model_data, None
         self.version = version
         self._version_data = None
 
+        created = not os.path.exists(self.root_dir)
         os.makedirs(self.root_dir, exist_ok=True)
         self._f_lock = os.path.join(self.root_dir, '.filelock')
         self._f_primary = os.path.join(self.root_dir, 'primary')
+        self._f_snapshot = os.path.join(self.root_dir, SNAPSHOT_FILENAME)
         self._d_files = os.path.join(self.root_dir, 'files')
         self._d_hashes = os.path.join(self.root_dir, 'hashes')
-        self.lock = FileLock(self._f_lock)
+        self._d_partial = os.path.join(self.root_dir, 'partial')
+        self._d_locks = os.path.join(self.root_dir, 'locks')
+        self.lock = ReadWriteLock(self._f_lock)
         self._offline = offline
+        self._catalog = catalog
+        self._blobs = blobs if catalog is not None else None
+        # registered when created, the existing ones are registered already or when their files are published
+        if self._catalog is not None and not self._offline and created:
+            self._catalog.add_version(self.root_dir)
 
     @property
     def _primary_file(self) -> Optional[str]:
-        if os.path.exists(self._f_primary):
-            pfile_val = pathlib.Path(self._f_primary).read_text(encoding='utf-8').splitlines(keepends=False)[0]
-            return pfile_val if pfile_val else None
-        else:
-            return None
+        return _read_primary(self._f_primary)
+
+    @property
+    def _snapshot(self) -> Optional[dict]:
+        snapshot = _read_snapshot(self._f_snapshot)
+        return _merge_snapshots([snapshot]) if snapshot is not None else None
+
+    def _save_snapshot(self):
+        # the downloads of different files may save it at the same time
+        with self._file_lock(SNAPSHOT_FILENAME):
+            snapshot = _snapshot_model_data(self._get_model(), self._get_version())
+            _atomic_write_text(self._f_snapshot, snapshot)
+            if self._catalog is not None:
+                self._catalog.put_snapshot(self.root_dir, snapshot)
 
     def _get_model(self):
         if not self._model_data:
             self._model_data = find_model(self.model_name_or_id, self.creator)
         return self._model_data
 
+    def _get_model_index(self) -> ModelIndex:
+        if self._model_index is None:
+            self._model_index = ModelIndex.of(self._get_model())
+        return self._model_index
+
     def _get_version(self):
         if not self._version_data:
-            self._version_data = find_version(self._get_model(), self.version)
+            self._version_data = find_version(self._get_model_index(), self.version)
         return self._version_data
 
-    def _get_resource(self, pattern: str = None) -> Resource:
-        return find_resource(self._get_model(), self._get_version(), pattern)
+    def _get_resource(self, pattern: FilePatternTyping = None) -> Resource:
+        return find_resource(self._get_model_index(), self._get_version(), pattern)
 
     def _file_path(self, filename: str):
         return os.path.join(self._d_files, filename)
@@ -103,6 +142,16 @@ class VersionManager:
     def _hash_path(self, filename: str):
         return os.path.join(self._d_hashes, f'{filename}.hash')
 
+    def _file_lock(self, filename: str) -> FileLock:
+        os.makedirs(self._d_locks, exist_ok=True)
+        return FileLock(os.path.join(self._d_locks, f'{filename}.lock'))
+
+    def _partial_path(self, filename: str):
+        return os.path.join(self._d_partial, f'{filename}.part')
+
+    def _digests_path(self, filename: str):
+        return os.path.join(self._d_hashes, f'{filename}.json')
+
     def _get_file_hash(self, filename: str) -> Optional[str]:
         f = self._hash_path(filename)
         return pathlib.Path(f).read_text(encoding='utf-8').strip() if os.path.exists(f) else None
@@ -118,7 +167,9 @@ class VersionManager:
             return (resource.size != local_size) or (resource.sha256 != local_hash)
 
     def _iter_local_files(self) -> Iterator[Tuple[str, str, int]]:
-        if os.path.exists(self._d_files):
+        if self._catalog is not None:
+            yield from self._catalog.list_files(self.root_dir)
+        elif os.path.exists(self._d_files):
             for f in os.listdir(self._d_files):
                 _hash, _size = self._get_file_meta(f)
                 if not _hash or _size is None:
@@ -127,36 +178,104 @@ class VersionManager:
                 yield f, _hash, _size
 
     def _download_resource(self, resource: Resource):
-        with TemporaryDirectory() as td:
-            file = os.path.join(td, resource.filename)
-            download_file(
-                resource.url, file,
-                expected_size=resource.size,
-                desc=resource.filename,
-                session=get_session(),
-            )
-
-            os.makedirs(self._d_files, exist_ok=True)
-            shutil.copyfile(file, self._file_path(resource.filename))
-            os.makedirs(self._d_hashes, exist_ok=True)
-            with open(self._hash_path(resource.filename), 'w', encoding='utf-8') as hf:
-                hf.write(resource.sha256)
-
-            if resource.is_primary:
-                with open(self._f_primary, 'w', encoding='utf-8') as pf:
-                    pf.write(resource.filename)
-
-    def _try_sync_from_site(self, pattern: str = None):
+        if self._blobs is not None and resource.sha256:
+            with self._blobs.lock(resource.sha256):
+                digests = self._blobs.get(resource.sha256, resource.size)
+                if digests is not None:
+                    # the same file has been downloaded for another model or version, no network access needed
+                    logging.debug(f'Resource {resource.filename!r} found in blob store, linking to it.')
+                    self._publish_resource(resource, digests)
+                    return
+
+        digests = self._fetch_resource(resource)
+        if self._blobs is not None:
+            with self._blobs.lock(digests['SHA256']):
+                self._blobs.put(self._partial_path(resource.filename), digests)
+                self._publish_resource(resource, digests)
+        else:
+            self._publish_resource(resource, digests)
+
+    def _fetch_resource(self, resource: Resource) -> Dict[str, str]:
+        # the partial file and its progress are staged in the version directory, on the same filesystem
+        # as the published files, so it can be continued by the next try or call, and published by renaming
+        part_file = self._partial_path(resource.filename)
+        tries = 0
+        while True:
+            hasher = FileHasher()
+            try:
+                download_file(
+                    resource.url, part_file,
+                    expected_size=resource.size,
+                    desc=resource.filename,
+                    session=get_session(),
+                    segments=DEFAULT_SEGMENTS if resource.size >= SEGMENTED_DOWNLOAD_THRESHOLD else 1,
+                    resume=True,
+                    identity=resource.sha256,
+                    hasher=hasher,
+                )
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout):
+                tries += 1
+                if tries > DOWNLOAD_RETRIES:
+                    raise
+                logging.warning(f'Download of {resource.filename!r} interrupted, '
+                                f'resuming ({tries}/{DOWNLOAD_RETRIES}) ...')
+
+        # verified before published, a corrupted file should never be resumed again
+        try:
+            hasher.verify(resource.hashes)
+        except HashMismatch:
+            os.remove(part_file)
+            raise
+        return hasher.hexdigests
+
+    def _publish_resource(self, resource: Resource, digests: Dict[str, str]):
+        # publish with atomic renames on the same filesystem, file first, then its sidecars,
+        # so a crash never leaves a half-written file which looks like a complete one.
+        # the .hash sidecar marks the file as complete, so it is written last, after which the readers
+        # (not holding the lock of this file) can use the file, the primary file and the catalog entry
+        replaced_hash = self._get_file_hash(resource.filename)
+        os.makedirs(self._d_files, exist_ok=True)
+        if self._blobs is not None:
+            self._blobs.link(digests['SHA256'], self._file_path(resource.filename))
+        else:
+            os.replace(self._partial_path(resource.filename), self._file_path(resource.filename))
+        os.makedirs(self._d_hashes, exist_ok=True)
+        _atomic_write_text(self._digests_path(resource.filename), json.dumps(digests, indent=4, sort_keys=True))
+        if resource.is_primary:
+            _atomic_write_text(self._f_primary, resource.filename)
+        if self._catalog is not None:
+            self._catalog.put_file(self.root_dir, resource.filename, digests['SHA256'],
+                                   os.path.getsize(self._file_path(resource.filename)), resource.is_primary)
+        _atomic_write_text(self._hash_path(resource.filename), digests['SHA256'])
+
+        if self._blobs is not None and replaced_hash and replaced_hash != digests['SHA256']:
+            self._blobs.release([replaced_hash], self._catalog)
+
+    def _try_sync_from_site(self, pattern: FilePatternTyping = None) -> bool:
+        # return True when the local file has been validated with the site
         try:
             if OFFLINE_MODE or self._offline:
                 raise OfflineModeEnabled
 
             resource = self._get_resource(pattern)
             logging.debug(f'Resource found from {ENDPOINT!r}: {resource!r}')
+            downloaded = False
             if self._need_download_check(resource):
-                logging.debug('The resource is not available locally or has been updated. '
-                              'The download will commence shortly.')
-                self._download_resource(resource)
+                # only the file being written is locked, so the other files can be used or downloaded meanwhile
+                with self._file_lock(resource.filename):
+                    # check again, it may have been downloaded by the others while waiting for the lock
+                    if self._need_download_check(resource):
+                        logging.debug('The resource is not available locally or has been updated. '
+                                      'The download will commence shortly.')
+                        self._download_resource(resource)
+                        downloaded = True
+
+            # the snapshot of metadata is used for resolving in offline mode
+            if downloaded or not os.path.exists(self._f_snapshot):
+                self._save_snapshot()
+            return True
         except (requests.exceptions.SSLError, requests.exceptions.ProxyError):
             # Actually raise for those subclasses of ConnectionError
             raise
@@ -167,21 +286,31 @@ class VersionManager:
         ):
             # ignore this, use the local models
             logging.debug('Offline environment detected, using locally downloaded resources.')
+            return False
 
-    def get_file(self, pattern: str = None):
+    def get_file(self, pattern: FilePatternTyping = None):
         """
         Get the local file path of the specified model file.
 
-        :param pattern: The pattern or name of the file to get. If None, the primary file will be returned.
-        :type pattern: str
+        :param pattern: The pattern or name of the file to get, which can be a glob, a list of globs or
+            a compiled regular expression. If None, the primary file will be returned.
+        :type pattern: FilePatternTyping
         :return: The local path of the specified model file.
         :rtype: str
         :raises LocalPrimaryFileUnset: If the primary file is not set and no specific pattern is provided.
         :raises LocalFileNotFound: If the specified file is not found locally.
         :raises LocalFileDuplicated: If multiple files matching the pattern are found locally.
         """
-        with self.lock:
-            self._try_sync_from_site(pattern)
+        return self._get_file(pattern)[0]
+
+    def _get_file(self, pattern: FilePatternTyping = None) -> Tuple[str, bool]:
+        # the local path of file, and whether it has been validated with the site
+        with self.lock.read():
+            synced = self._try_sync_from_site(pattern)
+            if not synced:
+                snapshot = self._snapshot
+                if snapshot is not None:
+                    return self._get_file_from_snapshot(snapshot, pattern), synced
 
             if pattern is None:
                 pattern = self._primary_file
@@ -192,11 +321,15 @@ class VersionManager:
                 fullmatch = False
 
             matched_files = []
-            if os.path.exists(self._d_files):
-                for filename in os.listdir(self._d_files):
-                    if (fullmatch and filename == pattern) or \
-                            (not fullmatch and fnmatch.fnmatch(filename, pattern)):
-                        matched_files.append(filename)
+            if self._catalog is not None or os.path.exists(self._d_files):
+                if self._catalog is not None:
+                    filenames = [filename for filename, _, _ in self._catalog.list_files(self.root_dir)]
+                else:
+                    filenames = os.listdir(self._d_files)
+                if fullmatch:
+                    matched_files = [filename for filename in filenames if filename == pattern]
+                else:
+                    matched_files = compile_pattern(pattern).filter(filenames)
 
             if not matched_files:
                 raise LocalFileNotFound(self.model_name_or_id, self.version)
@@ -204,10 +337,27 @@ class VersionManager:
                 raise LocalFileDuplicated(self.model_name_or_id, self.version, matched_files)
             else:
                 local_file = self._file_path(matched_files[0])
+                if self._catalog is not None and not os.path.exists(local_file):
+                    # removed outside the managers, the catalog is out of date
+                    self._catalog.remove_file(self.root_dir, matched_files[0])
+                    raise LocalFileNotFound(self.model_name_or_id, self.version)
                 assert os.path.exists(local_file), \
                     f'The expected resource file {local_file!r} was not found, ' \
                     f'indicating a BUG. Please contact the developer.'
-                return local_file
+                return local_file, synced
+
+    def _get_file_from_snapshot(self, model_data: dict, pattern: FilePatternTyping = None) -> str:
+        # resolved against the file list of the version, just like the online mode does
+        try:
+            resource = find_resource(model_data, model_data['modelVersions'][0], pattern)
+        except ResourceNotFound:
+            raise LocalFileNotFound(self.model_name_or_id, self.version)
+        except ResourceDuplicated as err:
+            raise LocalFileDuplicated(self.model_name_or_id, self.version, err.args[2])
+
+        if self._need_download_check(resource):
+            raise LocalFileNotFound(self.model_name_or_id, self.version)
+        return self._file_path(resource.filename)
 
     def list_files(self) -> List[LocalFile]:
         """
@@ -216,9 +366,10 @@ class VersionManager:
         :return: A list of LocalFile objects containing information about each local model file.
         :rtype: List[LocalFile]
         """
-        with self.lock:
+        with self.lock.read():
             retval = []
-            primary_file = self._primary_file
+            primary_file = self._catalog.get_primary(self.root_dir) if self._catalog is not None \
+                else self._primary_file
             for filename, hash_, size_ in self._iter_local_files():
                 retval.append(LocalFile(filename, hash_, size_, filename == primary_file))
 
@@ -232,7 +383,11 @@ class VersionManager:
         :return: The total size in bytes.
         :rtype: int
         """
-        with self.lock:
+        if self._catalog is not None:  # accounted incrementally in the catalog
+            _, size = self._catalog.version_usage(self.root_dir)
+            return size
+
+        with self.lock.read():
             return sum((file.size for file in self.list_files()))
 
     def delete_file(self, filename):
@@ -243,16 +398,24 @@ class VersionManager:
         :type filename: str
         :raises LocalFileNotFound: If the specified file is not found locally.
         """
-        with self.lock:
+        with self.lock.write(), self._file_lock(filename):
             fp = self._file_path(filename)
             hp = self._hash_path(filename)
+            dp = self._digests_path(filename)
             if not os.path.exists(fp) and not os.path.exists(hp):
                 raise LocalFileNotFound(self.model_name_or_id, self.version, filename)
             else:
+                hash_ = self._get_file_hash(filename)
                 if os.path.exists(fp):
                     os.remove(fp)
                 if os.path.exists(hp):
                     os.remove(hp)
+                if os.path.exists(dp):
+                    os.remove(dp)
+                if self._catalog is not None:
+                    self._catalog.remove_file(self.root_dir, filename)
+                if self._blobs is not None and hash_:
+                    self._blobs.release([hash_], self._catalog)
 
     def _repr(self):
         return f'<{self.__class__.__name__} model: {self.model_name_or_id!r}, version: {self.version!r}>'
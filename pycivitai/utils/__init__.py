@@ -1,2 +1,5 @@
 from .cli import print_version, GLOBAL_CONTEXT_SETTINGS
-from .download import download_file
+from .download import download_file, AggregatedProgress, DEFAULT_SEGMENTS, SEGMENTED_DOWNLOAD_THRESHOLD
+from .hashing import FileHasher, HashMismatch
+from .pattern import compile_pattern, FilePattern, FilePatternTyping
+from .rwlock import ReadWriteLock
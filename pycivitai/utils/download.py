@@ -1,8 +1,43 @@
+import json
+import logging
 import os
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from typing import List, Tuple, Optional, Callable
 
 import requests
 from tqdm.auto import tqdm
+from urllib3.exceptions import ProtocolError, DecodeError, ReadTimeoutError, SSLError
+
+from .hashing import FileHasher
+
+#: Default number of concurrent byte ranges for segmented downloads.
+DEFAULT_SEGMENTS = 8
+
+#: Minimal size of each byte range in segmented downloads, smaller files will be split into fewer segments.
+MIN_SEGMENT_SIZE = 8 * 1024 ** 2
+
+#: Files no smaller than this will be downloaded with segments by the managers.
+SEGMENTED_DOWNLOAD_THRESHOLD = 64 * 1024 ** 2
+
+#: Progress of resumable downloads is persisted every time this many bytes are received.
+PROGRESS_SAVE_INTERVAL = 16 * 1024 ** 2
+
+#: Initial (and minimal) size of the receive buffers.
+MIN_BUFFER_SIZE = 1024 ** 2
+
+#: Maximal total size of the receive buffers of each download, shared by its segments.
+MAX_BUFFER_SIZE = 16 * 1024 ** 2
+
+#: Seconds between the checks of the writer thread, when the receiver is waiting for a free buffer.
+WRITER_CHECK_INTERVAL = 1.0
+
+#: With ``drop_cache`` enabled, written data is flushed and dropped from page cache in blocks of this size.
+DROP_CACHE_INTERVAL = 64 * 1024 ** 2
 
 
 class _FakeClass:
@@ -10,8 +45,105 @@ class _FakeClass:
         pass
 
 
+_PROGRESS = threading.local()
+
+
+class AggregatedProgress:
+    """
+    One progress bar of the downloads in several threads. The threads report into it with :meth:`attach`,
+    instead of displaying a progress bar for each file.
+
+    :param items: Number of the items to download.
+    :type items: int
+    :param desc: The description of the progress bar.
+    :type desc: Optional[str]
+    :param silent: Whether to silence the progress bar. (default: False)
+    :type silent: bool
+
+    .. note::
+        The progress is reported per thread, so the downloads in other processes are not counted.
+
+    Example::
+        >>> from concurrent.futures import ThreadPoolExecutor
+        >>> from pycivitai.utils import AggregatedProgress, download_file
+        >>>
+        >>> def _download(url, filename):
+        ...     with progress.attach():
+        ...         download_file(url, filename)
+        >>>
+        >>> with AggregatedProgress(2, desc='Downloading') as progress, ThreadPoolExecutor() as pool:
+        ...     for url, filename in [(url1, 'a.bin'), (url2, 'b.bin')]:
+        ...         pool.submit(_download, url, filename).add_done_callback(progress.finish_item)
+    """
+
+    def __init__(self, items: int, desc: Optional[str] = None, silent: bool = False):
+        self.items = items
+        self.desc = desc
+        self.silent = silent
+        self._pbar = None
+        self._lock = threading.Lock()
+        self._finished = 0
+
+    def __enter__(self):
+        if not self.silent:
+            self._pbar = tqdm(total=0, unit='B', unit_scale=True, unit_divisor=1024, desc=self.desc)
+            self._pbar.set_postfix_str(f'0/{self.items}', refresh=False)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._pbar is not None:
+            self._pbar.close()
+            self._pbar = None
+
+    def _add(self, total: int, n: int):
+        with self._lock:
+            if self._pbar is not None:
+                self._pbar.total += total
+                self._pbar.update(n)
+                self._pbar.refresh()
+
+    def finish_item(self, *args):
+        """
+        Count an item as finished, no matter it succeeded or not. It can be used as the done callback of futures.
+        """
+        with self._lock:
+            self._finished += 1
+            if self._pbar is not None:
+                self._pbar.set_postfix_str(f'{self._finished}/{self.items}')
+
+    @contextmanager
+    def attach(self):
+        """
+        Report the progress of downloads in the current thread into this progress bar.
+        """
+        previous = getattr(_PROGRESS, 'progress', None)
+        _PROGRESS.progress = self
+        try:
+            yield self
+        finally:
+            _PROGRESS.progress = previous
+
+
+class _AggregatedFileProgress:
+    def __init__(self, progress: AggregatedProgress, expected_size: Optional[int], initial: int):
+        self.progress = progress
+        self.expected_size = expected_size or 0
+        self.done = initial
+        self.progress._add(self.expected_size, initial)
+
+    def update(self, n: int):
+        # may be called by the threads of segments
+        with self.progress._lock:
+            self.done += n
+        self.progress._add(0, n)
+
+    def discard(self):
+        # the failed attempt is removed, it will be counted again when retried
+        self.progress._add(-self.expected_size, -self.done)
+
+
 @contextmanager
-def _with_tqdm(expected_size, desc, silent: bool = False):
+def _with_tqdm(expected_size, desc, silent: bool = False, initial: int = 0):
     """
     Context manager that provides a tqdm progress bar for tracking the download progress.
 
@@ -21,15 +153,343 @@ def _with_tqdm(expected_size, desc, silent: bool = False):
     :type desc: str
     :param silent: Whether to silence the progress bar. If True, a fake progress bar is used. (default: False)
     :type silent: bool
+    :param initial: Number of bytes already downloaded, e.g. when resuming. (default: 0)
+    :type initial: int
     """
-    if not silent:
-        with tqdm(total=expected_size, unit='B', unit_scale=True, unit_divisor=1024, desc=desc) as pbar:
+    progress: Optional[AggregatedProgress] = getattr(_PROGRESS, 'progress', None)
+    if progress is not None:
+        pbar = _AggregatedFileProgress(progress, expected_size, initial)
+        try:
+            yield pbar
+        except BaseException:
+            pbar.discard()
+            raise
+    elif not silent:
+        with tqdm(total=expected_size, initial=initial, unit='B', unit_scale=True, unit_divisor=1024,
+                  desc=desc) as pbar:
             yield pbar
     else:
         yield _FakeClass()
 
 
-def download_file(url, filename, expected_size: int = None, desc=None, session=None, silent: bool = False, **kwargs):
+def _split_ranges(total_size: int, segments: int) -> List[Tuple[int, int]]:
+    """
+    Split ``[0, total_size)`` into at most ``segments`` inclusive byte ranges, each of them is no smaller
+    than :data:`MIN_SEGMENT_SIZE` (except the last one).
+    """
+    segments = max(1, min(segments, total_size // MIN_SEGMENT_SIZE))
+    step = -(-total_size // segments)
+    return [(start, min(start + step, total_size) - 1) for start in range(0, total_size, step)]
+
+
+def _support_ranges(response: requests.Response, expected_size) -> bool:
+    return response.headers.get('Accept-Ranges', '').lower() == 'bytes' and \
+        response.headers.get('Content-Encoding', 'identity').lower() == 'identity' and \
+        expected_size is not None and \
+        response.headers.get('Content-Length', str(expected_size)) == str(expected_size)
+
+
+def _get_validator(response: requests.Response) -> Optional[str]:
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):  # weak etags are not allowed in If-Range
+        return etag
+    else:
+        return response.headers.get('Last-Modified')
+
+
+class _DownloadState:
+    """
+    Progress of a download, which is a list of ``[start, end, offset]`` byte ranges of the target file.
+
+    When ``path`` is given, the progress is persisted to it as JSON, so the download can be resumed later.
+    The recorded offsets never exceed the bytes which are actually written to the target file.
+    """
+
+    def __init__(self, path: Optional[str], total_size: Optional[int], identity: Optional[str],
+                 validator: Optional[str], ranges: List[List[Optional[int]]]):
+        self.path = path
+        self.total_size = total_size
+        self.identity = identity
+        self.validator = validator
+        self.ranges = ranges
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+    @classmethod
+    def load(cls, path: str) -> Optional['_DownloadState']:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(path, data['total_size'], data['identity'], data['validator'], data['ranges'])
+        except (FileNotFoundError, ValueError, TypeError, KeyError):
+            return None
+
+    @property
+    def done_size(self) -> int:
+        return sum(offset - start for start, _, offset in self.ranges)
+
+    @property
+    def pending(self) -> List[int]:
+        return [i for i, (_, end, offset) in enumerate(self.ranges) if end is None or offset <= end]
+
+    def advance(self, index: int, length: int):
+        with self._lock:
+            self.ranges[index][2] += length
+            self._unsaved += length
+            if self._unsaved >= PROGRESS_SAVE_INTERVAL:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self._unsaved = 0
+        if self.path:
+            tmp_file = f'{self.path}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'total_size': self.total_size,
+                    'identity': self.identity,
+                    'validator': self.validator,
+                    'ranges': self.ranges,
+                }, f)
+            os.replace(tmp_file, self.path)
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _OrderedHasher:
+    """
+    Feed the ranges of a download into ``hasher`` in the order of file. The range containing the hashed prefix is
+    hashed inline while received, the data of the later ranges is only read back from ``filename`` when the prefix
+    reaches them, and only the part already written by then.
+    """
+
+    def __init__(self, hasher: FileHasher, filename: str, state: _DownloadState):
+        self.hasher = hasher
+        self.filename = filename
+        self.ranges = [(start, end) for start, end, _ in state.ranges]
+        self.written = [offset for _, _, offset in state.ranges]
+        self.position = 0
+        self.current = 0
+        self._lock = threading.Lock()
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self):
+        while True:
+            if self.written[self.current] > self.position:
+                self.hasher.update_from_file(self.filename, self.position, self.written[self.current])
+                self.position = self.written[self.current]
+            _, end = self.ranges[self.current]
+            if end is not None and self.position > end and self.current + 1 < len(self.ranges):
+                self.current += 1
+            else:
+                break
+
+    def update(self, index: int, position: int, view: memoryview):
+        """
+        Called after ``view`` is written to ``position`` of the file, as a part of range ``index``.
+        """
+        with self._lock:
+            self.written[index] = position + len(view)
+            if index == self.current and position == self.position:
+                self.hasher.update(view)
+                self.position += len(view)
+            self._catch_up()
+
+    def finish(self):
+        # not expected to read anything when all the ranges are completed
+        with self._lock:
+            self.hasher.update_from_file(self.filename, self.position)
+
+
+def _range_headers(state: _DownloadState, index: int) -> dict:
+    _, end, offset = state.ranges[index]
+    headers = {'Range': f'bytes={offset}-{end}'}
+    if state.validator:
+        headers['If-Range'] = state.validator
+    return headers
+
+
+def _is_range_of(response: requests.Response, state: _DownloadState, index: int) -> bool:
+    _, end, offset = state.ranges[index]
+    return response.status_code == 206 and \
+        response.headers.get('Content-Range', '') == f'bytes {offset}-{end}/{state.total_size}'
+
+
+def _read_into(raw, view: memoryview, decode: bool) -> int:
+    """
+    Read from urllib3 response ``raw`` into ``view``, translate the exceptions like ``iter_content``.
+    """
+    try:
+        if decode:
+            # decompressed data can not be read into the given buffer directly
+            data = raw.read(len(view), decode_content=True)
+            view[:len(data)] = data
+            return len(data)
+        else:
+            return raw.readinto(view)
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e)
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e)
+    except SSLError as e:
+        raise requests.exceptions.SSLError(e)
+
+
+def _drop_page_cache(fd: int, start: int, length: int):
+    getattr(os, 'fdatasync', os.fsync)(fd)
+    os.posix_fadvise(fd, start, length, os.POSIX_FADV_DONTNEED)
+
+
+def _receive_to_file(response: requests.Response, filename: str, offset: int, on_data: Callable[[memoryview], None],
+                     stopped: threading.Event, max_buffer_size: int = MAX_BUFFER_SIZE, drop_cache: bool = False):
+    """
+    Receive the body of ``response`` into ``filename`` starting at ``offset``.
+
+    The body is read into 2 reusable buffers, while a writer thread writes the filled one to disk and
+    calls ``on_data`` (hashing, progress, etc.) with it, so network reads and disk writes overlap.
+    The buffer size starts at :data:`MIN_BUFFER_SIZE` and adapts to the throughput up to ``max_buffer_size``,
+    so each buffer takes about 0.1 - 0.5 seconds to fill.
+    """
+    raw = response.raw
+    decode = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+    free_buffers, filled_buffers = queue.Queue(), queue.Queue()
+    for _ in range(2):
+        free_buffers.put(bytearray(MIN_BUFFER_SIZE))
+    errors = []
+
+    def _writer():
+        # the buffers are always returned to the reader, even when the file can not be opened or written
+        try:
+            fd = os.open(filename, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        except BaseException as err:
+            errors.append(err)
+            fd = None
+        try:
+            position, cache_start = offset, offset
+            while True:
+                item = filled_buffers.get()
+                if item is None:
+                    break
+                buffer, length = item
+                try:
+                    if not errors:
+                        view = memoryview(buffer)[:length]
+                        os.lseek(fd, position, os.SEEK_SET)
+                        written = 0
+                        while written < length:
+                            written += os.write(fd, view[written:])
+                        position += length
+                        on_data(view)
+
+                        if drop_cache and position - cache_start >= DROP_CACHE_INTERVAL:
+                            _drop_page_cache(fd, cache_start, position - cache_start)
+                            cache_start = position
+                except BaseException as err:
+                    errors.append(err)
+                finally:
+                    free_buffers.put(buffer)
+
+            if drop_cache and not errors and position > cache_start:
+                _drop_page_cache(fd, cache_start, position - cache_start)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    writer = threading.Thread(target=_writer, daemon=True)
+    writer.start()
+    try:
+        size = MIN_BUFFER_SIZE
+        while not stopped.is_set() and not errors:
+            try:
+                buffer = free_buffers.get(timeout=WRITER_CHECK_INTERVAL)
+            except queue.Empty:
+                if writer.is_alive():
+                    continue
+                errors.append(RuntimeError(f'Writer of {filename!r} exited unexpectedly.'))
+                break
+            if len(buffer) != size:
+                buffer = bytearray(size)
+
+            start_time = time.perf_counter()
+            length = _read_into(raw, memoryview(buffer)[:size], decode)
+            if length:
+                filled_buffers.put((buffer, length))
+            else:
+                free_buffers.put(buffer)
+                break
+
+            duration = time.perf_counter() - start_time
+            if length == size and duration < 0.1 and size * 2 <= max_buffer_size:
+                size *= 2
+            elif duration > 0.5 and size // 2 >= MIN_BUFFER_SIZE:
+                size //= 2
+    finally:
+        filled_buffers.put(None)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _fetch_ranges(session: requests.Session, url: str, filename: str, state: _DownloadState, pbar,
+                  response: Optional[requests.Response] = None, hasher: Optional[_OrderedHasher] = None,
+                  drop_cache: bool = False, **kwargs):
+    """
+    Download all the pending ranges of ``state`` concurrently into ``filename``.
+    When ``response`` is given, it is used as the stream of the first pending range.
+    When ``hasher`` is given, the received data is fed into it.
+    """
+    stopped = threading.Event()
+    headers = dict(kwargs.pop('headers', None) or {})
+
+    def _fetch(index: int, resp: Optional[requests.Response]):
+        if resp is None:
+            resp = session.get(url, stream=True, headers={**headers, **_range_headers(state, index)}, **kwargs)
+        with resp:
+            resp.raise_for_status()
+            start, end, offset = state.ranges[index]
+            if (resp.status_code == 200 and (offset != 0 or (end is not None and end + 1 != state.total_size))) or \
+                    (resp.status_code != 200 and not _is_range_of(resp, state, index)):
+                raise requests.exceptions.HTTPError(f'Range request not respected, partial content of '
+                                                    f'{state.ranges[index]!r} expected but '
+                                                    f'{resp.status_code} {resp.headers.get("Content-Range")!r} '
+                                                    f'found.', response=resp)
+
+            def _on_data(view: memoryview):
+                if hasher is not None:
+                    hasher.update(index, state.ranges[index][2], view)
+                state.advance(index, len(view))
+                pbar.update(len(view))
+
+            _receive_to_file(resp, filename, offset, _on_data, stopped,
+                             max_buffer_size=max(MIN_BUFFER_SIZE, MAX_BUFFER_SIZE // len(pending)),
+                             drop_cache=drop_cache)
+
+    pending = state.pending
+    if len(pending) == 1:
+        _fetch(pending[0], response)
+    elif pending:
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            futures = [pool.submit(_fetch, index, response if i == 0 else None) for i, index in enumerate(pending)]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                stopped.set()
+                raise
+
+
+def download_file(url, filename, expected_size: int = None, desc=None, session=None, silent: bool = False,
+                  segments: int = 1, resume: bool = False, identity: Optional[str] = None,
+                  hasher: Optional[FileHasher] = None, drop_cache: bool = False, **kwargs):
     """
     Downloads a file from the given URL and saves it to the specified filename.
 
@@ -45,31 +505,114 @@ def download_file(url, filename, expected_size: int = None, desc=None, session=N
     :type session: requests.Session
     :param silent: Whether to silence the progress bar. If True, no progress bar is displayed. (default: False)
     :type silent: bool
+    :param segments: Number of concurrent byte ranges to download. The redirection of ``url`` is followed only once,
+        and the ranges are fetched from the final location into a preallocated file. When the server does not
+        support range requests, it falls back to a single stream. (default: 1)
+    :type segments: int
+    :param resume: Keep the partially downloaded file and its progress (saved as ``{filename}.progress``) on failure,
+        so the next call can continue with range requests. (default: False)
+    :type resume: bool
+    :param identity: Identity of the expected content (e.g. its SHA256), the saved progress will be discarded
+        and the download will restart when it is changed. The ``ETag`` or ``Last-Modified`` header is also
+        checked with ``If-Range`` to detect the updates on server side. (default: None)
+    :type identity: Optional[str]
+    :param hasher: Hasher to feed the downloaded data into, in the order of file. The first range is hashed while
+        being received, and each later range continues the hash inline once all the ranges before it are completed.
+        Only the part of a range which was already written by then is read back, e.g. about half of the file with
+        2 equal segments and less with more segments, and nothing in single stream mode. The existing part is read
+        back once when resuming. It should be a fresh hasher. (default: None)
+    :type hasher: Optional[FileHasher]
+    :param drop_cache: Flush the written data and drop it from the page cache with ``posix_fadvise``, so huge
+        downloads do not evict the page cache of other processes. Only available on POSIX systems. (default: False)
+    :type drop_cache: bool
     :param kwargs: Additional keyword arguments to pass to the `srequest` function.
     :type kwargs: dict
     :returns: The filename of the downloaded file.
     :rtype: str
     """
     session = session or requests.session()
-    response = session.get(url, stream=True, allow_redirects=True, **kwargs)
-    expected_size = expected_size or response.headers.get('Content-Length', None)
-    expected_size = int(expected_size) if expected_size is not None else expected_size
-
+    headers = dict(kwargs.pop('headers', None) or {})
+    if drop_cache and not hasattr(os, 'posix_fadvise'):
+        warnings.warn('Dropping page cache is not supported on this platform, option drop_cache will be ignored.')
+        drop_cache = False
     desc = desc or os.path.basename(filename)
     directory = os.path.dirname(filename)
     if directory:
         os.makedirs(directory, exist_ok=True)
 
-    with open(filename, 'wb') as f:
-        with _with_tqdm(expected_size, desc, silent) as pbar:
-            for chunk in response.iter_content(chunk_size=1024):
-                f.write(chunk)
-                pbar.update(len(chunk))
+    progress_file = f'{filename}.progress'
+    state = _DownloadState.load(progress_file) if resume else None
+    if state is not None and (state.identity != identity or state.total_size is None or
+                              (expected_size is not None and state.total_size != expected_size) or
+                              not os.path.exists(filename) or os.path.getsize(filename) != state.total_size):
+        state.discard()
+        state = None
 
-    actual_size = os.path.getsize(filename)
+    response, final_url = None, url
+    if state is not None and state.pending:
+        index = state.pending[0]
+        response = session.get(url, stream=True, allow_redirects=True,
+                               headers={**headers, **_range_headers(state, index)}, **kwargs)
+        response.raise_for_status()
+        final_url = response.url
+        if _is_range_of(response, state, index):
+            logging.info(f'Resuming download of {filename!r} from {state.done_size} bytes.')
+        else:
+            logging.info(f'Unable to resume download of {filename!r}, restarting.')
+            state.discard()
+            state = None
+            if response.status_code != 200:
+                response.close()
+                response = None
+
+    if state is None:
+        if response is None:
+            response = session.get(url, stream=True, allow_redirects=True, headers=headers, **kwargs)
+            response.raise_for_status()
+            final_url = response.url
+        expected_size = expected_size or response.headers.get('Content-Length', None)
+        expected_size = int(expected_size) if expected_size is not None else expected_size
+
+        validator = _get_validator(response)
+        if segments > 1 and _support_ranges(response, expected_size) and expected_size >= 2 * MIN_SEGMENT_SIZE:
+            response.close()
+            response = None
+            ranges = [[start, end, start] for start, end in _split_ranges(expected_size, segments)]
+        else:
+            ranges = [[0, expected_size - 1 if expected_size is not None else None, 0]]
+        state = _DownloadState(
+            path=progress_file if resume and expected_size is not None else None,
+            total_size=expected_size,
+            identity=identity,
+            validator=validator,
+            ranges=ranges,
+        )
+
+        with open(filename, 'wb') as f:
+            if expected_size is not None:
+                f.truncate(expected_size)
+        state.save()
+
+    ordered_hasher = _OrderedHasher(hasher, filename, state) if hasher is not None else None
+    try:
+        with _with_tqdm(state.total_size, desc, silent, initial=state.done_size) as pbar:
+            _fetch_ranges(session, final_url, filename, state, pbar, response=response,
+                          hasher=ordered_hasher, drop_cache=drop_cache, headers=headers, **kwargs)
+    finally:
+        state.save()
+
+    expected_size = state.total_size
+    if expected_size is not None and state.pending:
+        actual_size = state.done_size
+    else:
+        actual_size = os.path.getsize(filename)
     if expected_size is not None and actual_size != expected_size:
+        state.discard()
         os.remove(filename)
         raise requests.exceptions.HTTPError(f"Downloaded file is not of expected size, "
                                             f"{expected_size} expected but {actual_size} found.")
 
+    if ordered_hasher is not None:
+        ordered_hasher.finish()
+    state.discard()
     return filename
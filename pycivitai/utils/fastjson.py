@@ -0,0 +1,44 @@
+"""
+Overview:
+    JSON encoding and decoding of the metadata payloads.
+
+    `orjson <https://github.com/ijl/orjson>`_ is used when installed, which is several times faster than the
+    standard :mod:`json` and creates less temporary objects when decoding large payloads. Please install it
+    with ``pip install pycivitai[speedups]``.
+"""
+import json
+from typing import Union, Any
+
+try:
+    import orjson
+except (ModuleNotFoundError, ImportError):
+    orjson = None
+
+
+def json_loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Decode the JSON document.
+
+    :param data: The JSON document, in UTF-8 bytes or string.
+    :return: Decoded object.
+    :raises ValueError: If the document is not a valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    else:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+def json_dumps(obj: Any) -> bytes:
+    """
+    Encode the object to a compact JSON document.
+
+    :param obj: Object to encode.
+    :return: The JSON document, in UTF-8 bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    else:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
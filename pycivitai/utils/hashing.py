@@ -0,0 +1,97 @@
+import hashlib
+import zlib
+from typing import Dict, Optional
+
+try:
+    import blake3
+except (ModuleNotFoundError, ImportError):
+    blake3 = None
+
+
+class HashMismatch(Exception):
+    pass
+
+
+class FileHasher:
+    """
+    Incremental hasher of the file hashes published by civitai.com.
+    """
+
+    def __init__(self, use_blake3: Optional[bool] = None):
+        """
+        Create a hasher which computes ``SHA256``, ``AutoV2`` and ``CRC32`` (and ``BLAKE3`` optionally)
+        of the data fed in one pass.
+
+        :param use_blake3: Compute ``BLAKE3`` or not. ``None`` means only when the ``blake3`` package is installed.
+        :raises OSError: If ``use_blake3`` is ``True`` but ``blake3`` is not installed.
+        """
+        if use_blake3 is None:
+            use_blake3 = blake3 is not None
+        elif use_blake3 and blake3 is None:
+            raise OSError('BLAKE3 hash not available, please install it with `pip install blake3`.')
+
+        self._sha256 = hashlib.sha256()
+        self._crc32 = 0
+        self._blake3 = blake3.blake3() if use_blake3 else None
+        self.size = 0
+
+    def update(self, data):
+        """
+        Feed the next chunk of data.
+
+        :param data: Bytes-like object of data.
+        """
+        self._sha256.update(data)
+        self._crc32 = zlib.crc32(data, self._crc32)
+        if self._blake3 is not None:
+            self._blake3.update(data)
+        self.size += len(data)
+
+    def update_from_file(self, filename: str, start: int = 0, end: Optional[int] = None,
+                         chunk_size: int = 1024 * 1024):
+        """
+        Feed the data of file ``filename`` in ``[start, end)``.
+
+        :param filename: File to read.
+        :param start: Start offset. (default: 0)
+        :param end: End offset, ``None`` means the end of file. (default: None)
+        :param chunk_size: Size of each read. (default: 1 MiB)
+        """
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            remaining = end - start if end is not None else None
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                self.update(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+
+    @property
+    def hexdigests(self) -> Dict[str, str]:
+        """
+        Hex digests of the data fed, in upper case and keyed by the names used by civitai.com,
+        e.g. ``{'SHA256': '...', 'AutoV2': '...', 'CRC32': '...'}``.
+        """
+        sha256 = self._sha256.hexdigest().upper()
+        retval = {
+            'SHA256': sha256,
+            'AutoV2': sha256[:10],
+            'CRC32': f'{self._crc32:08X}',
+        }
+        if self._blake3 is not None:
+            retval['BLAKE3'] = self._blake3.hexdigest().upper()
+        return retval
+
+    def verify(self, expected: Dict[str, str]):
+        """
+        Verify the digests against the expected ones. Hashes not computed by this hasher are ignored.
+
+        :param expected: Expected hashes, such as ``Resource.hashes``.
+        :raises HashMismatch: If any of the hashes does not match.
+        """
+        actual = self.hexdigests
+        for name, value in (expected or {}).items():
+            if name in actual and value and value.upper() != actual[name]:
+                raise HashMismatch(name, value, actual[name])
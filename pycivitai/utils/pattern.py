@@ -0,0 +1,77 @@
+import fnmatch
+import os
+import re
+from functools import lru_cache
+from typing import Union, List, Tuple, Iterable
+
+#: Type of file patterns, which can be a glob, a list of globs or a compiled regular expression.
+FilePatternTyping = Union[str, List[str], Tuple[str, ...], 're.Pattern']
+
+#: Max number of compiled patterns cached.
+PATTERN_CACHE_SIZE = 256
+
+
+class FilePattern:
+    """
+    Compiled file pattern, which matches the filenames in the same way as :func:`fnmatch.fnmatch`.
+    """
+
+    def __init__(self, regex: 're.Pattern', normcase: bool = True):
+        """
+        :param regex: Compiled regular expression, the whole filename should be matched.
+        :param normcase: Normalize the case of filenames before matching or not, just like :func:`fnmatch.fnmatch`.
+        """
+        self.regex = regex
+        self.normcase = normcase
+
+    def match(self, filename: str) -> bool:
+        """
+        Check if the filename matches this pattern.
+
+        :param filename: Name of file.
+        :return: Matched or not.
+        """
+        return self.regex.fullmatch(os.path.normcase(filename) if self.normcase else filename) is not None
+
+    def filter(self, filenames: Iterable[str]) -> List[str]:
+        """
+        Filter the filenames which match this pattern.
+
+        :param filenames: Names of files.
+        :return: Matched filenames, in the original order.
+        """
+        fullmatch = self.regex.fullmatch
+        if self.normcase:
+            normcase = os.path.normcase
+            return [filename for filename in filenames if fullmatch(normcase(filename))]
+        else:
+            return [filename for filename in filenames if fullmatch(filename)]
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.regex.pattern!r}>'
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _compile_globs(globs: Tuple[str, ...]) -> FilePattern:
+    regex = '|'.join(fnmatch.translate(os.path.normcase(glob)) for glob in globs)
+    return FilePattern(re.compile(regex if len(globs) == 1 else f'(?:{regex})'), normcase=True)
+
+
+def compile_pattern(pattern: FilePatternTyping) -> FilePattern:
+    """
+    Compile the file pattern, the compiled patterns are cached and reused.
+
+    :param pattern: Glob (e.g. ``*.safetensors``), list of globs (matches any of them), or a compiled
+        regular expression (the whole filename should be matched).
+    :return: Compiled file pattern.
+    :raises TypeError: If the pattern is not a string, a list of strings or a compiled regular expression.
+    """
+    if isinstance(pattern, str):
+        return _compile_globs((pattern,))
+    elif isinstance(pattern, (list, tuple)) and all(isinstance(item, str) for item in pattern):
+        return _compile_globs(tuple(pattern))
+    elif isinstance(pattern, re.Pattern):
+        return FilePattern(pattern, normcase=False)
+    else:
+        raise TypeError(f'Pattern of file should be a string, a list of strings or '
+                        f'a compiled regular expression, but {pattern!r} found.')
@@ -0,0 +1,161 @@
+"""
+Overview:
+    Reader/writer lock on a file, shared by the threads and processes on the same host.
+
+    On POSIX systems, it is based on ``fcntl.flock``, so any number of readers can hold the lock at the same time,
+    while a writer holds it exclusively. On the other systems, both readers and writers fall back to an exclusive
+    :class:`filelock.FileLock`.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import ContextManager
+
+from filelock import FileLock, Timeout
+
+try:
+    import fcntl
+except (ModuleNotFoundError, ImportError):  # pragma: no cover
+    fcntl = None
+
+_HELD = threading.local()
+
+
+def _held_locks() -> dict:
+    if not hasattr(_HELD, 'locks'):
+        _HELD.locks = {}
+    return _HELD.locks
+
+
+class _Holding:
+    def __init__(self, fd=None, filelock=None):
+        self.fd = fd
+        self.filelock = filelock
+        self.modes = []  # stack of the nested acquisitions in this thread, True means shared
+
+    @property
+    def exclusive(self) -> bool:
+        return not all(self.modes)
+
+
+class ReadWriteLock:
+    """
+    Reader/writer lock on file ``lock_file``.
+
+    The lock is reentrant in the same thread. Nested acquisitions are allowed in any order, and a shared lock
+    is upgraded to an exclusive one when a nested writer asks for it (the upgrade is not atomic, just like
+    ``fcntl.flock``). Using it as a context manager directly acquires the exclusive lock, just like
+    :class:`filelock.FileLock`.
+    """
+
+    def __init__(self, lock_file: str, timeout: float = -1, poll_interval: float = 0.05):
+        """
+        :param lock_file: Path of the lock file.
+        :param timeout: Seconds to wait for the lock, negative value means waiting forever. (default: -1)
+        :param poll_interval: Seconds between the attempts when ``timeout`` is not negative. (default: 0.05)
+        """
+        self.lock_file = lock_file
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def _key(self) -> str:
+        return os.path.abspath(self.lock_file)
+
+    def _flock(self, fd: int, shared: bool):
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if self.timeout < 0:
+            fcntl.flock(fd, operation)
+        else:
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                    return
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise Timeout(self.lock_file)
+                    time.sleep(self.poll_interval)
+
+    def _open(self, shared: bool) -> _Holding:
+        if fcntl is not None:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                self._flock(fd, shared)
+            except BaseException:
+                os.close(fd)
+                raise
+            return _Holding(fd=fd)
+        else:  # pragma: no cover
+            filelock = FileLock(self.lock_file, timeout=self.timeout)
+            filelock.acquire(poll_interval=self.poll_interval)
+            return _Holding(filelock=filelock)
+
+    def acquire(self, shared: bool = False):
+        """
+        Acquire the lock.
+
+        :param shared: Acquire the shared lock (for readers) or the exclusive lock (for writers).
+            (default: False)
+        :raises filelock.Timeout: If the lock can not be acquired in ``timeout`` seconds.
+        """
+        held = _held_locks()
+        holding = held.get(self._key())
+        if holding is None:
+            holding = self._open(shared)
+            held[self._key()] = holding
+        elif not shared and not holding.exclusive and holding.fd is not None:
+            self._flock(holding.fd, shared=False)
+        holding.modes.append(shared)
+
+    def release(self):
+        """
+        Release the lock acquired last time in this thread.
+        """
+        held = _held_locks()
+        holding = held[self._key()]
+        holding.modes.pop()
+        if not holding.modes:
+            del held[self._key()]
+            if holding.fd is not None:
+                fcntl.flock(holding.fd, fcntl.LOCK_UN)
+                os.close(holding.fd)
+            else:  # pragma: no cover
+                holding.filelock.release()
+        elif not holding.exclusive and holding.fd is not None:
+            # the nested writer is released, downgrade to the shared lock
+            fcntl.flock(holding.fd, fcntl.LOCK_SH)
+
+    @contextmanager
+    def _locked(self, shared: bool):
+        self.acquire(shared)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def read(self) -> ContextManager['ReadWriteLock']:
+        """
+        Context manager of the shared lock, for readers.
+        """
+        return self._locked(shared=True)
+
+    def write(self) -> ContextManager['ReadWriteLock']:
+        """
+        Context manager of the exclusive lock, for writers.
+        """
+        return self._locked(shared=False)
+
+    @property
+    def is_locked(self) -> bool:
+        """
+        Whether the lock is held by the current thread.
+        """
+        return self._key() in _held_locks()
+
+    def __enter__(self):
+        self.acquire(shared=False)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,108 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from hbutils.testing import isolated_directory
+
+from pycivitai.client import ModelNotFound, configure_rate_limit, configure_metadata_cache
+
+try:
+    import aiohttp
+except (ModuleNotFoundError, ImportError):
+    aiohttp = None
+
+
+def _run(coro):
+    async def _main():
+        from pycivitai.client.aio import close_async_session
+        try:
+            return await coro
+        finally:
+            await close_async_session()
+
+    return asyncio.run(_main())
+
+
+@pytest.mark.unittest
+@pytest.mark.skipif(aiohttp is None, reason='aiohttp not installed')
+class TestClientAio:
+    def test_find_model(self):
+        from pycivitai.client.aio import find_model
+        data = _run(find_model(115427))
+        assert data['id'] == 115427
+        assert data['name'] == 'amiya arknights (old)'
+
+        data = _run(find_model('amiya arknights (old)'))
+        assert data['id'] == 115427
+
+        with pytest.raises(ModelNotFound):
+            _run(find_model(-1))
+        with pytest.raises(TypeError):
+            _run(find_model(None))
+
+    def test_find_model_concurrent(self):
+        from pycivitai.client.aio import find_model
+
+        async def _gather():
+            return await asyncio.gather(*(find_model(model_id) for model_id in [115427, 121604, 115427]))
+
+        assert [item['id'] for item in _run(_gather())] == [115427, 121604, 115427]
+
+    def test_find_version_id_by_hash(self):
+        from pycivitai.client.aio import find_version_id_by_hash
+        assert _run(find_version_id_by_hash('FB64F545')) == (121986, 155681, 'mutsuki_bluearchive.pt')
+        assert _run(find_version_id_by_hash('not a hash')) is None
+
+
+@pytest.mark.unittest
+@pytest.mark.skipif(aiohttp is None, reason='aiohttp not installed')
+class TestClientAioThrottled:
+    def test_rate_limit_and_cache(self):
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from pycivitai.client import aio
+        from pycivitai.client.http import TokenBucket
+
+        statuses = [429, 200]
+        calls = []
+
+        async def _model(request):
+            calls.append(request.path)
+            status = statuses.pop(0) if statuses else 200
+            if status == 429:
+                return web.Response(status=429, headers={'Retry-After': '0'})
+            return web.json_response({'id': 1, 'name': 'Foo Model'})
+
+        async def _main():
+            app = web.Application()
+            app.router.add_get('/api/v1/models/1', _model)
+            async with TestServer(app) as server:
+                with patch.object(aio, 'ENDPOINT', f'http://{server.host}:{server.port}'):
+                    try:
+                        first = await aio.find_model_by_id(1)
+                        second = await aio.find_model_by_id(1)
+                    finally:
+                        await aio.close_async_session()
+            return first, second
+
+        acquire_async = TokenBucket.acquire_async
+        acquired = []
+
+        async def _acquire_async(self):
+            acquired.append(1)
+            await acquire_async(self)
+
+        with isolated_directory():
+            configure_metadata_cache(directory='metadata', ttl=60)
+            configure_rate_limit(rate=100, burst=1)
+            try:
+                with patch.object(TokenBucket, 'acquire_async', _acquire_async):
+                    first, second = asyncio.run(_main())
+            finally:
+                configure_rate_limit()
+                configure_metadata_cache()
+
+        assert first == second == {'id': 1, 'name': 'Foo Model'}
+        # retried after 429 through the shared bucket, and then served from the metadata cache
+        assert calls == ['/api/v1/models/1'] * 2
+        assert len(acquired) == 2
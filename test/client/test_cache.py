@@ -0,0 +1,141 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+import responses
+from hbutils.testing import isolated_directory
+
+from pycivitai.client import find_model, configure_metadata_cache, get_metadata_cache, ModelNotFound, \
+    MetadataCache, CacheEntry
+from pycivitai.client.resource import _get_json, _json_key
+
+
+@pytest.fixture()
+def model_data():
+    return {'id': 1, 'name': 'Foo Model', 'creator': {'username': 'alice'}, 'modelVersions': []}
+
+
+@pytest.fixture()
+def metadata_cache_dir():
+    with isolated_directory():
+        configure_metadata_cache(directory='metadata', ttl=60)
+        try:
+            yield 'metadata'
+        finally:
+            configure_metadata_cache()
+
+
+@pytest.mark.unittest
+class TestClientCache:
+    def test_fresh(self, metadata_cache_dir, model_data):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json=model_data)
+            assert find_model(1) == model_data
+            assert find_model(1) == model_data
+            assert len(rsps.calls) == 1
+
+            get_metadata_cache().clear()
+            assert find_model('1') == model_data
+            assert len(rsps.calls) == 1
+
+    def test_revalidate(self, metadata_cache_dir, model_data):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json=model_data, headers={'ETag': '"v1"'})
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', status=304)
+            assert find_model(1) == model_data
+
+            with patch('time.time', return_value=time.time() + 120):
+                assert find_model(1) == model_data
+                assert find_model(1) == model_data
+            assert len(rsps.calls) == 2
+            assert rsps.calls[1].request.headers['If-None-Match'] == '"v1"'
+
+    def test_not_found(self, metadata_cache_dir):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/2', status=404)
+            with pytest.raises(ModelNotFound):
+                find_model(2)
+            with pytest.raises(ModelNotFound):
+                find_model(2)
+            assert len(rsps.calls) == 2
+
+    def test_disabled(self, model_data):
+        configure_metadata_cache(enabled=False)
+        try:
+            with responses.RequestsMock() as rsps:
+                rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json=model_data)
+                assert find_model(1) == model_data
+                assert find_model(1) == model_data
+                assert len(rsps.calls) == 2
+        finally:
+            configure_metadata_cache()
+
+    def test_disk_unwritable(self, metadata_cache_dir, model_data):
+        with responses.RequestsMock() as rsps, patch('os.replace', side_effect=PermissionError('read-only')):
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json=model_data)
+            assert find_model(1) == model_data
+            assert find_model(1) == model_data
+            assert len(rsps.calls) == 1
+        assert not [name for name in os.listdir(metadata_cache_dir) if name.endswith('.tmp')]
+
+    def test_copied(self, metadata_cache_dir, model_data):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json=model_data)
+            find_model(1)['modelVersions'].append({'id': 2})
+            data = find_model(1)
+            assert data == model_data
+            data['creator']['username'] = 'bob'
+            assert find_model(1) == model_data
+
+            get_metadata_cache().clear()  # from disk
+            find_model(1)['name'] = 'Bar Model'
+            assert find_model(1) == model_data
+            assert len(rsps.calls) == 1
+
+    def test_copied_when_coalesced(self, model_data):
+        def _callback(request):
+            time.sleep(0.5)
+            return 200, {}, json.dumps(model_data)
+
+        configure_metadata_cache(enabled=False)
+        try:
+            with responses.RequestsMock() as rsps, ThreadPoolExecutor(max_workers=5) as pool:
+                rsps.add_callback(responses.GET, 'https://civitai.com/api/v1/models/1', callback=_callback)
+                results = list(pool.map(lambda _: find_model(1), range(5)))
+                assert len(rsps.calls) == 1
+        finally:
+            configure_metadata_cache()
+
+        assert len({id(result) for result in results}) == 5
+        results[0]['creator']['username'] = 'bob'
+        assert results[1:] == [model_data] * 4
+
+    def test_not_coalesced_across_use_cache(self, metadata_cache_dir, model_data):
+        def _callback(request):
+            time.sleep(0.5)
+            return 200, {}, json.dumps(model_data)
+
+        url = 'https://civitai.com/api/v1/models/1'
+        with responses.RequestsMock() as rsps, ThreadPoolExecutor(max_workers=2) as pool:
+            rsps.add_callback(responses.GET, url, callback=_callback)
+            results = list(pool.map(lambda use_cache: _get_json(url, use_cache=use_cache), [False, True]))
+            assert len(rsps.calls) == 2
+
+        assert results == [model_data] * 2
+        assert get_metadata_cache().get(_json_key(url)).data == model_data
+
+    def test_max_disk_entries(self):
+        with isolated_directory():
+            cache = MetadataCache('metadata', max_disk_entries=16)
+            for i in range(40):
+                cache.put(f'key_{i}', CacheEntry(f'url_{i}', {'id': i}, None, None, time.time()))
+                os.utime(cache._entry_path(f'key_{i}'), (i, i))
+            cache.prune()
+            assert len(os.listdir('metadata')) == 16
+
+            cache.clear()
+            assert cache.get('key_0') is None
+            assert cache.get('key_39').data == {'id': 39}
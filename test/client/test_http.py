@@ -1,7 +1,17 @@
+import io
+import multiprocessing
+import os
+import threading
+import time
+from unittest.mock import patch
+
 import pytest
 import requests
+import responses
+from requests.adapters import BaseAdapter
 
-from pycivitai.client import configure_http_backend, get_session
+from pycivitai.client import configure_http_backend, get_session, configure_http_pool, configure_rate_limit, configure_metadata_cache, \
+    TokenBucket, find_model_by_id
 
 
 @pytest.fixture()
@@ -25,3 +35,141 @@ class TestClientHttp:
             configure_http_backend(requests.session)
             session = get_session()
             assert not hasattr(session, 'custom_prop')
+
+
+class _RecordingAdapter(BaseAdapter):
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        self.urls.append(request.url)
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response._content, response.raw = b'{"id": 1}', io.BytesIO()
+        response.request, response.url = request, request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture()
+def no_metadata_cache():
+    configure_metadata_cache(enabled=False)
+    try:
+        yield
+    finally:
+        configure_metadata_cache()
+
+
+@pytest.mark.unittest
+class TestClientHttpRateLimit:
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=20, burst=5)
+        start_time = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+        assert 0.4 <= time.monotonic() - start_time < 1.0
+
+    def test_retry_after(self, no_metadata_cache):
+        with responses.RequestsMock() as rsps, patch('pycivitai.client.http.time.sleep') as sleep:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', status=429, headers={'Retry-After': '7'})
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', status=503)
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json={'id': 1})
+            assert find_model_by_id(1) == {'id': 1}
+            assert len(rsps.calls) == 3
+            assert sleep.call_args_list[0].args == (7.0,)
+            assert 2.0 <= sleep.call_args_list[1].args[0] < 3.0
+
+    def test_retry_after_longer_than_backoff_max(self, no_metadata_cache):
+        with responses.RequestsMock() as rsps, patch('pycivitai.client.http.time.sleep') as sleep:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', status=429,
+                     headers={'Retry-After': '120'})
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', json={'id': 1})
+            assert find_model_by_id(1) == {'id': 1}
+            assert sleep.call_args_list[0].args == (120.0,)
+
+    def test_retry_after_max(self, no_metadata_cache):
+        try:
+            configure_rate_limit(retry_after_max=30.0)
+            with responses.RequestsMock() as rsps, patch('pycivitai.client.http.time.sleep') as sleep:
+                rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', status=429,
+                         headers={'Retry-After': '120'})
+                with pytest.raises(requests.exceptions.HTTPError):
+                    find_model_by_id(1)
+                assert len(rsps.calls) == 1
+                sleep.assert_not_called()
+        finally:
+            configure_rate_limit()
+
+    def test_custom_adapter(self, no_metadata_cache):
+        adapter = _RecordingAdapter([429, 200])
+
+        def _factory():
+            session = requests.session()
+            session.mount('https://', adapter)
+            return session
+
+        try:
+            configure_http_backend(_factory)
+            with patch('pycivitai.client.http.time.sleep') as sleep:
+                assert find_model_by_id(1) == {'id': 1}
+            # the customized adapter receives the api requests, and they are still throttled
+            assert adapter.urls == ['https://civitai.com/api/v1/models/1'] * 2
+            assert sleep.call_count == 1
+        finally:
+            configure_http_backend(requests.session)
+
+    def test_retry_exhausted(self, no_metadata_cache):
+        try:
+            configure_rate_limit(retries=2, backoff_factor=0.01)
+            with responses.RequestsMock() as rsps:
+                rsps.add(responses.GET, 'https://civitai.com/api/v1/models/1', status=429)
+                with pytest.raises(requests.exceptions.HTTPError):
+                    find_model_by_id(1)
+                assert len(rsps.calls) == 3
+        finally:
+            configure_rate_limit()
+
+
+def _adapter_id_in_child(queue):
+    queue.put(id(get_session().get_adapter('https://example.com/')))
+
+
+@pytest.mark.unittest
+class TestClientHttpPool:
+    def test_shared_pool(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(get_session()))
+        thread.start()
+        thread.join()
+
+        session = get_session()
+        assert session is get_session()
+        assert sessions[0] is not session
+        assert sessions[0].get_adapter('https://example.com/') is session.get_adapter('https://example.com/')
+        assert sessions[0].get_adapter('https://civitai.com/api/v1/models') is \
+               session.get_adapter('https://civitai.com/api/v1/models')
+
+    def test_configure_http_pool(self):
+        try:
+            configure_http_pool(pool_maxsize=3, keep_alive=False)
+            session = get_session()
+            assert session.get_adapter('https://example.com/')._pool_maxsize == 3
+            assert session.headers['Connection'] == 'close'
+        finally:
+            configure_http_pool()
+        assert get_session().get_adapter('https://example.com/')._pool_maxsize == 64
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork not supported')
+    def test_fork(self):
+        parent_adapter_id = id(get_session().get_adapter('https://example.com/'))
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        process = ctx.Process(target=_adapter_id_in_child, args=(queue,))
+        process.start()
+        child_adapter_id = queue.get(timeout=30)
+        process.join()
+        assert child_adapter_id != parent_adapter_id
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+import responses
+
+from pycivitai.client import find_version_ids_by_hashes
+
+
+def _version(model_id, version_id, files):
+    return {
+        'id': version_id, 'modelId': model_id,
+        'files': [{'name': name, 'hashes': hashes} for name, hashes in files],
+    }
+
+
+@pytest.fixture()
+def versions():
+    return [
+        _version(1, 11, [('a.safetensors', {'SHA256': 'AAAA' * 16, 'CRC32': 'AAAA0001'}),
+                         ('a.vae.pt', {'SHA256': 'BBBB' * 16, 'CRC32': 'BBBB0001'})]),
+        _version(2, 21, [('c.pt', {'SHA256': 'CCCC' * 16, 'CRC32': 'CCCC0001', 'AutoV2': 'CCCCCCCCCC'})]),
+    ]
+
+
+@pytest.fixture()
+def by_hash_api(versions):
+    def _callback(request):
+        hashes = json.loads(request.body)
+        assert len(hashes) <= 2
+        found = [version for version in versions
+                 if any(h in file['hashes'].values() for file in version['files'] for h in hashes)]
+        return 200, {}, json.dumps(found)
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(responses.POST, 'https://civitai.com/api/v1/model-versions/by-hash', callback=_callback)
+        yield rsps
+
+
+@pytest.mark.unittest
+class TestClientResourceBatch:
+    def test_find_version_ids_by_hashes(self, by_hash_api):
+        result = find_version_ids_by_hashes(
+            ['aaaa0001', 'BBBB' * 16, 'CCCCCCCCCC', 'DDDD0001', 'not a hash', 'aaaa0001'],
+            chunk_size=2,
+        )
+        assert result == {
+            'aaaa0001': (1, 11, 'a.safetensors'),
+            'BBBB' * 16: (1, 11, 'a.vae.pt'),
+            'CCCCCCCCCC': (2, 21, 'c.pt'),
+            'DDDD0001': None,
+            'not a hash': None,
+        }
+        assert len(by_hash_api.calls) == 2
+
+    def test_find_version_ids_by_hashes_empty(self, by_hash_api):
+        assert find_version_ids_by_hashes(['not a hash']) == {'not a hash': None}
+        assert len(by_hash_api.calls) == 0
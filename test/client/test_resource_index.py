@@ -0,0 +1,84 @@
+import copy
+import gc
+import re
+import weakref
+
+import pytest
+
+from pycivitai.client import ModelIndex, find_version, find_resource, ModelVersionNotFound, \
+    ModelVersionDuplicated, ResourceNotFound, ResourceDuplicated
+
+
+class _Payload(dict):
+    pass  # dict itself can not be referenced weakly
+
+
+def _file(name, primary=False):
+    return {
+        'name': name, 'primary': primary, 'sizeKB': 1.0,
+        'downloadUrl': f'https://civitai.com/api/download/{name}',
+        'hashes': {'SHA256': 'AAAA' * 16, 'CRC32': 'AAAA0001'},
+    }
+
+
+@pytest.fixture()
+def model_data():
+    return {
+        'id': 1, 'name': 'Foo Model', 'creator': {'username': 'alice'}, 'tags': ['foo'],
+        'modelVersions': [
+            {'id': 13, 'name': 'v3.0', 'files': [_file('foo_v3.safetensors', True), _file('foo_v3.pt'),
+                                                  _file('[v3].yaml')]},
+            {'id': 12, 'name': 'V 2.0', 'files': [_file('foo_v2.safetensors', True)]},
+            {'id': 11, 'name': 'v2_0', 'files': [_file('foo_v2.safetensors'), _file('foo_v2.ckpt')]},
+            {'id': 10, 'name': '13', 'files': [_file('foo_v1.safetensors', True)]},
+        ]
+    }
+
+
+@pytest.mark.unittest
+class TestClientResourceIndex:
+    def test_of(self, model_data):
+        index = ModelIndex.of(model_data)
+        assert index.data is model_data
+        assert ModelIndex.of(index) is index
+
+        # not kept after used, so the payload is released with its owner
+        payload = _Payload(copy.deepcopy(model_data))
+        ref = weakref.ref(payload)
+        assert find_resource(payload, find_version(payload)).filename == 'foo_v3.safetensors'
+        del payload
+        gc.collect()
+        assert ref() is None
+
+    def test_find_version(self, model_data):
+        index = ModelIndex.of(model_data)
+        assert find_version(index)['id'] == 13
+        assert find_version(index, 12)['id'] == 12
+        assert find_version(model_data, 10)['id'] == 10
+        assert [v['id'] for v in index.find_versions(13)] == [13, 10]
+        assert [v['id'] for v in index.find_versions('13')] == [10]
+        with pytest.raises(ModelVersionDuplicated):
+            find_version(index, 'v2.0')
+        with pytest.raises(ModelVersionDuplicated):
+            find_version(index, 13)
+        with pytest.raises(ModelVersionNotFound):
+            find_version(index, 'v4')
+
+    def test_find_resource(self, model_data):
+        index = ModelIndex.of(model_data)
+        v3, v2_0 = find_version(index, 'v3.0'), find_version(index, 11)
+        assert find_resource(index, v3).filename == 'foo_v3.safetensors'
+        assert find_resource(model_data, v3, 'foo_v3.pt').filename == 'foo_v3.pt'
+        assert find_resource(index, v3, '*.pt').filename == 'foo_v3.pt'
+        assert find_resource(index, v3, '[[]v3].yaml').filename == '[v3].yaml'
+        assert find_resource(index, v2_0, 'foo_v2.ckpt').filename == 'foo_v2.ckpt'
+        with pytest.raises(ResourceNotFound):
+            find_resource(index, v2_0)
+        with pytest.raises(ResourceDuplicated):
+            find_resource(index, v3, 'foo_v3.*')
+        with pytest.raises(ResourceNotFound):
+            find_resource(index, v3, 'foo_v3')
+        assert find_resource(index, v3, ['*.yaml', '*.ckpt']).filename == '[v3].yaml'
+        assert find_resource(index, v3, re.compile(r'foo_v\d\.pt')).filename == 'foo_v3.pt'
+        with pytest.raises(TypeError):
+            find_resource(index, v3, 1)
@@ -0,0 +1,117 @@
+import copy
+import dataclasses
+import hashlib
+import json
+import tracemalloc
+from dataclasses import dataclass
+from typing import List
+
+import pytest
+
+from pycivitai.client import Model, find_version, find_resource
+from pycivitai.manager import LocalFile
+
+
+@dataclass
+class _PlainResource:
+    model_name: str
+    model_id: int
+    creator: str
+    version_name: str
+    version_id: int
+    filename: str
+    is_primary: bool
+    url: str
+    sha256: str
+    crc32: str
+    hashes: dict
+    size: int
+    tags: List[str]
+
+
+def _model_data(model_id):
+    sha256 = hashlib.sha256(str(model_id).encode()).hexdigest().upper()
+    return {
+        'id': model_id, 'name': f'Model {model_id}', 'creator': {'username': 'alice'},
+        'tags': ['character', 'anime', 'arknights'],
+        'modelVersions': [{
+            'id': model_id * 10, 'name': 'v1.0',
+            'files': [{
+                'name': f'model_{model_id}.safetensors', 'primary': True, 'sizeKB': 1.0,
+                'downloadUrl': f'https://civitai.com/api/download/models/{model_id * 10}',
+                'hashes': {'SHA256': sha256, 'CRC32': sha256[:8], 'AutoV2': sha256[:10]},
+            }],
+        }],
+    }
+
+
+def _allocated(factory, count=5000):
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        objects = [factory(i) for i in range(count)]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del objects
+    return after - before
+
+
+@pytest.mark.unittest
+class TestClientResourceRecords:
+    def test_resource(self):
+        model_data = _model_data(1)
+        sha256 = model_data['modelVersions'][0]['files'][0]['hashes']['SHA256']
+        resource = find_resource(model_data, find_version(model_data))
+        assert not hasattr(resource, '__dict__')
+        assert resource.tags == ['character', 'anime', 'arknights']
+        assert resource.hashes == {'SHA256': sha256, 'CRC32': sha256[:8], 'AutoV2': sha256[:10]}
+        assert resource.sha256 == sha256
+        assert json.loads(json.dumps(dataclasses.asdict(resource)))['hashes'] == resource.hashes
+        assert copy.deepcopy(resource) == resource
+
+        # the strings are shared by the resources of different payloads
+        other_data = json.loads(json.dumps(_model_data(2)))
+        other = find_resource(other_data, find_version(other_data))
+        assert all(tag is other_tag for tag, other_tag in zip(resource.tags, other.tags))
+        assert all(name is other_name for name, other_name in zip(resource.hashes, other.hashes))
+        # and the records are still independent
+        other.tags.append('operator')
+        other.hashes['SHA256'] = 'BBBB' * 16
+        assert resource.tags == ['character', 'anime', 'arknights']
+        assert resource.sha256 == sha256
+
+    def test_model(self):
+        model_data = _model_data(1)
+        model = Model(model_data)
+        assert (model.model_name, model.model_id, model.creator) == ('Model 1', 1, 'alice')
+        assert model.data is model_data
+        assert Model(model_data, keep_data=False).data is None
+        assert repr(Model(model_data, keep_data=False)) == "<Model name: 'Model 1', id: 1, creator: 'alice'>"
+
+    def test_local_file(self):
+        file = LocalFile('amiya.pt', 'AAAA' * 16, 25451, True)
+        assert not hasattr(file, '__dict__')
+        assert repr(file) == f"LocalFile(filename='amiya.pt', hash='{'AAAA' * 16}', size=25451, is_primary=True)"
+
+    def test_memory(self):
+        # the records outlive the payloads they are parsed from, so only the memory kept by them is measured
+        texts = [json.dumps(_model_data(i)) for i in range(5000)]
+
+        def _resource(i):
+            model_data = json.loads(texts[i])
+            return find_resource(model_data, find_version(model_data))
+
+        def _plain_resource(i):
+            model_data = json.loads(texts[i])
+            file = model_data['modelVersions'][0]['files'][0]
+            return _PlainResource(
+                model_name=model_data['name'], model_id=model_data['id'], creator=model_data['creator']['username'],
+                version_name='v1.0', version_id=model_data['id'] * 10, filename=file['name'], is_primary=True,
+                url=file['downloadUrl'], sha256=file['hashes']['SHA256'], crc32=file['hashes']['CRC32'],
+                hashes=dict(file['hashes']), size=1024, tags=list(model_data['tags']),
+            )
+
+        _resource(0), _plain_resource(0)  # warm up
+        slotted_size, plain_size = _allocated(_resource), _allocated(_plain_resource)
+        assert slotted_size < plain_size * 0.85, f'{slotted_size} bytes vs {plain_size} bytes'
@@ -0,0 +1,98 @@
+import json
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+import responses
+from hbutils.testing import isolated_directory
+
+from pycivitai.client import iter_models, list_models_by_name, find_model_by_name, configure_metadata_cache, \
+    ModelNotFound
+from pycivitai.dispatch import civitai_search_online
+
+
+def _model(model_id, name, creator):
+    return {'id': model_id, 'name': name, 'creator': {'username': creator}, 'modelVersions': []}
+
+
+@pytest.fixture()
+def all_models():
+    return [
+        _model(1, 'Foo Model', 'alice'),
+        _model(2, 'Foo', 'bob'),
+        _model(3, 'Foo Model', 'bob'),
+        _model(4, 'Foo Model Plus', 'alice'),
+        _model(5, 'foo_model', 'alice'),
+    ]
+
+
+@pytest.fixture()
+def no_metadata_cache():
+    configure_metadata_cache(enabled=False)
+    try:
+        yield
+    finally:
+        configure_metadata_cache()
+
+
+@pytest.fixture()
+def search_api(all_models, no_metadata_cache):
+    def _callback(request):
+        query = parse_qs(urlparse(request.url).query)
+        cursor = int(query.get('cursor', ['0'])[0])
+        limit = int(query.get('limit', ['2'])[0])
+        items = all_models[cursor:cursor + limit]
+        metadata = {}
+        if cursor + limit < len(all_models):
+            metadata['nextCursor'] = cursor + limit
+            metadata['nextPage'] = f'https://civitai.com/api/v1/models?query=foo&limit={limit}&cursor={cursor + limit}'
+        return 200, {}, json.dumps({'items': items, 'metadata': metadata})
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(responses.GET, 'https://civitai.com/api/v1/models', callback=_callback)
+        yield rsps
+
+
+@pytest.mark.unittest
+class TestClientSearch:
+    @pytest.mark.parametrize(['prefetch'], [(True,), (False,)])
+    def test_iter_models(self, search_api, prefetch):
+        models = list(iter_models('foo', page_size=2, prefetch=prefetch))
+        assert [model.model_id for model in models] == [1, 2, 3, 4, 5]
+        assert len(search_api.calls) == 3
+
+    def test_iter_models_strict(self, search_api):
+        models = list(iter_models('Foo Model', creator='alice', strict=True, page_size=2))
+        assert [model.model_id for model in models] == [1, 5]
+
+    def test_iter_models_lazy(self, search_api):
+        iterator = iter_models('foo', page_size=2, prefetch=False)
+        assert next(iterator).model_id == 1
+        assert len(search_api.calls) == 1
+        iterator.close()
+
+    def test_iter_models_use_cache(self, search_api):
+        with isolated_directory():
+            configure_metadata_cache(directory='metadata', ttl=60)
+            list(iter_models('foo', page_size=2))
+            list(iter_models('foo', page_size=2))
+            assert len(search_api.calls) == 6  # not cached by default
+
+            list(iter_models('foo', page_size=2, use_cache=True))
+            list(iter_models('foo', page_size=2, use_cache=True))
+            assert len(search_api.calls) == 9
+
+    def test_list_models_by_name(self, search_api, all_models):
+        assert list_models_by_name('foo') == all_models[:2]
+        assert len(search_api.calls) == 1
+        assert list_models_by_name('foo', all_pages=True) == all_models
+        assert [model.model_id for model in civitai_search_online('foo')] == [1, 2, 3, 4, 5]
+
+    def test_find_model_by_name_single_page(self, search_api, all_models):
+        assert find_model_by_name('foo', creator='bob') == all_models[1]
+        assert len(search_api.calls) == 1
+
+    def test_not_found(self, no_metadata_cache):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'https://civitai.com/api/v1/models', status=404)
+            with pytest.raises(ModelNotFound):
+                list(iter_models('foo'))
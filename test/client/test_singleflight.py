@@ -0,0 +1,56 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pycivitai.client.singleflight import SingleFlight
+
+
+@pytest.mark.unittest
+class TestClientSingleFlight:
+    def test_do(self):
+        group, calls, lock = SingleFlight(), [], threading.Lock()
+
+        def _fn(x):
+            with lock:
+                calls.append(x)
+            time.sleep(0.5)
+            return x * 2
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda i: group.do(i % 2, _fn, i % 2), range(16)))
+
+        assert results == [0, 2] * 8
+        assert sorted(calls) == [0, 1]
+        assert group.do(1, _fn, 1) == 2
+        assert len(calls) == 3
+
+    def test_do_copy(self):
+        group = SingleFlight(copy=dict)
+
+        def _fn():
+            time.sleep(0.5)
+            return {'value': 1}
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(lambda _: group.do('key', _fn), range(5)))
+        assert results == [{'value': 1}] * 5
+        assert len({id(result) for result in results}) == 5
+
+    def test_do_error(self):
+        group, calls = SingleFlight(), []
+
+        def _fn():
+            calls.append(1)
+            time.sleep(0.5)
+            raise ValueError('shared error')
+
+        def _call():
+            with pytest.raises(ValueError):
+                group.do('key', _fn)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for future in [pool.submit(_call) for _ in range(8)]:
+                future.result()
+        assert len(calls) == 1
@@ -0,0 +1,17 @@
+import pytest
+
+from ..testings import mock_site
+
+
+@pytest.fixture()
+def site_models():
+    """
+    Models served by :func:`rsps`, override or parametrize this in the test modules.
+    """
+    return [dict(model_id=1, name='Foo Model', versions=[(11, 'v1.0', {'a.safetensors': b'a' * 4096})])]
+
+
+@pytest.fixture()
+def rsps(site_models):
+    with mock_site(site_models) as rsps:
+        yield rsps
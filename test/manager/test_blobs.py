@@ -0,0 +1,125 @@
+import hashlib
+import os
+from unittest.mock import patch
+
+import pytest
+
+from pycivitai.manager import DispatchManager, BlobStore
+from ..testings import download_url
+
+_CONTENTS = {
+    'a.safetensors': b'a' * 4096,
+    'b.safetensors': b'b' * 4096,
+    'shared.vae.pt': b'v' * 2048,
+}
+
+
+@pytest.fixture()
+def site_models():
+    return [
+        dict(model_id=model_id, name=name,
+             versions=[(model_id * 10, 'v1.0', {name: _CONTENTS[name], 'shared.vae.pt': _CONTENTS['shared.vae.pt']})])
+        for model_id, name in [(1, 'a.safetensors'), (2, 'b.safetensors')]
+    ]
+
+
+def _download_calls(rsps):
+    return [call.request.url for call in rsps.calls if '/api/download/' in call.request.url]
+
+
+def _blob_path(manager: DispatchManager):
+    return manager.blobs.blob_path(hashlib.sha256(_CONTENTS['shared.vae.pt']).hexdigest())
+
+
+@pytest.mark.unittest
+class TestManagerBlobs:
+    def test_deduplicated(self, rsps):
+        manager = DispatchManager('repo')
+        path_1 = manager.get_file(1, pattern='shared.vae.pt')
+        path_2 = manager.get_file(2, pattern='shared.vae.pt')
+        assert path_1 != path_2
+        assert _download_calls(rsps) == [download_url(10, 'shared.vae.pt')]
+
+        blob_path = _blob_path(manager)
+        assert os.path.samefile(path_1, blob_path)
+        assert os.path.samefile(path_2, blob_path)
+        assert os.stat(blob_path).st_nlink == 3
+        with open(path_2, 'rb') as f:
+            assert f.read() == _CONTENTS['shared.vae.pt']
+
+        # released when the last file using it is deleted
+        manager.delete_model(1)
+        assert os.path.exists(blob_path)
+        with open(path_2, 'rb') as f:
+            assert f.read() == _CONTENTS['shared.vae.pt']
+        manager.delete_model(2)
+        assert not os.path.exists(blob_path)
+
+    def test_delete_version_and_file(self, rsps):
+        manager = DispatchManager('repo')
+        manager.get_file(1, pattern='shared.vae.pt')
+        manager.get_file(2, pattern='shared.vae.pt')
+        blob_path = _blob_path(manager)
+
+        manager.list_models()[0].list_versions()[0].delete_file('shared.vae.pt')
+        assert os.path.exists(blob_path)
+        manager.delete_version(2, 'v1.0')
+        assert not os.path.exists(blob_path)
+
+    def test_quota(self, rsps):
+        manager = DispatchManager('repo')
+        for accessed_at, model_id in enumerate([1, 2]):
+            for filename in ['a.safetensors', 'b.safetensors'][model_id - 1:model_id] + ['shared.vae.pt']:
+                path = manager.get_file(model_id, pattern=filename)
+            manager.catalog.touch_version(os.path.dirname(os.path.dirname(path)), accessed_at)
+        assert manager.catalog.disk_usage(dedupe=True) == 4096 * 2 + 2048
+
+        # the shared file is still used by model 2, so it is not released with model 1
+        evicted, released = manager.enforce_quota(4096 + 2048)
+        assert [os.path.basename(os.path.dirname(version_dir)) for version_dir in evicted] == \
+               ['a_safetensors__alice__1']
+        assert released == 4096
+        assert manager.catalog.disk_usage(dedupe=True) == 4096 + 2048
+
+        evicted, released = manager.enforce_quota(0)
+        assert len(evicted) == 1
+        assert released == 4096 + 2048
+        assert manager.catalog.disk_usage(dedupe=True) == 0
+
+    def test_symlink_fallback(self, rsps):
+        manager = DispatchManager('repo')
+        with patch('os.link', side_effect=OSError):
+            path_1 = manager.get_file(1, pattern='shared.vae.pt')
+            path_2 = manager.get_file(2, pattern='shared.vae.pt')
+
+        assert len(_download_calls(rsps)) == 1
+        assert os.path.islink(path_1) and os.path.islink(path_2)
+        assert not os.path.isabs(os.readlink(path_1))
+        assert os.path.samefile(path_1, _blob_path(manager))
+        with open(path_2, 'rb') as f:
+            assert f.read() == _CONTENTS['shared.vae.pt']
+
+    def test_disabled(self, rsps):
+        manager = DispatchManager('repo', use_blobs=False)
+        assert manager.blobs is None
+        path_1 = manager.get_file(1, pattern='shared.vae.pt')
+        path_2 = manager.get_file(2, pattern='shared.vae.pt')
+        assert len(_download_calls(rsps)) == 2
+        assert not os.path.samefile(path_1, path_2)
+        assert not os.path.exists(os.path.join('repo', '.blobs'))
+
+    def test_prune(self, rsps):
+        manager = DispatchManager('repo')
+        manager.get_file(1)
+        with open('orphan', 'wb') as f:
+            f.write(b'orphan')
+        orphan_hash = hashlib.sha256(b'orphan').hexdigest().upper()
+        orphan_path = manager.blobs.put('orphan', {'SHA256': orphan_hash})
+        assert isinstance(manager.blobs, BlobStore)
+        assert manager.blobs.get(orphan_hash, 6) == {'SHA256': orphan_hash}
+        assert manager.blobs.get(orphan_hash, 7) is None
+
+        manager.rebuild_catalog()
+        assert not os.path.exists(orphan_path)
+        with open(manager.get_file(1), 'rb') as f:
+            assert f.read() == _CONTENTS['a.safetensors']
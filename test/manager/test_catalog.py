@@ -0,0 +1,180 @@
+import hashlib
+import os
+import shutil
+from unittest.mock import patch
+
+import pytest
+from hbutils.testing import isolated_directory
+
+from pycivitai.manager import DispatchManager, ModelManager, VersionManager, Catalog, LocalModelNotFound, \
+    LocalVersionNotFound, LocalFileNotFound
+from pycivitai.manager.catalog import CATALOG_FILENAME
+from test.testings import get_testfile
+
+
+def _add_file(repo_dir, model_dir, version_dir, filename, content, primary=True):
+    version_path = os.path.join(repo_dir, model_dir, version_dir)
+    os.makedirs(os.path.join(version_path, 'files'), exist_ok=True)
+    os.makedirs(os.path.join(version_path, 'hashes'), exist_ok=True)
+    with open(os.path.join(version_path, 'files', filename), 'wb') as f:
+        f.write(content)
+    with open(os.path.join(version_path, 'hashes', f'{filename}.hash'), 'w') as f:
+        f.write(hashlib.sha256(content).hexdigest().upper())
+    if primary:
+        with open(os.path.join(version_path, 'primary'), 'w') as f:
+            f.write(filename)
+
+
+@pytest.fixture()
+def repo_dir():
+    with isolated_directory({'repo': get_testfile('sample_repo_1')}):
+        _add_file('repo', 'amiya_arknights_old__narugo1992__115427', 'v1_1__124885', 'amiya.pt', b'a' * 25515)
+        _add_file('repo', '明日方舟_安洁莉娜_arknights_angeline__zbw__5632', 'v1_0__6555',
+                  'angeline.safetensors', b'b' * 37863532)
+        yield 'repo'
+
+
+@pytest.fixture()
+def repo_manager(repo_dir):
+    yield DispatchManager(repo_dir, offline=True)
+
+
+def _scanned(repo_dir):
+    return str(DispatchManager(repo_dir, offline=True, use_catalog=False))
+
+
+@pytest.mark.unittest
+class TestManagerCatalog:
+    def test_built_from_tree(self, repo_dir, repo_manager):
+        assert os.path.exists(os.path.join(repo_dir, CATALOG_FILENAME))
+        assert str(repo_manager) == _scanned(repo_dir)
+        assert repo_manager.total_size == 37914498
+
+        assert repo_manager.catalog.find_models('amiya_arknights_old') == [
+            ('amiya_arknights_old', 'narugo1992', 115427,
+             os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427')),
+        ]
+        assert [item[2] for item in repo_manager.catalog.find_models('', 5632)] == [5632]
+        assert repo_manager.catalog.find_models('amiya_arknights_old', creator='zbw') == []
+
+    def test_get_file(self, repo_dir, repo_manager):
+        assert os.path.samefile(
+            repo_manager.get_file('amiya arknights (old)', 'v1.0'),
+            os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427', 'v1_0__124870', 'files', 'amiya.pt')
+        )
+        assert os.path.samefile(
+            repo_manager.get_file(115427, 124885, '*.pt'),
+            os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427', 'v1_1__124885', 'files', 'amiya.pt')
+        )
+        assert os.path.samefile(
+            repo_manager.get_file('amiya arknights (old)', creator='narugo1992'),
+            os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427', 'v1_1__124885', 'files', 'amiya.pt')
+        )
+        with pytest.raises(LocalVersionNotFound):
+            repo_manager.get_file('amiya arknights (old)', 'v1.2')
+        with pytest.raises(LocalModelNotFound):
+            repo_manager.get_file('amiya arknights (old)', creator='zbw')
+
+    def test_delete(self, repo_dir, repo_manager):
+        repo_manager.delete_version('amiya arknights (old)', 'v1.0')
+        assert repo_manager.total_size == 37889047
+        assert str(repo_manager) == _scanned(repo_dir)
+
+        repo_manager.delete_model('明日方舟_安洁莉娜_arknights_angeline')
+        assert repo_manager.total_size == 25515
+        assert str(repo_manager) == _scanned(repo_dir)
+
+        version = repo_manager.list_models()[0].list_versions()[0]
+        version.delete_file('amiya.pt')
+        assert repo_manager.total_size == 0
+        assert str(repo_manager) == _scanned(repo_dir)
+
+    def test_rebuild(self, repo_dir, repo_manager):
+        version_dir = os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427', 'v1_1__124885')
+        shutil.rmtree(os.path.join(version_dir, 'files'))
+        with pytest.raises(LocalFileNotFound):
+            repo_manager.get_file('amiya arknights (old)', 'v1.1')
+        assert repo_manager.total_size == 37888983
+
+        shutil.rmtree(os.path.join(repo_dir, '明日方舟_安洁莉娜_arknights_angeline__zbw__5632'))
+        assert str(repo_manager) != _scanned(repo_dir)
+        repo_manager.rebuild_catalog()
+        assert str(repo_manager) == _scanned(repo_dir)
+        assert repo_manager.total_size == 25451
+
+    def test_missing(self, repo_dir, repo_manager):
+        repo_manager.delete_model('明日方舟_安洁莉娜_arknights_angeline')
+        os.remove(os.path.join(repo_dir, CATALOG_FILENAME))
+        catalog = Catalog(repo_dir)
+        assert [item[0] for item in catalog.list_models()] == ['amiya_arknights_old']
+        assert catalog.list_files(os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427', 'v1_0__124870')) \
+               == [('amiya.pt', '259BE5CF344CDBCA981B389BE7C105B8993D9D340C172C556F2E0E8283E3DBED', 25451)]
+        assert catalog.get_primary(
+            os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427', 'v1_1__124885')) == 'amiya.pt'
+
+    def test_usage(self, repo_dir, repo_manager):
+        amiya_dir = os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427')
+        angeline_dir = os.path.join(repo_dir, '明日方舟_安洁莉娜_arknights_angeline__zbw__5632')
+        assert repo_manager.list_usage() == [
+            (amiya_dir, os.path.join(amiya_dir, 'v1_0__124870'), 1, 25451),
+            (amiya_dir, os.path.join(amiya_dir, 'v1_1__124885'), 1, 25515),
+            (angeline_dir, os.path.join(angeline_dir, 'v1_0__6555'), 1, 37863532),
+        ]
+        assert repo_manager.catalog.model_usage(amiya_dir) == (2, 50966)
+
+        # the replaced file is subtracted from the counters
+        version = repo_manager.list_models()[0].list_versions()[0]
+        repo_manager.catalog.put_file(version.root_dir, 'amiya.pt', 'A' * 64, 100)
+        repo_manager.catalog.put_file(version.root_dir, 'amiya_2.pt', 'B' * 64, 200)
+        assert version.total_size == 300
+        assert repo_manager.catalog.model_usage(amiya_dir) == (3, 25815)
+
+        repo_manager.delete_version('amiya arknights (old)', 'v1.1')
+        assert repo_manager.catalog.model_usage(amiya_dir) == (2, 300)
+        repo_manager.delete_model('明日方舟_安洁莉娜_arknights_angeline')
+        assert repo_manager.total_size == 300
+        assert repo_manager.catalog.model_usage(angeline_dir) == (0, 0)
+
+    def test_deduped_usage(self, repo_dir, repo_manager):
+        catalog = repo_manager.catalog
+
+        def _scanned():
+            rows = catalog._query('SELECT SUM(size) FROM (SELECT MAX(size) AS size FROM files GROUP BY hash)')
+            return rows[0][0] or 0
+
+        assert catalog.disk_usage(dedupe=True) == _scanned() == catalog.disk_usage()
+        v1_0, v1_1 = [version.root_dir for version in repo_manager.list_models()[0].list_versions()]
+        catalog.put_file(v1_0, 'shared.pt', 'A' * 64, 100)
+        catalog.put_file(v1_1, 'shared.pt', 'A' * 64, 100)
+        assert catalog.disk_usage(dedupe=True) == _scanned() == catalog.disk_usage() - 100
+
+        # the hash is only subtracted when its last reference is dropped
+        repo_manager.delete_version('amiya arknights (old)', 'v1.1')
+        assert catalog.disk_usage(dedupe=True) == _scanned() == catalog.disk_usage()
+        catalog.put_file(v1_0, 'shared.pt', 'B' * 64, 200)
+        assert catalog.disk_usage(dedupe=True) == _scanned() == catalog.disk_usage()
+        repo_manager.delete_model('amiya arknights (old)')
+        assert catalog.disk_usage(dedupe=True) == _scanned() == catalog.disk_usage() == 37863532
+
+    def test_usage_scanned(self, repo_dir, repo_manager):
+        scanned = DispatchManager(repo_dir, offline=True, use_catalog=False)
+        assert scanned.list_usage() == repo_manager.list_usage()
+        assert scanned.total_size == repo_manager.total_size
+        assert [model.total_size for model in scanned.list_models()] == \
+               [model.total_size for model in repo_manager.list_models()]
+
+    def test_wal(self, repo_manager):
+        assert repo_manager.catalog._query('PRAGMA journal_mode') == [('wal',)]
+
+    def test_registered_when_created(self, repo_dir, repo_manager):
+        model_dir = os.path.join(repo_dir, 'amiya_arknights_old__narugo1992__115427')
+        with patch.object(Catalog, 'add_model') as add_model, patch.object(Catalog, 'add_version') as add_version:
+            ModelManager(model_dir, 'amiya_arknights_old', catalog=repo_manager.catalog)
+            VersionManager(os.path.join(model_dir, 'v1_0__124870'), 'amiya_arknights_old', None, 'v1.0',
+                           catalog=repo_manager.catalog)
+            add_model.assert_not_called()
+            add_version.assert_not_called()
+
+        VersionManager(os.path.join(model_dir, 'v2_0__124999'), 'amiya_arknights_old', None, 'v2.0',
+                       catalog=repo_manager.catalog)
+        assert [item[1] for item in repo_manager.catalog.list_versions(model_dir)] == [124870, 124885, 124999]
@@ -0,0 +1,86 @@
+import re
+import time
+
+import pytest
+import requests
+import responses
+
+from pycivitai.manager import DispatchManager
+from pycivitai.manager.dispatch import _resolution_key
+
+def _age(manager: DispatchManager, seconds: float, *args):
+    key = _resolution_key(*args)
+    path, validated_at = manager.catalog.get_resolution(key)
+    manager.catalog.put_resolution(key, path, validated_at - seconds)
+
+
+@pytest.mark.unittest
+class TestManagerFreshness:
+    def test_resolution_key(self):
+        assert _resolution_key(1, None, None, None) != _resolution_key('1', None, None, None)
+        assert _resolution_key(1, None, '*.pt', None) == _resolution_key(1, None, '*.pt', None)
+        assert _resolution_key(1, None, ['*.pt'], None) == _resolution_key(1, None, ('*.pt',), None)
+        assert _resolution_key(1, None, re.compile('a'), None) != _resolution_key(1, None, 'a', None)
+        assert _resolution_key(1, None, re.compile('a', re.I), None) != \
+               _resolution_key(1, None, re.compile('a'), None)
+        assert _resolution_key(1, None, object(), None) is None
+
+    def test_validate_always(self, rsps):
+        manager = DispatchManager('repo')
+        path = manager.get_file(1)
+        calls = len(rsps.calls)
+        assert manager.get_file(1) == path
+        assert len(rsps.calls) == calls + 1
+
+    def test_fresh(self, rsps):
+        manager = DispatchManager('repo', ttl=60)
+        path = manager.get_file(1)
+        calls = len(rsps.calls)
+        assert manager.get_file(1) == path
+        assert len(rsps.calls) == calls
+
+        # another request is validated separately
+        assert manager.get_file(1, 'v1.0', 'a.safetensors') == path
+        assert len(rsps.calls) == calls + 1
+        assert manager.get_file(1, 'v1.0', 'a.safetensors') == path
+        assert len(rsps.calls) == calls + 1
+
+        _age(manager, 120, 1, None, None, None)
+        assert manager.get_file(1) == path
+        assert len(rsps.calls) == calls + 2
+
+    def test_stale_while_revalidate(self, rsps):
+        manager = DispatchManager('repo', ttl=60, stale_while_revalidate=3600)
+        path = manager.get_file(1)
+        calls = len(rsps.calls)
+
+        _age(manager, 120, 1, None, None, None)
+        assert manager.get_file(1) == path
+        for thread in list(manager._revalidating.values()):
+            thread.join()
+        assert len(rsps.calls) == calls + 1
+        _, validated_at = manager.catalog.get_resolution(_resolution_key(1, None, None, None))
+        assert time.time() - validated_at < 60
+
+        # too stale, validated in place
+        _age(manager, 7200, 1, None, None, None)
+        assert manager.get_file(1) == path
+        assert not manager._revalidating
+        assert len(rsps.calls) == calls + 2
+
+    def test_file_removed(self, rsps):
+        manager = DispatchManager('repo', ttl=60)
+        path = manager.get_file(1)
+        manager.delete_model(1)
+        calls = len(rsps.calls)
+        assert manager.get_file(1) == path
+        assert len(rsps.calls) == calls + 2
+
+    def test_not_validated_when_offline(self, rsps):
+        manager = DispatchManager('repo', ttl=60)
+        path = manager.get_file(1)
+        _age(manager, 120, 1, None, None, None)
+        rsps.replace(responses.GET, 'https://civitai.com/api/v1/models/1', body=requests.exceptions.ConnectionError())
+        assert manager.get_file(1) == path
+        _, validated_at = manager.catalog.get_resolution(_resolution_key(1, None, None, None))
+        assert time.time() - validated_at >= 120
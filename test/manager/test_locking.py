@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+import responses
+
+from pycivitai.manager import DispatchManager
+from pycivitai.utils import DEFAULT_SEGMENTS, download_file
+from ..testings import download_url
+
+_CONTENTS = {
+    'a.safetensors': b'a' * 4096,
+    'b.safetensors': b'b' * 8192,
+}
+
+
+@pytest.fixture()
+def site_models():
+    return [dict(model_id=1, name='Foo Model', versions=[(11, 'v1.0', _CONTENTS)])]
+
+
+@pytest.fixture()
+def manager(rsps):
+    yield DispatchManager('repo'), rsps
+
+
+def _serve_file(rsps, name, on_request):
+    def _callback(request):
+        on_request()
+        content = _CONTENTS[name]
+        return 200, {'Content-Length': str(len(content))}, content
+
+    rsps.remove(responses.GET, download_url(11, name))
+    rsps.add_callback(responses.GET, download_url(11, name), callback=_callback)
+
+
+@pytest.mark.unittest
+class TestManagerLocking:
+    def test_different_files_in_parallel(self, manager):
+        manager, rsps = manager
+        # both downloads must be in progress at the same time, or the barrier will be broken
+        barrier = threading.Barrier(2, timeout=10)
+        for name in _CONTENTS:
+            _serve_file(rsps, name, barrier.wait)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(manager.get_file, 1, None, name) for name in _CONTENTS]
+            paths = [future.result() for future in futures]
+
+        for path, content in zip(paths, _CONTENTS.values()):
+            with open(path, 'rb') as f:
+                assert f.read() == content
+
+    def test_same_file_downloaded_once(self, manager):
+        manager, rsps = manager
+        calls = []
+        _serve_file(rsps, 'a.safetensors', lambda: (calls.append(1), time.sleep(0.5)))
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            paths = list(pool.map(lambda _: manager.get_file(1), range(4)))
+
+        assert len(calls) == 1
+        assert len(set(paths)) == 1
+        with open(paths[0], 'rb') as f:
+            assert f.read() == _CONTENTS['a.safetensors']
+
+    def test_large_file_segmented(self, manager):
+        manager, rsps = manager
+        with patch('pycivitai.manager.version.SEGMENTED_DOWNLOAD_THRESHOLD', 8192), \
+                patch('pycivitai.manager.version.download_file', wraps=download_file) as mocked:
+            paths = [manager.get_file(1, None, name) for name in _CONTENTS]
+        assert [call.kwargs['segments'] for call in mocked.call_args_list] == [1, DEFAULT_SEGMENTS]
+        for path, content in zip(paths, _CONTENTS.values()):
+            with open(path, 'rb') as f:
+                assert f.read() == content
+
+    def test_readers_not_blocked(self, manager):
+        manager, rsps = manager
+        path = manager.get_file(1)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            with manager.lock.read():
+                assert pool.submit(manager.get_file, 1).result(timeout=10) == path
+                assert len(pool.submit(manager.list_models).result(timeout=10)) == 1
+
+                # the writer waits until all the readers are released
+                deleting = pool.submit(manager.delete_model, 1)
+                time.sleep(0.3)
+                assert not deleting.done()
+
+            deleting.result(timeout=10)
+        assert manager.list_models() == []
+
+    def test_hits_not_blocked_by_catalog_writer(self, manager):
+        manager, rsps = manager
+        path = manager.get_file(1)
+        # served from the recorded resolution, without any request
+        fresh_manager = DispatchManager('repo', ttl=60.0)
+        assert fresh_manager.get_file(1) == path
+
+        # another process is writing the catalog, the hits only read it
+        writer = sqlite3.connect(manager.catalog.path, isolation_level=None)
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                futures = [pool.submit(m.get_file, 1) for m in [manager, fresh_manager] * 4]
+                assert [future.result(timeout=10) for future in futures] == [path] * 8
+        finally:
+            writer.execute('ROLLBACK')
+            writer.close()
+
+        # the accesses are kept, and written before the eviction
+        fresh_manager.catalog.flush_accesses()
+        assert len(manager.catalog.list_eviction_candidates()) == 1
+        (access_count,), = manager.catalog._query('SELECT access_count FROM versions')
+        assert access_count == 10
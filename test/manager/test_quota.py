@@ -0,0 +1,109 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from pycivitai.manager import DispatchManager
+
+_SIZE = 4096
+
+
+def _content(version_id):
+    return str(version_id).encode() * (_SIZE // len(str(version_id)))
+
+
+@pytest.fixture()
+def site_models():
+    return [
+        dict(model_id=model_id, name=f'Model {model_id}',
+             versions=[(version_id, f'v{version_id}', {f'{version_id}.safetensors': _content(version_id)})
+                       for version_id in version_ids])
+        for model_id, version_ids in [(1, [13, 12, 11]), (2, [21])]
+    ]
+
+
+def _download_all(manager: DispatchManager):
+    return {
+        version_id: manager.get_file(model_id, version_id)
+        for model_id, version_id in [(1, 11), (1, 12), (1, 13), (2, 21)]
+    }
+
+
+def _touch(manager: DispatchManager, path: str, accessed_at: float, times: int = 1):
+    for _ in range(times):
+        manager.catalog.touch_version(os.path.dirname(os.path.dirname(path)), accessed_at)
+
+
+@pytest.mark.unittest
+class TestManagerQuota:
+    def test_lru(self, rsps):
+        manager = DispatchManager('repo')
+        paths = _download_all(manager)
+        for accessed_at, version_id in enumerate([12, 21, 13, 11]):
+            _touch(manager, paths[version_id], accessed_at)
+
+        assert manager.catalog.disk_usage() == _SIZE * 4
+        # the usage is only queried once, and the evicted versions are subtracted from it
+        with patch.object(manager.catalog, 'disk_usage', wraps=manager.catalog.disk_usage) as disk_usage:
+            evicted, released = manager.enforce_quota(_SIZE * 2)
+        assert disk_usage.call_count == 1
+        assert [os.path.basename(version_dir) for version_dir in evicted] == ['v12__12', 'v21__21']
+        assert released == _SIZE * 2
+        assert not os.path.exists(paths[12])
+        assert os.path.exists(paths[11])
+        assert manager.catalog.disk_usage() == _SIZE * 2
+
+    def test_lfu(self, rsps):
+        manager = DispatchManager('repo', eviction='lfu')
+        paths = _download_all(manager)
+        for accessed_at, (version_id, times) in enumerate([(12, 5), (21, 2), (13, 3), (11, 1)]):
+            _touch(manager, paths[version_id], accessed_at, times)
+
+        evicted, _ = manager.enforce_quota(_SIZE * 2)
+        assert [os.path.basename(version_dir) for version_dir in evicted] == ['v11__11', 'v21__21']
+        evicted, _ = manager.enforce_quota(0, eviction='lru')
+        assert [os.path.basename(version_dir) for version_dir in evicted] == ['v12__12', 'v13__13']
+
+    def test_access_tracked(self, rsps):
+        manager = DispatchManager('repo')
+        paths = _download_all(manager)
+        _touch(manager, paths[11], 0)
+        # the lately used one is evicted last
+        manager.get_file(1, 11)
+        evicted, _ = manager.enforce_quota(_SIZE)
+        assert [os.path.basename(version_dir) for version_dir in evicted] == ['v12__12', 'v13__13', 'v21__21']
+
+    def test_pinned(self, rsps):
+        manager = DispatchManager('repo')
+        paths = _download_all(manager)
+        manager.pin_model('Model 1')
+        assert manager.catalog.is_pinned(os.path.join('repo', 'model_1__alice__1'))
+
+        evicted, released = manager.enforce_quota(0)
+        assert [os.path.basename(version_dir) for version_dir in evicted] == ['v21__21']
+        assert released == _SIZE
+        assert all(os.path.exists(paths[version_id]) for version_id in [11, 12, 13])
+
+        # the pinning is kept after rebuilt
+        manager.rebuild_catalog()
+        assert manager.catalog.is_pinned(os.path.join('repo', 'model_1__alice__1'))
+        manager.unpin_model(1)
+        assert not manager.catalog.is_pinned(os.path.join('repo', 'model_1__alice__1'))
+        evicted, released = manager.enforce_quota(0)
+        assert len(evicted) == 3
+        assert released == _SIZE * 3
+
+    def test_enforced_after_download(self, rsps):
+        manager = DispatchManager('repo', max_size=_SIZE * 2)
+        paths = _download_all(manager)
+        assert manager.catalog.disk_usage() == _SIZE * 2
+        # the file just downloaded is never evicted
+        assert [version_id for version_id, path in paths.items() if os.path.exists(path)] == [13, 21]
+
+    def test_invalid(self, rsps):
+        with pytest.raises(ValueError):
+            DispatchManager('repo', eviction='fifo')
+        with pytest.raises(ValueError):
+            DispatchManager('repo', max_size=_SIZE, use_catalog=False)
+        with pytest.raises(ValueError):
+            DispatchManager('repo', use_catalog=False).enforce_quota(_SIZE)
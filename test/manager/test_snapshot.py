@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import zlib
+
+import pytest
+
+from pycivitai.manager import DispatchManager, LocalFileDuplicated, LocalFileNotFound, LocalModelNotFound, \
+    LocalVersionNotFound
+from ..testings import file_payload
+
+_CONTENTS = {
+    'a.safetensors': b'a' * 4096,
+    'b.vae.pt': b'b' * 2048,
+    'c.safetensors': b'c' * 1024,
+    'd.safetensors': b'd' * 1024,
+}
+
+
+@pytest.fixture()
+def site_models():
+    return [dict(
+        model_id=1, name='Foo Model', creator='Alice_Bob', tags=['foo'],
+        versions=[
+            (12, 'v2.0', {name: _CONTENTS[name] for name in ['c.safetensors', 'd.safetensors']}),
+            (11, 'v1.0', {name: _CONTENTS[name] for name in ['a.safetensors', 'b.vae.pt']}),
+        ],
+    )]
+
+
+@pytest.fixture()
+def repo(rsps):
+    manager = DispatchManager('repo')
+    manager.get_file(1, 'v1.0')
+    manager.get_file(1, 'v1.0', 'b.vae.pt')
+    manager.get_file(1, 'v2.0')
+    yield manager
+
+
+@pytest.fixture(params=[True, False], ids=['catalog', 'scan'])
+def offline_manager(request, repo):
+    return DispatchManager('repo', offline=True, use_catalog=request.param)
+
+
+@pytest.mark.unittest
+class TestManagerSnapshot:
+    def test_trimmed(self, repo):
+        with open(os.path.join('repo', 'foo_model__alice_bob__1', 'v1_0__11', 'metadata.json'), 'rb') as f:
+            snapshot = json.load(f)
+        assert snapshot == {
+            'id': 1, 'name': 'Foo Model', 'creator': {'username': 'Alice_Bob'}, 'tags': ['foo'],
+            'modelVersions': [{
+                'id': 11, 'modelId': 1, 'name': 'v1.0',
+                'files': [
+                    {key: value for key, value in file_payload(11, name, _CONTENTS[name],
+                                                               primary=name == 'a.safetensors').items()
+                     if key != 'metadata'}
+                    for name in ['a.safetensors', 'b.vae.pt']
+                ],
+            }],
+        }
+
+    def test_original_names(self, offline_manager):
+        path = offline_manager.get_file('FooModel', 'V10')
+        assert os.path.basename(path) == 'a.safetensors'
+        assert offline_manager.get_file('foo-model', 11, creator='alice-bob') == path
+        assert offline_manager.get_file('1', 'v1.0') == path
+        assert os.path.basename(offline_manager.get_file(1)) == 'c.safetensors'
+
+        with pytest.raises(LocalModelNotFound):
+            offline_manager.get_file('Foo Model', creator='carol')
+        with pytest.raises(LocalVersionNotFound):
+            offline_manager.get_file('Foo Model', 'v3.0')
+
+    def test_remote_file_list(self, offline_manager):
+        assert os.path.basename(offline_manager.get_file(1, 'v1.0', '*.pt')) == 'b.vae.pt'
+        # d.safetensors is not downloaded, but it is still matched like the online mode does
+        with pytest.raises(LocalFileDuplicated):
+            offline_manager.get_file(1, 'v2.0', '*.safetensors')
+        with pytest.raises(LocalFileNotFound):
+            offline_manager.get_file(1, 'v2.0', 'd.safetensors')
+
+    def test_find_version_id_by_hash(self, offline_manager):
+        sha256 = hashlib.sha256(_CONTENTS['b.vae.pt']).hexdigest()
+        assert offline_manager.find_version_id_by_hash(sha256) == (1, 11, 'b.vae.pt')
+        crc32 = f'{zlib.crc32(_CONTENTS["c.safetensors"]):08x}'
+        assert offline_manager.find_version_id_by_hash(crc32) == (1, 12, 'c.safetensors')
+        assert offline_manager.find_version_id_by_hash('0' * 64) is None
+        assert offline_manager.find_version_id_by_hash('not a hash') is None
+
+    def test_rebuild_catalog(self, repo):
+        repo.rebuild_catalog()
+        manager = DispatchManager('repo', offline=True)
+        assert os.path.basename(manager.get_file('FooModel', 'V10', '*.pt')) == 'b.vae.pt'
+
+    def test_find_snapshots(self, repo):
+        other_dir = os.path.join('repo', 'bar_model__carol__2', 'v1_0__21')
+        repo.catalog.put_snapshot(other_dir, json.dumps({
+            'id': 2, 'name': 'Bar Model', 'creator': {'username': 'carol'}, 'modelVersions': [],
+        }))
+        # only the snapshots of the models which may be matched are loaded
+        assert [os.path.basename(version_dir) for _, version_dir, _ in repo.catalog.find_snapshots('FooModel')] \
+               == ['v1_0__11', 'v2_0__12']
+        assert [os.path.basename(version_dir) for _, version_dir, _ in repo.catalog.find_snapshots('x', 2)] \
+               == ['v1_0__21']
+        assert repo.catalog.find_snapshots('Baz Model') == []
+
+        # renamed on the site after downloaded, the directory keeps the original name
+        version_dir = os.path.join('repo', 'foo_model__alice_bob__1', 'v2_0__12')
+        with open(os.path.join(version_dir, 'metadata.json'), 'r') as f:
+            snapshot = json.load(f)
+        repo.catalog.put_snapshot(version_dir, json.dumps({**snapshot, 'name': 'Foo Model XL'}))
+        manager = DispatchManager('repo', offline=True)
+        assert os.path.basename(manager.get_file('Foo Model XL')) == 'c.safetensors'
+        with pytest.raises(LocalModelNotFound):
+            manager.get_file('Foo Model')
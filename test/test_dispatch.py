@@ -1,10 +1,16 @@
 import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from unittest.mock import patch
 
 import pytest
+import responses
+from hbutils.testing import disable_output
 
 from pycivitai.client import ResourceDuplicated, ModelFoundDuplicated
-from pycivitai.dispatch import civitai_find_online, civitai_download, civitai_search_online
+from pycivitai.dispatch import civitai_find_online, civitai_download, civitai_search_online, civitai_download_many
+from pycivitai.manager import DispatchManager
+from .testings import download_url, mock_site
 
 
 def calculate_sha256(file_path):
@@ -126,3 +132,55 @@ class TestDispatch:
         assert resource.crc32 == '838408E0'
         assert resource.is_primary
         assert resource.size == 3894258133
+
+
+@pytest.fixture()
+def site():
+    models = [
+        dict(model_id=model_id, name=f'Model {model_id}',
+             versions=[(model_id * 10, 'v1.0', {f'model_{model_id}.safetensors': bytes([model_id]) * 4096})])
+        for model_id in (1, 2)
+    ]
+    with mock_site(models) as rsps, disable_output(), \
+            patch('pycivitai.dispatch._get_global_manager', lambda offline: DispatchManager('repo', offline)):
+        rsps.add(responses.GET, 'https://civitai.com/api/v1/models/3', status=404)
+        yield rsps
+
+
+@pytest.mark.unittest
+class TestDispatchDownloadMany:
+    def test_civitai_download_many(self, site):
+        results = civitai_download_many([1, (2, None, '*.safetensors'), 3, {'model': 1}, (1,)], max_workers=2)
+        assert len(results) == 5
+        assert os.path.basename(results[0]) == 'model_1.safetensors'
+        assert os.path.basename(results[1]) == 'model_2.safetensors'
+        assert isinstance(results[2], Exception)
+        assert results[3] == results[4] == results[0]
+
+        download_calls = [call for call in site.calls if '/api/download/' in call.request.url]
+        assert sorted(call.request.url for call in download_calls) == [
+            download_url(10, 'model_1.safetensors'),
+            download_url(20, 'model_2.safetensors'),
+        ]
+
+    def test_civitai_download_many_executor(self, site):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = civitai_download_many([(2, 'v1.0', ['*.safetensors']), (2, 'v1.0', ('*.safetensors',))],
+                                            executor=executor)
+            assert results[0] == results[1]
+            assert os.path.basename(results[0]) == 'model_2.safetensors'
+            assert executor.submit(lambda: 1).result() == 1  # not shut down
+
+    def test_civitai_download_many_process_pool(self, site):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with pytest.raises(TypeError):
+                civitai_download_many([1], executor=executor)
+
+    def test_civitai_download_many_invalid(self, site):
+        assert civitai_download_many([]) == []
+        with pytest.raises(ValueError):
+            civitai_download_many([()])
+        with pytest.raises(ValueError):
+            civitai_download_many([{'version': 'v1.0'}])
+        with pytest.raises(ValueError):
+            civitai_download_many([{'model': 1, 'pattern': '*.pt'}])
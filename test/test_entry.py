@@ -1,4 +1,5 @@
 import os
+import shutil
 from unittest import skipUnless
 from unittest.mock import patch
 
@@ -159,6 +160,23 @@ class TestEntry:
             )
         assert sample_repo.total_size == 25451
 
+    def test_rebuild(self, sample_repo, text_aligner):
+        shutil.rmtree(os.path.join('repo', 'amiya_arknights_old__narugo1992__115427', 'v1_0__124870', 'files'))
+        assert sample_repo.total_size == 25451
+
+        result = simulate_entry(cli, ['cli', 'rebuild'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal(
+            'Catalog rebuilt, 1 model and 1 version found.',
+            result.stdout,
+        )
+        assert sample_repo.total_size == 0
+
     def test_get(self, sample_repo):
         result = simulate_entry(cli, ['cli', 'get', '-m', 'amiya arknights (old)'])
         assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
@@ -197,3 +215,86 @@ class TestEntry:
             result.stdout.strip(),
             os.path.join('repo', 'amiya_arknights_old__narugo1992__115427', 'v1_0__124870', 'files', 'amiya.pt'),
         )
+
+    def test_du(self, sample_repo, text_aligner):
+        result = simulate_entry(cli, ['cli', 'du'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal(
+            'Model amiya_arknights_old(ID: 115427, 1 file, size: 24.854 KiB)\n'
+            '    v1_0(ID: 124870, 1 file, size: 24.854 KiB)\n'
+            'Total 1 model, 1 version and 1 file, size: 24.854 KiB.',
+            result.stdout,
+        )
+
+        result = simulate_entry(cli, ['cli', 'du', '-M'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal(
+            'Model amiya_arknights_old(ID: 115427, 1 file, size: 24.854 KiB)\n'
+            'Total 1 model, 1 version and 1 file, size: 24.854 KiB.',
+            result.stdout,
+        )
+
+    def test_du_empty(self, empty_repo, text_aligner):
+        result = simulate_entry(cli, ['cli', 'du'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal('Total 0 models, 0 versions and 0 files, size: 0.000 b.', result.stdout)
+
+    def test_gc(self, sample_repo, text_aligner):
+        result = simulate_entry(cli, ['cli', 'gc', '-s', '1MiB'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal('0 versions evicted, 0.000 b released.', result.stdout)
+        assert sample_repo.total_size == 25451
+
+        result = simulate_entry(cli, ['cli', 'gc', '-s', '0', '-p', 'lfu'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal('1 version evicted, 24.854 KiB released.', result.stdout)
+        assert sample_repo.total_size == 0
+
+    def test_gc_pinned(self, sample_repo, text_aligner):
+        result = simulate_entry(cli, ['cli', 'pin', '-m', 'amiya arknights (old)'])
+        assert result.exitcode == 0, f'Exitcode - {result.exitcode}\n' \
+                                     f'Stdout:\n' \
+                                     f'{result.stdout}\n' \
+                                     f'\n' \
+                                     f'Stderr:\n' \
+                                     f'{result.stderr}'
+        text_aligner.assert_equal("Model 'amiya arknights (old)' pinned.", result.stdout)
+
+        result = simulate_entry(cli, ['cli', 'gc', '-s', '0'])
+        assert result.exitcode == 0
+        text_aligner.assert_equal('0 versions evicted, 0.000 b released.', result.stdout)
+        assert sample_repo.total_size == 25451
+
+        result = simulate_entry(cli, ['cli', 'unpin', '-m', 'amiya arknights (old)'])
+        assert result.exitcode == 0
+        text_aligner.assert_equal("Model 'amiya arknights (old)' unpinned.", result.stdout)
+
+        result = simulate_entry(cli, ['cli', 'gc', '-s', '0'])
+        assert result.exitcode == 0
+        text_aligner.assert_equal('1 version evicted, 24.854 KiB released.', result.stdout)
+        assert sample_repo.total_size == 0
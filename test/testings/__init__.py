@@ -1,2 +1,3 @@
 from .temporary import LocalTemporaryDirectory
 from .testfile import TESTFILE_DIR, isolated_to_testfile, start_http_server, start_http_server_to_testfile, get_testfile
+from .site import download_url, file_payload, model_payload, mock_site
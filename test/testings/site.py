@@ -0,0 +1,68 @@
+import hashlib
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+import responses
+from hbutils.testing import isolated_directory
+
+from pycivitai.client import configure_metadata_cache
+
+VersionSpecTyping = Tuple[int, str, Dict[str, bytes]]
+
+
+def download_url(version_id: int, filename: str) -> str:
+    return f'https://civitai.com/api/download/{version_id}/{filename}'
+
+
+def file_payload(version_id: int, filename: str, content: bytes, primary: bool = False) -> dict:
+    return {
+        'name': filename, 'primary': primary, 'sizeKB': len(content) / 1024,
+        'downloadUrl': download_url(version_id, filename),
+        'hashes': {'SHA256': hashlib.sha256(content).hexdigest().upper(), 'CRC32': f'{zlib.crc32(content):08X}'},
+        'metadata': {'format': 'SafeTensor'},
+    }
+
+
+def model_payload(model_id: int, name: str, versions: List[VersionSpecTyping], creator: str = 'alice',
+                  tags: Iterable[str] = ()) -> dict:
+    """
+    Payload of model API, ``versions`` are ``(version_id, version_name, {filename: content})``,
+    and the first file of each version is the primary one.
+    """
+    return {
+        'id': model_id, 'name': name, 'creator': {'username': creator, 'image': 'x.png'}, 'tags': list(tags),
+        'description': f'<p>{name}</p>', 'stats': {'downloadCount': 100},
+        'modelVersions': [
+            {
+                'id': version_id, 'modelId': model_id, 'name': version_name, 'images': [{'url': 'x.png'}],
+                'files': [
+                    file_payload(version_id, filename, content, primary=i == 0)
+                    for i, (filename, content) in enumerate(files.items())
+                ],
+            } for version_id, version_name, files in versions
+        ],
+    }
+
+
+@contextmanager
+def mock_site(models: Iterable[dict]):
+    """
+    Serve the models and their files in an isolated directory, with metadata cache disabled.
+
+    :param models: Keyword arguments of :func:`model_payload`.
+    """
+    configure_metadata_cache(enabled=False)
+    try:
+        with isolated_directory():
+            with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+                for model in models:
+                    rsps.add(responses.GET, f'https://civitai.com/api/v1/models/{model["model_id"]}',
+                             json=model_payload(**model))
+                    for version_id, _, files in model['versions']:
+                        for filename, content in files.items():
+                            rsps.add(responses.GET, download_url(version_id, filename), body=content,
+                                     headers={'Content-Length': str(len(content))})
+                yield rsps
+    finally:
+        configure_metadata_cache()
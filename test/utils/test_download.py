@@ -1,11 +1,16 @@
+import gzip
 import os.path
 import pathlib
+import threading
 from hashlib import sha256
+from unittest.mock import patch
 
 import pytest
-from hbutils.testing import disable_output
+import responses
+from hbutils.testing import disable_output, isolated_directory
 
-from pycivitai.utils import download_file
+from pycivitai.utils import download_file, FileHasher, AggregatedProgress
+from pycivitai.utils.download import _DownloadState, _split_ranges
 from ..testings import isolated_to_testfile
 
 
@@ -30,3 +35,229 @@ class TestUtilsDownload:
 
             assert os.path.getsize('nian_skin.png') == 3832280
             assert sha.hexdigest() == '3333af134d03375958b54d88193dcddfad3a0dd3135bbfd3a6c0988938049073'
+
+
+def _range_callback(content: bytes, accept_ranges: bool = True):
+    def _callback(request):
+        headers = {'Accept-Ranges': 'bytes'} if accept_ranges else {}
+        range_ = request.headers.get('Range')
+        if accept_ranges and range_:
+            start, end = map(int, range_[len('bytes='):].split('-'))
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+            headers['Content-Length'] = str(end + 1 - start)
+            return 206, headers, content[start:end + 1]
+        else:
+            headers['Content-Length'] = str(len(content))
+            return 200, headers, content
+
+    return _callback
+
+
+@pytest.fixture()
+def random_content():
+    return os.urandom(100 * 1024 + 17)
+
+
+@pytest.mark.unittest
+class TestUtilsDownloadSegments:
+    @pytest.mark.parametrize(['accept_ranges'], [(True,), (False,)])
+    def test_download_file_segments(self, random_content, accept_ranges):
+        with responses.RequestsMock() as rsps, isolated_directory(), \
+                patch('pycivitai.utils.download.MIN_SEGMENT_SIZE', 1024), disable_output():
+            rsps.add(responses.GET, 'https://civitai.com/api/download/models/1', status=302,
+                     headers={'Location': 'https://cdn.example.com/model.bin'})
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_range_callback(random_content, accept_ranges))
+
+            download_file('https://civitai.com/api/download/models/1', 'model.bin', segments=4)
+            assert pathlib.Path('model.bin').read_bytes() == random_content
+            assert len(rsps.calls) == (6 if accept_ranges else 2)
+            assert all(call.request.url == 'https://cdn.example.com/model.bin' for call in rsps.calls[2:])
+
+
+def _resumable_callback(content: bytes, etag: str):
+    def _callback(request):
+        headers = {'Accept-Ranges': 'bytes', 'ETag': etag}
+        range_, if_range = request.headers.get('Range'), request.headers.get('If-Range')
+        if range_ and (if_range is None or if_range == etag):
+            start, end = map(int, range_[len('bytes='):].split('-'))
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+            headers['Content-Length'] = str(end + 1 - start)
+            return 206, headers, content[start:end + 1]
+        else:
+            headers['Content-Length'] = str(len(content))
+            return 200, headers, content
+
+    return _callback
+
+
+def _make_partial(filename, content: bytes, done: int, identity, validator):
+    with open(filename, 'wb') as f:
+        f.write(content[:done])
+        f.truncate(len(content))
+    _DownloadState(f'{filename}.progress', len(content), identity, validator,
+                   [[0, len(content) - 1, done]]).save()
+
+
+@pytest.mark.unittest
+class TestUtilsDownloadResume:
+    def test_download_file_resume(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_resumable_callback(random_content, '"v1"'))
+            _make_partial('model.bin.part', random_content, 40000, 'SHA', '"v1"')
+
+            download_file('https://cdn.example.com/model.bin', 'model.bin.part', resume=True, identity='SHA')
+            assert pathlib.Path('model.bin.part').read_bytes() == random_content
+            assert not os.path.exists('model.bin.part.progress')
+            assert len(rsps.calls) == 1
+            assert rsps.calls[0].request.headers['Range'] == f'bytes=40000-{len(random_content) - 1}'
+
+    def test_download_file_resume_upstream_changed(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_resumable_callback(random_content, '"v2"'))
+            _make_partial('model.bin.part', os.urandom(len(random_content)), 40000, 'SHA', '"v1"')
+
+            download_file('https://cdn.example.com/model.bin', 'model.bin.part', resume=True, identity='SHA')
+            assert pathlib.Path('model.bin.part').read_bytes() == random_content
+            assert len(rsps.calls) == 1
+
+    def test_download_file_resume_identity_changed(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_resumable_callback(random_content, '"v1"'))
+            _make_partial('model.bin.part', os.urandom(len(random_content)), 40000, 'OLD_SHA', '"v1"')
+
+            download_file('https://cdn.example.com/model.bin', 'model.bin.part', resume=True, identity='SHA')
+            assert pathlib.Path('model.bin.part').read_bytes() == random_content
+            assert len(rsps.calls) == 1
+            assert 'Range' not in rsps.calls[0].request.headers
+
+
+@pytest.mark.unittest
+class TestUtilsDownloadHashing:
+    @pytest.mark.parametrize(['segments'], [(1,), (4,)])
+    def test_download_file_hasher(self, random_content, segments):
+        with responses.RequestsMock() as rsps, isolated_directory(), \
+                patch('pycivitai.utils.download.MIN_SEGMENT_SIZE', 1024), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_range_callback(random_content))
+
+            hasher = FileHasher(use_blake3=False)
+            read_back = []
+            update_from_file = FileHasher.update_from_file
+
+            def _update_from_file(self_, filename, start=0, end=None, **kwargs):
+                read_back.append((end if end is not None else os.path.getsize(filename)) - start)
+                return update_from_file(self_, filename, start, end, **kwargs)
+
+            with patch.object(FileHasher, 'update_from_file', _update_from_file):
+                download_file('https://cdn.example.com/model.bin', 'model.bin', segments=segments, hasher=hasher)
+            assert hasher.hexdigests['SHA256'] == sha256(random_content).hexdigest().upper()
+            if segments == 1:
+                assert len(rsps.calls) == 1
+                # hashed while received, never read back
+                assert sum(read_back) == 0
+            else:
+                assert len(rsps.calls) == segments + 1
+                # the first range is always hashed inline, only the written parts of the later ones are read back
+                assert sum(read_back) <= len(random_content) - _split_ranges(len(random_content), segments)[0][1] - 1
+
+    def test_download_file_hasher_resume(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_resumable_callback(random_content, '"v1"'))
+            _make_partial('model.bin.part', random_content, 40000, 'SHA', '"v1"')
+
+            hasher = FileHasher(use_blake3=False)
+            download_file('https://cdn.example.com/model.bin', 'model.bin.part', resume=True, identity='SHA',
+                          hasher=hasher)
+            assert hasher.hexdigests['SHA256'] == sha256(random_content).hexdigest().upper()
+
+    def test_download_file_hasher_resume_segments(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_resumable_callback(random_content, '"v1"'))
+            size = len(random_content)
+            ranges = [[0, 29999, 20000], [30000, 59999, 60000], [60000, size - 1, 70000]]
+            with open('model.bin.part', 'wb') as f:
+                f.truncate(size)
+                for start, _, offset in ranges:
+                    f.seek(start)
+                    f.write(random_content[start:offset])
+            _DownloadState('model.bin.part.progress', size, 'SHA', '"v1"', ranges).save()
+
+            hasher = FileHasher(use_blake3=False)
+            download_file('https://cdn.example.com/model.bin', 'model.bin.part', resume=True, identity='SHA',
+                          hasher=hasher)
+            assert pathlib.Path('model.bin.part').read_bytes() == random_content
+            assert hasher.hexdigests['SHA256'] == sha256(random_content).hexdigest().upper()
+            assert len(rsps.calls) == 2
+
+
+@pytest.mark.unittest
+class TestUtilsDownloadReceive:
+    def test_download_file_gzip(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output():
+            rsps.add(responses.GET, 'https://cdn.example.com/model.json', body=gzip.compress(random_content),
+                     headers={'Content-Encoding': 'gzip'})
+            download_file('https://cdn.example.com/model.json', 'model.json')
+            assert pathlib.Path('model.json').read_bytes() == random_content
+
+    def test_download_file_writer_failed(self):
+        content = os.urandom(4 * 1024 ** 2)
+        errors = []
+
+        def _download():
+            try:
+                download_file('https://cdn.example.com/model.bin', 'model.bin')
+            except BaseException as err:
+                errors.append(err)
+
+        with responses.RequestsMock() as rsps, isolated_directory(), disable_output(), \
+                patch('os.open', side_effect=PermissionError('denied')):
+            rsps.add(responses.GET, 'https://cdn.example.com/model.bin', body=content)
+            thread = threading.Thread(target=_download, daemon=True)
+            thread.start()
+            thread.join(timeout=30)
+            assert not thread.is_alive()
+            assert len(errors) == 1 and isinstance(errors[0], PermissionError)
+
+    @pytest.mark.skipif(not hasattr(os, 'posix_fadvise'), reason='posix_fadvise not supported')
+    def test_download_file_drop_cache(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), \
+                patch('pycivitai.utils.download.DROP_CACHE_INTERVAL', 4096), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_range_callback(random_content))
+            download_file('https://cdn.example.com/model.bin', 'model.bin', drop_cache=True)
+            assert pathlib.Path('model.bin').read_bytes() == random_content
+
+
+@pytest.mark.unittest
+class TestUtilsDownloadAggregated:
+    def test_download_file_aggregated(self, random_content):
+        with responses.RequestsMock() as rsps, isolated_directory(), \
+                patch('pycivitai.utils.download.MIN_SEGMENT_SIZE', 1024), disable_output():
+            rsps.add_callback(responses.GET, 'https://cdn.example.com/model.bin',
+                              callback=_range_callback(random_content))
+
+            with AggregatedProgress(2) as progress:
+                def _download(filename, segments):
+                    with progress.attach():
+                        download_file('https://cdn.example.com/model.bin', filename, segments=segments)
+                    progress.finish_item()
+
+                threads = [threading.Thread(target=_download, args=('model_1.bin', 1)),
+                           threading.Thread(target=_download, args=('model_2.bin', 4))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                assert progress._pbar.total == 2 * len(random_content)
+                assert progress._pbar.n == 2 * len(random_content)
+                assert progress._finished == 2
+
+            assert pathlib.Path('model_1.bin').read_bytes() == random_content
+            assert pathlib.Path('model_2.bin').read_bytes() == random_content
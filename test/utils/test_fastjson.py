@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+import pytest
+
+from pycivitai.utils import fastjson
+from pycivitai.utils.fastjson import json_loads, json_dumps
+
+
+@pytest.fixture(params=[True, False], ids=['default', 'stdlib'])
+def json_backend(request):
+    if request.param:
+        yield
+    else:
+        with patch.object(fastjson, 'orjson', None):
+            yield
+
+
+@pytest.mark.unittest
+class TestUtilsFastjson:
+    def test_round_trip(self, json_backend):
+        obj = {'id': 1, 'name': 'ケルシー', 'files': [{'sizeKB': 1.5, 'primary': True, 'hashes': None}]}
+        data = json_dumps(obj)
+        assert isinstance(data, bytes)
+        assert json_loads(data) == obj
+        assert json_loads(data.decode('utf-8')) == obj
+        assert json_loads(memoryview(data)) == obj
+
+    def test_invalid(self, json_backend):
+        with pytest.raises(ValueError):
+            json_loads(b'{"id": 1')
@@ -0,0 +1,49 @@
+import hashlib
+import os
+import zlib
+
+import pytest
+from hbutils.testing import isolated_directory
+
+from pycivitai.utils import FileHasher, HashMismatch
+
+
+@pytest.fixture()
+def random_content():
+    return os.urandom(3 * 1024 * 1024 + 7)
+
+
+@pytest.mark.unittest
+class TestUtilsHashing:
+    def test_hexdigests(self, random_content):
+        hasher = FileHasher(use_blake3=False)
+        for i in range(0, len(random_content), 100000):
+            hasher.update(random_content[i:i + 100000])
+
+        sha256 = hashlib.sha256(random_content).hexdigest().upper()
+        assert hasher.hexdigests == {
+            'SHA256': sha256,
+            'AutoV2': sha256[:10],
+            'CRC32': f'{zlib.crc32(random_content):08X}',
+        }
+        assert hasher.size == len(random_content)
+
+    def test_update_from_file(self, random_content):
+        with isolated_directory():
+            with open('file.bin', 'wb') as f:
+                f.write(random_content)
+
+            hasher = FileHasher(use_blake3=False)
+            hasher.update_from_file('file.bin', 0, 12345)
+            hasher.update_from_file('file.bin', 12345)
+            assert hasher.hexdigests['SHA256'] == hashlib.sha256(random_content).hexdigest().upper()
+
+    def test_verify(self, random_content):
+        hasher = FileHasher(use_blake3=False)
+        hasher.update(random_content)
+        sha256 = hashlib.sha256(random_content).hexdigest()
+
+        hasher.verify({'SHA256': sha256, 'AutoV1': 'ignored', 'BLAKE3': 'ignored'})
+        hasher.verify({})
+        with pytest.raises(HashMismatch):
+            hasher.verify({'SHA256': sha256, 'CRC32': '00000000' if zlib.crc32(random_content) else '00000001'})
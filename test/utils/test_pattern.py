@@ -0,0 +1,32 @@
+import re
+
+import pytest
+
+from pycivitai.utils import compile_pattern
+
+
+@pytest.mark.unittest
+class TestUtilsPattern:
+    def test_glob(self):
+        pattern = compile_pattern('*.safetensors')
+        assert compile_pattern('*.safetensors') is pattern
+        assert pattern.match('foo.safetensors')
+        assert not pattern.match('foo.safetensors.bak')
+        assert not pattern.match('foo.pt')
+        assert pattern.filter(['a.pt', 'b.safetensors', 'c.safetensors']) == ['b.safetensors', 'c.safetensors']
+
+    def test_globs(self):
+        pattern = compile_pattern(['*.pt', '*pruned*'])
+        assert compile_pattern(('*.pt', '*pruned*')) is pattern
+        assert pattern.filter(['a.pt', 'b-pruned.safetensors', 'c.safetensors']) == ['a.pt', 'b-pruned.safetensors']
+        assert compile_pattern([]).filter(['a.pt']) == []
+
+    def test_regex(self):
+        pattern = compile_pattern(re.compile(r'.*_v\d+\.safetensors'))
+        assert pattern.filter(['foo_v1.safetensors', 'foo.safetensors', 'foo_v2.safetensors.bak']) == \
+               ['foo_v1.safetensors']
+
+    @pytest.mark.parametrize(['pattern'], [(1,), (None,), ([1, '*.pt'],)])
+    def test_invalid(self, pattern):
+        with pytest.raises(TypeError):
+            compile_pattern(pattern)
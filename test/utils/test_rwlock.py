@@ -0,0 +1,92 @@
+import os
+import threading
+
+import pytest
+from filelock import Timeout
+
+from pycivitai.utils import ReadWriteLock
+
+
+@pytest.fixture()
+def lock_file(tmp_path):
+    return os.path.join(str(tmp_path), '.lock')
+
+
+def _try_in_thread(lock_file, shared: bool) -> bool:
+    result = []
+
+    def _target():
+        try:
+            with ReadWriteLock(lock_file, timeout=0.1)._locked(shared):
+                result.append(True)
+        except Timeout:
+            result.append(False)
+
+    t = threading.Thread(target=_target)
+    t.start()
+    t.join()
+    return result[0]
+
+
+@pytest.mark.unittest
+class TestUtilsRwlock:
+    def test_shared(self, lock_file):
+        barrier = threading.Barrier(3, timeout=5.0)
+
+        def _reader():
+            with ReadWriteLock(lock_file).read():
+                barrier.wait()  # all the readers are holding the lock at the same time
+
+        threads = [threading.Thread(target=_reader) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not barrier.broken
+
+    def test_writer_excludes(self, lock_file):
+        lock = ReadWriteLock(lock_file)
+        with lock.read():
+            assert _try_in_thread(lock_file, shared=True)
+            assert not _try_in_thread(lock_file, shared=False)
+
+        with lock.write():
+            assert not _try_in_thread(lock_file, shared=True)
+            assert not _try_in_thread(lock_file, shared=False)
+
+        assert _try_in_thread(lock_file, shared=False)
+
+    def test_reentrant(self, lock_file):
+        lock = ReadWriteLock(lock_file)
+        assert not lock.is_locked
+        with lock.read():
+            with lock.read():
+                assert lock.is_locked
+            with lock.write():  # upgrade
+                assert not _try_in_thread(lock_file, shared=True)
+            # downgraded after the writer is released
+            assert _try_in_thread(lock_file, shared=True)
+            assert lock.is_locked
+        assert not lock.is_locked
+
+        with lock:
+            with ReadWriteLock(lock_file).read():
+                assert not _try_in_thread(lock_file, shared=True)
+            assert not _try_in_thread(lock_file, shared=True)
+        assert not lock.is_locked
+
+    def test_timeout(self, lock_file):
+        errors = []
+
+        def _target():
+            try:
+                ReadWriteLock(lock_file, timeout=0.1).acquire(shared=True)
+            except Timeout as err:
+                errors.append(err)
+
+        with ReadWriteLock(lock_file).write():
+            t = threading.Thread(target=_target)
+            t.start()
+            t.join()
+
+        assert len(errors) == 1